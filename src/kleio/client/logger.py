@@ -8,28 +8,198 @@
    :synopsis: Provides functions for communicating with `kleio.core`.
 
 """
+import atexit
+import datetime
 import io
+import mmap
 import pickle
 import os
 import logging
 import pprint
+import queue
+import shutil
+import tempfile
+import threading
+
+import numpy
 
 
 python_logger = logging.getLogger(__name__)
 
 
+class AsyncWriter(object):
+    """Run writes of a trial in background threads
+
+    Each of the `workers` threads serves its own queue of at most `queue_size` writes. When a
+    queue is full, `submit` blocks until a write is done, so that a training loop cannot run
+    ahead of the database indefinitely. Writes of the same kind, ex: statistics, always go to
+    the same thread so that they are saved in the order they were submitted.
+
+    Errors raised by a write are raised again by the next call to `submit` or `flush`.
+    """
+
+    def __init__(self, queue_size=64, workers=1):
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._kinds = {}
+        self._error = None
+        self._threads = []
+        for tasks in self._queues:
+            thread = threading.Thread(target=self._work, args=(tasks, ), name="kleio-writer",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self, tasks):
+        while True:
+            task = tasks.get()
+            try:
+                if task is None:
+                    return
+
+                function, args, kwargs = task
+                function(*args, **kwargs)
+            except BaseException as e:  # pylint: disable=broad-except
+                python_logger.error("Asynchronous write failed: {}".format(e))
+                if self._error is None:
+                    self._error = e
+            finally:
+                tasks.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Asynchronous write failed") from error
+
+    def submit(self, kind, function, *args, **kwargs):
+        """Queue `function(*args, **kwargs)`, blocking while the queue is full"""
+        self._raise_error()
+        if not self._threads:
+            raise RuntimeError("Cannot submit writes after the writer is closed")
+
+        if kind not in self._kinds:
+            self._kinds[kind] = self._queues[len(self._kinds) % len(self._queues)]
+        self._kinds[kind].put((function, args, kwargs))
+
+    def flush(self):
+        """Wait for all queued writes to be done"""
+        for tasks in self._queues:
+            tasks.join()
+
+        self._raise_error()
+
+    def close(self):
+        """Wait for all queued writes and stop the threads"""
+        threads, self._threads = self._threads, []
+        if not threads:
+            return
+
+        for tasks in self._queues:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+        self._raise_error()
+
+
+def _copy_artifact(artifact, max_size=None):
+    """Copy the rest of a file in memory, or on disk above `max_size` bytes
+
+    :raises: :exc:`ValueError`: if the file is closed.
+
+    """
+    if getattr(artifact, 'closed', False):
+        raise ValueError("Cannot log a closed file")
+
+    max_size = KLEIO_ASYNC_SPOOL_SIZE if max_size is None else max_size
+    artifact_copy = tempfile.SpooledTemporaryFile(max_size=max_size)
+    shutil.copyfileobj(artifact, artifact_copy)
+    artifact_copy.seek(0)
+
+    return artifact_copy
+
+
 class Logger(object):
-    def __init__(self):
-        self.trial = TrialNode.load(KLEIO_TRIAL_ID)
+    """Log statistics and artifacts of the trial executed by kleio
+
+    With `enable_async()` or the environment variable `KLEIO_ASYNC_LOGGING=1`, statistics and
+    artifacts are written in background threads. Artifacts are copied before being queued, so
+    that they can be modified or closed right away. Queued writes are flushed when leaving a
+    `with` block and at exit.
+    """
+
+    def __init__(self, trial_id=None):
+        trial_id = trial_id if trial_id else KLEIO_TRIAL_ID
+        self.trial = TrialNode.load(trial_id)
         if self.trial is None:
             raise RuntimeWarning(
-                "Trial with id '{}' could not be found in database".format(KLEIO_TRIAL_ID))
+                "Trial with id '{}' could not be found in database".format(trial_id))
+
+        if KLEIO_COLUMNAR_STATISTICS:
+            self.trial.use_columnar_statistics()
+
+        self._writer = None
+        if KLEIO_ASYNC_LOGGING:
+            self.enable_async(KLEIO_ASYNC_QUEUE_SIZE)
+
+    def enable_async(self, queue_size=64, workers=1):
+        """Write statistics and artifacts in background threads"""
+        if self._writer is not None:
+            return
+
+        self._writer = AsyncWriter(queue_size, workers)
+        atexit.register(self._flush_at_exit)
+
+    def _flush_at_exit(self):
+        try:
+            self.close()
+        except RuntimeError as e:
+            python_logger.error(str(e.__cause__ if e.__cause__ else e))
 
     def log_statistic(self, **statistics):
-        self.trial.add_statistic(**statistics)
+        if self._writer is None:
+            self.trial.add_statistic(**statistics)
+            return
+
+        # Statistics are timestamped when logged, not when written
+        statistics.setdefault('timestamp', datetime.datetime.utcnow())
+        self._writer.submit('statistics', self.trial.add_statistic, **statistics)
 
     def log_artifact(self, filename, artifact, backup_path='.', **attributes):
-        self.trial.add_artifact(filename, artifact, **attributes)
+        if self._writer is None:
+            self.trial.add_artifact(filename, artifact, **attributes)
+            return
+
+        # The caller may modify or close the file as soon as we return
+        artifact = _copy_artifact(artifact)
+        self._writer.submit('artifacts', self._add_copied_artifact, filename, artifact,
+                            **attributes)
+
+    def _add_copied_artifact(self, filename, artifact, **attributes):
+        try:
+            self.trial.add_artifact(filename, artifact, **attributes)
+        finally:
+            artifact.close()
+
+    def flush(self):
+        """Wait for queued writes and write buffered statistics"""
+        if self._writer is not None:
+            self._writer.flush()
+
+        self.trial.flush()
+
+    def close(self):
+        """Flush and stop writing in background threads"""
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+        self.trial.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
 
     def load_statistic(self, query):
         if isinstance(query, str):
@@ -54,10 +224,7 @@ class Logger(object):
 
 class AnalyzeLogger(Logger):
     def __init__(self, trial_id):
-        self.trial = TrialNode.load(trial_id)
-        if self.trial is None:
-            raise RuntimeWarning(
-                "Trial with id '{}' could not be found in database".format(trial_id))
+        super().__init__(trial_id)
 
     def insert_statistic(self, timestamp, **statistics):
         statistics.setdefault('tags', ";".join(kleio_logger.trial.tags))
@@ -147,9 +314,27 @@ class BackupLogger(object):
 
 
 class RemoteFileWrapper(object):
+    """Read an artifact without copying it in memory when possible
+
+    Artifacts saved in the artifact directory can be memory-mapped with `mmap()`, read by
+    ranges with `read_range()`, streamed into caller buffers with `readinto()` and, for NumPy
+    files, loaded with `load_numpy(mmap_mode='r')`. `download()` copies the whole artifact in a
+    `BytesIO` and should only be used for small artifacts.
+    """
+
     def __init__(self, remote_file, chunk_size=255 * 1024):
         self.remote_file = remote_file
         self.chunk_size = chunk_size
+        self._mmap = None
+
+    @property
+    def path(self):
+        """Path of the artifact on the file system, None if it is not a local file"""
+        name = getattr(self.remote_file, 'name', None)
+        if isinstance(name, str) and os.path.exists(name):
+            return name
+
+        return None
 
     def readchunk(self):
         if self.remote_file.closed:
@@ -157,6 +342,43 @@ class RemoteFileWrapper(object):
 
         return self.remote_file.read(self.chunk_size)
 
+    def readinto(self, buffer):
+        """Read bytes into a pre-allocated writable buffer, return the number of bytes read"""
+        return self.remote_file.readinto(buffer)
+
+    def read_range(self, offset, size):
+        """Read `size` bytes starting at `offset` without moving the position of the file"""
+        try:
+            return os.pread(self.remote_file.fileno(), size, offset)
+        except (AttributeError, io.UnsupportedOperation):
+            position = self.remote_file.tell()
+            try:
+                self.remote_file.seek(offset)
+                return self.remote_file.read(size)
+            finally:
+                self.remote_file.seek(position)
+
+    def mmap(self):
+        """Return a read-only memory map of the artifact
+
+        Pages are loaded by the operating system on access, so that large artifacts are not
+        copied in memory. The map is closed with the wrapper.
+        """
+        if self._mmap is None:
+            if os.fstat(self.remote_file.fileno()).st_size == 0:
+                return memoryview(b'')
+
+            self._mmap = mmap.mmap(self.remote_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._mmap
+
+    def load_numpy(self, mmap_mode='r'):
+        """Load a `.npy` artifact, memory-mapped from the artifact directory when possible"""
+        if self.path is not None:
+            return numpy.load(self.path, mmap_mode=mmap_mode)
+
+        return numpy.load(self.download())
+
     def download(self):
         b = io.BytesIO()
         chunk = self.readchunk()
@@ -168,10 +390,30 @@ class RemoteFileWrapper(object):
 
         return b
 
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+        self.remote_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 
 KLEIO_IS_ON = False
 KLEIO_TRIAL_ID = os.getenv('KLEIO_TRIAL_ID', None)
 KLEIO_VERBOSITY = int(os.getenv('KLEIO_VERBOSITY', 0))
+# Store numeric statistics as chunked arrays rather than one document per call
+KLEIO_COLUMNAR_STATISTICS = bool(int(os.getenv('KLEIO_COLUMNAR_STATISTICS', 0)))
+# Write statistics and artifacts in background threads
+KLEIO_ASYNC_LOGGING = bool(int(os.getenv('KLEIO_ASYNC_LOGGING', 0)))
+KLEIO_ASYNC_QUEUE_SIZE = int(os.getenv('KLEIO_ASYNC_QUEUE_SIZE', 64))
+# Artifacts logged asynchronously are copied in memory up to this size, on disk above it
+KLEIO_ASYNC_SPOOL_SIZE = int(os.getenv('KLEIO_ASYNC_SPOOL_SIZE', 2 ** 20))
 trial = None
 flatten = None
 unflatten = None
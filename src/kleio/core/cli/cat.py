@@ -1,9 +1,26 @@
 import argparse
+import datetime
+import sys
 
 from kleio.core.cli.base import get_trial_from_short_id
 from kleio.core.io.trial_builder import TrialBuilder
 from kleio.core.evc.trial_node import TrialNode
-from kleio.core.wrapper import Consumer
+
+
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f',
+                     '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def timestamp(value):
+    """Parse a UTC timestamp given on command line"""
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, timestamp_format)
+        except ValueError:
+            pass
+
+    raise argparse.ArgumentTypeError(
+        "Invalid timestamp '{}', expected format is YYYY-MM-DD[ HH:MM:SS[.ffffff]]".format(value))
 
 
 def add_subparser(parser):
@@ -16,16 +33,43 @@ def add_subparser(parser):
     cat_parser.add_argument(
         '--stderr', action="store_true", help="Print the stderr as well.")
 
+    lines_group = cat_parser.add_mutually_exclusive_group()
+
+    lines_group.add_argument(
+        '--head', type=int, metavar='N', help="Print only the first N lines.")
+
+    lines_group.add_argument(
+        '--tail', type=int, metavar='N', help="Print only the last N lines.")
+
+    cat_parser.add_argument(
+        '--since', type=timestamp, metavar='TIMESTAMP',
+        help="Print only lines logged after the given UTC timestamp.")
+
     cat_parser.set_defaults(func=main)
 
     return cat_parser
 
 
+def write(trial, name, head=None, tail=None, since=None, stream=None):
+    """Write the lines of the trial and its ancestors page by page"""
+    stream = stream if stream is not None else sys.stdout
+    if tail is not None:
+        # Only the last `tail` lines are kept in memory
+        pages = list(trial.iter_logs(name, since=since, reverse=True, limit=tail))
+        pages = [page[::-1] for page in reversed(pages)]
+    else:
+        pages = trial.iter_logs(name, since=since, limit=head)
+
+    for lines in pages:
+        stream.write("\n".join(lines) + "\n")
+
+
 def main(args):
     TrialBuilder().build_database(args)
     trial = TrialNode.view(get_trial_from_short_id(args, args.pop('id'))['_id'])
-    print('\n'.join(trial.stdout))
+    options = dict(head=args.get('head'), tail=args.get('tail'), since=args.get('since'))
+    write(trial, 'stdout', **options)
 
     if args.get('stderr'):
         print()
-        print('\n'.join(trial.stderr))
+        write(trial, 'stderr', **options)
@@ -0,0 +1,57 @@
+from kleio.core.cli.base import get_trial_from_short_id
+from kleio.core.io.trial_builder import TrialBuilder
+from kleio.core.trial.base import Trial
+
+
+def add_subparser(parser):
+    """Return the parser that needs to be used for this command"""
+    compact_parser = parser.add_parser('compact', help='compact help')
+
+    compact_parser.add_argument(
+        'ids', nargs='*', help="id[s] of the trials. Default is all trials matching the tags.")
+
+    compact_parser.add_argument(
+        '--tags', default="",
+        help=('Tags for the trials, separated with `;`'))
+
+    compact_parser.add_argument(
+        '--attributes', default="status;tags",
+        help=('Attributes to compact, separated with `;`. Can be any of {}. '
+              'Default is status;tags'.format(", ".join(Trial.compactable_attributes))))
+
+    compact_parser.add_argument(
+        '--prune', action='store_true',
+        help=('Delete events folded in snapshots. Views of the trial before the snapshot '
+              '(ex: parents of branches) will only be able to use older snapshots.'))
+
+    compact_parser.set_defaults(func=main)
+
+    return compact_parser
+
+
+def main(args):
+    database = TrialBuilder().build_database(args)
+    attributes = [attribute for attribute in args.pop('attributes').split(";") if attribute]
+    tags = [tag for tag in args.pop('tags', "").split(";") if tag]
+
+    trial_ids = [get_trial_from_short_id(args, trial_id)['_id'] for trial_id in args.pop('ids')]
+
+    if not trial_ids:
+        query = {
+            'tags': {'$all': tags},
+            }
+
+        if not tags:
+            query.pop('tags')
+
+        trial_ids = [trial['_id'] for trial
+                     in database.read(Trial.trial_report_collection, query, {'_id': 1})]
+
+    for trial_id in trial_ids:
+        trial = Trial.load(trial_id)
+        if trial is None:
+            print("ERROR: Trial {} not found".format(trial_id[:7]))
+            continue
+
+        trial.compact(attributes, prune=args['prune'])
+        print("Trial {trial.short_id} compacted".format(trial=trial))
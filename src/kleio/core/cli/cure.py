@@ -7,7 +7,6 @@ from kleio.core.io.trial_builder import TrialBuilder
 from kleio.core.trial import status
 from kleio.core.trial.attribute import EventBasedItemAttributeWithDB
 from kleio.core.trial.base import Trial
-from kleio.core.wrapper import Consumer
 
 
 def add_subparser(parser):
@@ -24,7 +23,8 @@ def add_subparser(parser):
 
     cure_parser.add_argument(
         '--threshold-coefficient', default=10, type=float,
-        help=('Trials are considered dead if last heartbeat is older than '
+        help=('Trials are considered dead once their lease expired. Trials executed before '
+              'leases existed are considered dead if their last status change is older than '
               'threshold-coefficient times the hearthbeat rate'))
 
     cure_parser.add_argument(
@@ -46,27 +46,36 @@ STATUS = [
     'broken', 'branched']
  
 
-def failover(trial_id, status, timestamp, threshold_coefficient, trial=None, print_only=False):
-    # TODO: Get rid of magical number (10). It should be a config in kleio.
-    heartbeat_rate = 10
-    threshold = heartbeat_rate * threshold_coefficient
-    if status == 'running' and (datetime.datetime.utcnow() - timestamp).seconds > threshold:
-        if print_only:
-            print("Turning {} to failover".format(trial_id[:7]))
-            return
+def failover(trial_id, trial=None, print_only=False):
+    if print_only:
+        print("Turning {} to failover".format(trial_id[:7]))
+        return
 
-        if trial is None:
-            trial = Trial.load(trial_id)
+    if trial is None:
+        trial = Trial.load(trial_id)
 
-        if trial is None:
-            print("ERROR: Trial {} not found".format(trial_id[:7]))
-            return
+    if trial is None:
+        print("ERROR: Trial {} not found".format(trial_id[:7]))
+        return
 
-        trial.failover()
-        trial.save()
-        return True
+    trial.failover()
+    trial.save()
 
-    return False
+
+def is_dead(trial_id, status, last_seen, leased, expired, threshold_coefficient, now):
+    """Whether a trial with the given status is not running anymore
+
+    Trials with a lease are dead once it expired. Trials executed before leases existed are
+    dead if `last_seen` is older than `threshold_coefficient` heartbeats.
+    """
+    if status != 'running':
+        return False
+
+    if trial_id in leased:
+        return trial_id in expired
+
+    threshold = Trial.heartbeat_rate * threshold_coefficient
+    return (now - last_seen).total_seconds() > threshold
 
 
 def get_reports(database, query):
@@ -84,34 +93,51 @@ def get_reports(database, query):
 beginning_of_time = datetime.datetime(1900, 1, 1)
 
 
-def quick_cure(database, query, args):
-    query['registry.status'] = {'$eq': 'running'}
+def get_leased(database, trial_ids):
+    """Return the ids of the trials which have a lease"""
+    query = {'_id': {'$in': list(trial_ids)}}
+    return set(lease['_id']
+               for lease in database.read(Trial.trial_lease_collection, query, {'_id': 1}))
 
-    for trial_id, trial_doc in get_reports(database, query).items():
-        end_time = trial_doc['registry'].get('end_time', beginning_of_time)
-        failover(trial_id, 'running', end_time, args['threshold_coefficient'],
-                 print_only=args['print_only'])
 
+def get_expired(database, now):
+    """Return the ids of the trials whose lease expired, using the index on `expires_at`"""
+    query = {'expires_at': {'$lt': now}}
+    return set(lease['_id']
+               for lease in database.read(Trial.trial_lease_collection, query, {'_id': 1}))
 
-def extensive_cure(database, query, args):
 
-    selection = {
-        '_id': 1,
-        }
+def quick_cure(database, query, args):
+    query['registry.status'] = {'$eq': 'running'}
 
     reports = get_reports(database, query)
+    now = datetime.datetime.utcnow()
+    leased = get_leased(database, reports.keys())
+    expired = get_expired(database, now)
 
-    for trial_doc in database.read(Trial.trial_report_collection, query, selection):
-        # TODO: Get rid of magical number (10). It should be a config in kleio.
-        trial = Trial.load(trial_doc['_id'])
-        trial._status.load()
-        last_event = trial._status.history[-1]
-        if not failover(trial.id, last_event['item'], last_event['runtime_timestamp'],
-                        args['threshold_coefficient'], trial=trial, print_only=args['print_only']):
-            if reports[trial.id]['registry'].get('end_time', beginning_of_time) < trial.end_time:
-                print("Updating {trial.short_id} report".format(trial=trial))
-                trial.update()
-                trial.save()
+    for trial_id, trial_doc in reports.items():
+        # Trials executed before leases existed only have a report
+        last_seen = trial_doc['registry'].get('end_time', beginning_of_time)
+        if is_dead(trial_id, 'running', last_seen, leased, expired,
+                   args['threshold_coefficient'], now):
+            failover(trial_id, print_only=args['print_only'])
+
+
+def extensive_cure(database, query, args):
+    reports = get_reports(database, query)
+    now = datetime.datetime.utcnow()
+    leased = get_leased(database, reports.keys())
+    expired = get_expired(database, now)
+
+    # Statuses of all trials are loaded with a single query
+    for trial in Trial.load_many(reports.keys(), attributes=('status', )):
+        if is_dead(trial.id, trial._status.get(), trial._status.last_timestamp, leased,
+                   expired, args['threshold_coefficient'], now):
+            failover(trial.id, trial=trial, print_only=args['print_only'])
+        elif reports[trial.id]['registry'].get('end_time', beginning_of_time) < trial.end_time:
+            print("Updating {trial.short_id} report".format(trial=trial))
+            trial.update()
+            trial.save()
 
 
 def main(args):
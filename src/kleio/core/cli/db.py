@@ -0,0 +1,45 @@
+from kleio.core.io import schema
+from kleio.core.io.trial_builder import TrialBuilder
+
+
+def add_subparser(parser):
+    """Return the parser that needs to be used for this command"""
+    db_parser = parser.add_parser('db', help='db help')
+    # Sub-commands are optional with argparse, print the help without one
+    db_parser.set_defaults(func=lambda args: db_parser.print_help())
+
+    db_subparsers = db_parser.add_subparsers(help='db sub-command help')
+
+    setup_parser = db_subparsers.add_parser(
+        'setup', help='Create indexes of the database and record the schema version')
+    setup_parser.set_defaults(func=setup)
+
+    verify_parser = db_subparsers.add_parser(
+        'verify', help='Verify that the database matches the schema of kleio')
+    verify_parser.set_defaults(func=verify)
+
+    return db_parser
+
+
+def setup(args):
+    database = TrialBuilder().build_database(args)
+    schema.setup(database)
+    print("Database schema set to version {}".format(schema.SCHEMA_VERSION))
+
+
+def verify(args):
+    database = TrialBuilder().build_database(args)
+    version, missing_indexes = schema.verify(database)
+
+    for collection_name, keys, unique in missing_indexes:
+        print("Missing {}index {} on collection {}".format(
+            "unique " if unique else "", keys, collection_name))
+
+    if version != schema.SCHEMA_VERSION:
+        print("Database schema version is {} but kleio expects version {}".format(
+            version, schema.SCHEMA_VERSION))
+
+    if missing_indexes or version != schema.SCHEMA_VERSION:
+        raise SystemExit("Run `kleio db setup` to update the database.")
+
+    print("Database schema version {} is up to date".format(version))
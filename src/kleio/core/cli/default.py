@@ -11,6 +11,7 @@ from kleio.core.wrapper import Consumer
 from kleio.core.trial import status
 from kleio.core.trial.base import Trial
 from kleio.core.evc.trial_node import TrialNode
+from kleio.core.utils import canonical_digest
 from kleio.core.utils.diff import colored_diff
 import kleio.core.utils.errors
 
@@ -29,6 +30,11 @@ def add_default_subparser(parser, name):
         help=('Capture log output of the executed script. '
               'By default it is printed in terminal.'))
 
+    run_parser.add_argument(
+        '--buffer-logs', action='store_true',
+        help=('Write captured stdout and stderr lines in batches rather than '
+              'one database write per line.'))
+
     run_parser.add_argument(
         '--switch-over', action='store_true',
         help=('Execute trial even if broken.'))
@@ -104,11 +110,14 @@ def sequential_worker(consumer, args):
     print("No more trials executable. Leaving...")
 
 
-def fetch_new_trials(query, trials_seen):
-    for trial in Database().read(Trial.trial_report_collection, query, {'registry.status': 1}):
-        if trial['_id'] not in trials_seen:
-            trial = TrialNode.view(trial['_id'])
-            if trial is None:
+def fetch_new_trials(query, trials_seen, batch_size=100):
+    reports = Database().read(Trial.trial_report_collection, query, {'_id': 1})
+    trial_ids = [report['_id'] for report in reports if report['_id'] not in trials_seen]
+
+    # Trials are viewed by batches, with a few queries per batch rather than per trial
+    for i in range(0, len(trial_ids), batch_size):
+        for trial in TrialNode.view_many(trial_ids[i:i + batch_size]):
+            if trial.id in trials_seen:
                 continue
 
             trials_seen.add(trial.id)
@@ -133,7 +142,9 @@ def process_trial(consumer, trial, host, allow_host_change, allow_version_change
               "process".format(trial.short_id, trial.status))
         return
 
-    if trial.host and trial.host != host and not allow_host_change:
+    # Digests of the trial are computed once, comparing them is cheaper than comparing dicts
+    host_changed = trial.host_digest != canonical_digest(host)
+    if trial.host and host_changed and not allow_host_change:
         print("Skipping {}; different host".format(trial.short_id))
         return
 
@@ -150,16 +161,17 @@ def process_trial(consumer, trial, host, allow_host_change, allow_version_change
 
     version = resolve_config.infer_versioning_metadata(user_script)
 
-    if trial.version and trial.version != version and not allow_version_change:
+    version_changed = trial.version_digest != canonical_digest(version)
+    if trial.version and version_changed and not allow_version_change:
         print("Skipping {}; different code version".format(trial.short_id))
         return
 
     # Branch if there was any allowed change
-    if trial.version != version or trial.host != host:
-        if trial.version != version:
+    if version_changed or host_changed:
+        if version_changed:
             print("Branching {} because of different code version".format(trial.short_id))
 
-        if trial.host != host:
+        if host_changed:
             print("Branching {} because of different host".format(trial.short_id))
 
         parent_node = TrialNode.load(trial.id)
@@ -182,7 +194,7 @@ def process_trial(consumer, trial, host, allow_host_change, allow_version_change
             return
 
         for tag in parent_node.tags:
-            if tag not in trial._tags.get():
+            if tag not in trial._tags:
                 trial._tags.append(tag)
         trial.save()
     else:
@@ -233,7 +245,7 @@ def unique_worker(consumer, args):
         trial.switchover()
 
     for tag in tags:
-        if tag not in trial._tags.get():
+        if tag not in trial._tags:
             trial._tags.append(tag)
         # trial.save()
 
@@ -250,9 +262,10 @@ def unique_worker(consumer, args):
 def default(args):
     root_working_dir = args.pop('root_working_dir', '.')
     capture = args.pop('capture', False)
+    buffer_logs = args.pop('buffer_logs', False)
     debug = args.get('debug', False)
 
-    consumer = Consumer(root_working_dir, capture)
+    consumer = Consumer(root_working_dir, capture, buffer_logs)
 
     if not args['commandline']:
         sequential_worker(consumer, args)
@@ -16,6 +16,11 @@ def add_subparser(parser):
         help=('Capture log output of the executed script. '
               'By default it is printed in terminal.'))
 
+    exec_parser.add_argument(
+        '--buffer-logs', action='store_true',
+        help=('Write captured stdout and stderr lines in batches rather than '
+              'one database write per line.'))
+
     exec_parser.add_argument(
         'id', help="id of the trial. Can be name or hash.")
 
@@ -29,10 +34,11 @@ def add_subparser(parser):
 def main(args):
     root_working_dir = args.pop('root_working_dir', '.')
     capture = args.pop('capture', False)
+    buffer_logs = args.pop('buffer_logs', False)
     debug = args.get('debug', False)
     args['id'] = get_trial_from_short_id(args, args.pop('id'))['_id']
     trial = TrialBuilder().build_from_id(args)
     try:
-        Consumer(root_working_dir, capture).consume(trial)
+        Consumer(root_working_dir, capture, buffer_logs).consume(trial)
     except KeyboardInterrupt as e:
         raise SystemExit()
@@ -0,0 +1,90 @@
+import ast
+
+from kleio.core.io.trial_builder import TrialBuilder
+from kleio.core.trial.base import Trial
+
+
+def add_subparser(parser):
+    """Return the parser that needs to be used for this command"""
+    stats_parser = parser.add_parser('stats', help='stats help')
+
+    stats_parser.add_argument(
+        'keys', nargs='+',
+        help="Statistics to fetch. Nested statistics are accessed with dots, ex: valid.loss")
+
+    stats_parser.add_argument(
+        '--tags', default="",
+        help=('Tag for the trial, separated with `;`'))
+
+    stats_parser.add_argument(
+        '--status', default="",
+        help=('Status of the trials, separated with `;`'))
+
+    stats_parser.add_argument(
+        '--config', action='append', default=[], metavar='KEY=VALUE',
+        help=("Value of the configuration of the trials, ex: --config lr=0.1. "
+              "Can be given many times."))
+
+    stats_parser.add_argument(
+        '--all', action='store_true',
+        help="Print all values instead of the last one.")
+
+    stats_parser.set_defaults(func=main)
+
+    return stats_parser
+
+
+def _parse_value(value):
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def build_query(tags, status, config):
+    """Build a query on the reports of the trials from the arguments of the command"""
+    query = {}
+
+    tags = [tag for tag in tags.split(";") if tag]
+    if tags:
+        query['tags'] = {'$all': tags}
+
+    status = [name for name in status.split(";") if name]
+    if status:
+        query['registry.status'] = {'$in': status}
+
+    for item in config:
+        if "=" not in item:
+            raise SystemExit("Invalid configuration '{}', must be KEY=VALUE".format(item))
+        key, value = item.split("=", 1)
+        query['configuration.' + key] = _parse_value(value)
+
+    return query
+
+
+template = """\
+{short_id} {values}\
+"""
+
+
+def main(args):
+    TrialBuilder().build_database(args)
+    keys = args.pop('keys')
+    query = build_query(args.pop('tags', ""), args.pop('status', ""), args.pop('config', []))
+
+    statistics = Trial.fetch_statistics(query, keys)
+    arrays = dict((key, statistics[key]) for key in keys)
+
+    for i, trial_id in enumerate(statistics.trial_ids):
+        values = []
+        for key in keys:
+            array = arrays[key][i]
+            if args.get('all'):
+                value = array.tolist()
+            elif len(array):
+                value = "{} ({})".format(array[-1], len(array))
+            else:
+                value = None
+            values.append("{}={}".format(key, value))
+
+        print(template.format(short_id=trial_id[:7], values=" ".join(values)))
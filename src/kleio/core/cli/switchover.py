@@ -21,8 +21,8 @@ def add_subparser(parser):
 
 def main(args):
     TrialBuilder().build_database(args)
-    for trial_id in args.pop('ids'):
-        trial = TrialNode.load(get_trial_from_short_id(args, trial_id)['_id'])
+    trial_ids = [get_trial_from_short_id(args, trial_id)['_id'] for trial_id in args.pop('ids')]
+    for trial in TrialNode.load_many(trial_ids):
         try:
             trial.switchover()
         except RuntimeError as e:
@@ -1,10 +1,10 @@
 import argparse
+import sys
 import time
 
 from kleio.core.cli.base import get_trial_from_short_id
 from kleio.core.io.trial_builder import TrialBuilder
 from kleio.core.evc.trial_node import TrialNode
-from kleio.core.wrapper import Consumer
 
 
 def add_subparser(parser):
@@ -23,15 +23,69 @@ def add_subparser(parser):
     return tail_parser
 
 
+# Number of lines printed before following
+N_LINES = 5
+
+# Delays between polls when the database does not support change streams
+MIN_DELAY = 0.5
+MAX_DELAY = 30
+
+
+def last_lines(trial, n_lines=N_LINES):
+    """Return the last lines of stdout, only reading the last pages from the database"""
+    pages = list(trial.iter_logs('stdout', reverse=True, limit=n_lines))
+    return sum((page[::-1] for page in reversed(pages)), [])
+
+
+def follow(trial, min_delay=MIN_DELAY, max_delay=MAX_DELAY):
+    """Print new lines of stdout and stderr until the trial stops running
+
+    Only events following the last sequence number read of each log are fetched. The database
+    is watched with a change stream if supported, otherwise it is polled with a delay doubling
+    when no new lines are produced, from `min_delay` up to `max_delay` seconds.
+    """
+    try:
+        stream = trial.watch()
+    except NotImplementedError:
+        stream = None
+
+    last_seqs = {'stdout': trial.last_log_seq('stdout'), 'stderr': trial.last_log_seq('stderr')}
+    delay = min_delay
+    try:
+        while True:
+            # Only fetches new events of status, logs are never loaded
+            trial.update()
+            new_lines = {'stdout': [], 'stderr': []}
+            for name, lines in new_lines.items():
+                for seq, page in trial.iter_logs_after(name, last_seqs[name]):
+                    last_seqs[name] = seq
+                    lines.extend(page)
+
+            if new_lines['stdout']:
+                print("\n".join(new_lines['stdout']))
+            if new_lines['stderr']:
+                print("\n".join(new_lines['stderr']), file=sys.stderr)
+
+            if trial.status != "running":
+                break
+
+            if new_lines['stdout'] or new_lines['stderr']:
+                delay = min_delay
+            else:
+                delay = min(delay * 2, max_delay)
+
+            if stream is not None:
+                stream.wait(max_delay)
+            else:
+                time.sleep(delay)
+    finally:
+        if stream is not None:
+            stream.close()
+
+
 def main(args):
     TrialBuilder().build_database(args)
     trial = TrialNode.view(get_trial_from_short_id(args, args.pop('id'))['_id'])
-    idx = max(len(trial.stdout) - 5, 0)
-    print("\n".join(trial.stdout[idx:]))
-    while args['follow'] and trial.status == "running":
-        time.sleep(5)
-        idx = len(trial.stdout) + 1
-        trial.update()
-        new_lines = "\n".join(trial.stdout[idx:])
-        if new_lines:
-            print(new_lines)
+    print("\n".join(last_lines(trial)))
+    if args['follow'] and trial.status == "running":
+        follow(trial.item)
@@ -5,7 +5,7 @@ from kleio.core.io import resolve_config
 from kleio.core.io.cmdline_parser import CmdlineParser
 from kleio.core.io.database import Database, DuplicateKeyError
 from kleio.core.trial.attribute import (
-    event_based_property, event_based_diff, EventBasedItemAttribute)
+    event_based_property, event_based_diff, EventBasedItemAttribute, sort_order)
 from kleio.core.trial.base import Trial
 from kleio.core.utils import flatten, unflatten
 import kleio.core.utils.errors
@@ -13,6 +13,37 @@ import kleio.core.utils.errors
 from kleio.core.trial.statistic import Statistics
 
 
+def _get_field(document, key):
+    for name in key.split("."):
+        if not isinstance(document, dict) or name not in document:
+            return None
+        document = document[name]
+
+    return document
+
+
+def _compare_documents(a, b, sort):
+    """Return a positive number if `a` comes before `b` when sorted by the database
+
+    Missing values are the lowest, as in MongoDB.
+    """
+    for key, order in sort:
+        a_value = _get_field(a, key)
+        b_value = _get_field(b, key)
+        if a_value == b_value:
+            continue
+        elif a_value is None:
+            difference = -1
+        elif b_value is None:
+            difference = 1
+        else:
+            difference = -1 if a_value < b_value else 1
+
+        return difference * (1 if order == Database.DESCENDING else -1)
+
+    return 0
+
+
 class TrialNode(TreeNode):
 
     @classmethod
@@ -36,6 +67,18 @@ class TrialNode(TreeNode):
 
         return TrialNode(trial_id, trial)
 
+    @classmethod
+    def load_many(cls, trial_ids, interval=(None, None), attributes=('status', 'tags')):
+        """Load many trials at once, see :meth:`kleio.core.trial.base.Trial.load_many`"""
+        return [TrialNode(trial.id, trial)
+                for trial in Trial.load_many(trial_ids, interval, attributes)]
+
+    @classmethod
+    def view_many(cls, trial_ids, interval=(None, None), attributes=('status', 'tags')):
+        """View many trials at once, see :meth:`kleio.core.trial.base.Trial.load_many`"""
+        return [TrialNode(trial.id, trial)
+                for trial in Trial.view_many(trial_ids, interval, attributes)]
+
     @classmethod
     def branch(cls, trial_id, timestamp=None, **kwargs):
         """Builder method for a list of trials.
@@ -192,6 +235,35 @@ class TrialNode(TreeNode):
     def stderr(self, new_lines):
         self.item.stderr += new_lines
 
+    def iter_logs(self, name='stdout', since=None, reverse=False, limit=None):
+        """Iterate over pages of lines of the trial and its ancestors in time order
+
+        Ancestors are read one after the other, so that only one page of lines is in memory
+        at a time. With `reverse`, the trial is read first and ancestors are only read if more
+        lines are needed.
+
+        .. seealso:: :meth:`kleio.core.trial.base.Trial.iter_logs`
+        """
+        nodes = [self]
+        if not reverse:
+            while nodes[0].parent:
+                nodes.insert(0, nodes[0].parent)
+
+        remaining = limit
+        while nodes:
+            node = nodes.pop(0)
+            for lines in node.item.iter_logs(name, since=since, reverse=reverse,
+                                             limit=remaining):
+                yield lines
+                if remaining is not None:
+                    remaining -= len(lines)
+
+            if remaining is not None and remaining <= 0:
+                return
+
+            if reverse and node.parent:
+                nodes.append(node.parent)
+
     def get_artifacts(self, filename, query):
         if not self.parent:
             return self.item.get_artifacts(filename, query)
@@ -201,6 +273,30 @@ class TrialNode(TreeNode):
 
         return chain(parent_artifacts, node_artifacts)
 
+    def latest_artifact(self, filename, sort_by='runtime_timestamp', query=None):
+        """Return the artifact with the highest values of `sort_by` across the lineage
+
+        Each trial of the lineage only fetches its own latest artifact, so that the cost does
+        not depend on the number of artifacts. On ties, artifacts of children are preferred.
+
+        .. seealso:: :meth:`kleio.core.trial.base.Trial.latest_artifact`
+        """
+        sort = sort_order(sort_by)
+        latest = None
+        node = self
+        while node:
+            artifact = node.item.latest_artifact(filename, sort_by, query)
+            if artifact is not None and latest is not None:
+                if _compare_documents(artifact[1], latest[1], sort) > 0:
+                    artifact, latest = latest, artifact
+                artifact[0].close()
+            elif artifact is not None:
+                latest = artifact
+
+            node = node.parent
+
+        return latest
+
     @property
     def commandlines(self):
         commandlines = [(self.item.start_time, self.item.commandline)]
@@ -266,11 +362,12 @@ class TrialNode(TreeNode):
 
     @property
     def statistics(self):
-        history = list(self.item.statistics.history.values())
+        statistics = self.item.statistics
 
         if self.parent:
-            history = list(self.parent.statistics.history.values()) + history
-        return Statistics(history)
+            statistics = Statistics(columns=self.parent.statistics.columns + statistics.columns)
+
+        return statistics
 
     def __str__(self):
         """Represent partially with a string."""
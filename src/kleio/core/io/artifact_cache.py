@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`kleio.core.io.artifact_cache` -- Node-local cache of artifacts
+====================================================================
+
+.. module:: artifact_cache
+   :platform: Unix
+   :synopsis: Copy artifacts in a local scratch directory shared by the trials of a node.
+
+Artifacts are cached under `<root>/<key[:2]>/<key>` where key is the digest of the artifact,
+so that cached files never need to be invalidated. The first process reading an artifact
+copies it in the cache while holding a lock file created with `O_EXCL`, and moves the copy
+atomically in place once complete. Other processes wait for the copy instead of reading the
+artifact a second time.
+
+The cache is bounded by the total size of the files. When it is exceeded, the least recently
+used files are removed, the time of use being the modification time of the files.
+
+The cache is enabled by setting the environment variable `KLEIO_ARTIFACT_CACHE_DIR`, and its
+size in bytes with `KLEIO_ARTIFACT_CACHE_SIZE`.
+
+"""
+import logging
+import os
+import shutil
+import time
+import uuid
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 10 * 2 ** 30
+
+# Seconds after which a lock is considered abandoned by a killed process
+LOCK_TIMEOUT = 600
+
+LOCK_SUFFIX = '.lock'
+TMP_SUFFIX = '.tmp'
+
+
+def get_artifact_cache():
+    """Return the cache configured by the environment, None if it is disabled"""
+    root = os.getenv('KLEIO_ARTIFACT_CACHE_DIR')
+    if not root:
+        return None
+
+    return ArtifactCache(root, int(os.getenv('KLEIO_ARTIFACT_CACHE_SIZE', DEFAULT_MAX_SIZE)))
+
+
+class ArtifactCache(object):
+    """Size-bounded LRU cache of artifacts on the local file system
+
+    Attributes
+    ----------
+    root: str
+        Directory of the cached files.
+    max_size: int
+        Maximum total size of the cached files in bytes.
+
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, root, max_size=DEFAULT_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+
+    def path(self, key):
+        """Return the path of the cached file with the given key"""
+        return os.path.join(self.root, key[:2], key)
+
+    def open(self, key, source_path):
+        """Open the cached copy of `source_path` in binary mode, copying it first if needed
+
+        If the file cannot be cached, ex: it is larger than the cache, the source is opened
+        directly.
+        """
+        path = self.path(key)
+        deadline = time.time() + LOCK_TIMEOUT
+        while True:
+            try:
+                file_like_object = open(path, 'rb')
+            except FileNotFoundError:
+                pass
+            else:
+                self._touch(path)
+                return file_like_object
+
+            if os.path.getsize(source_path) > self.max_size:
+                return open(source_path, 'rb')
+
+            if self._fill(key, source_path):
+                continue
+
+            if time.time() > deadline:
+                log.warning("Timeout while waiting for %s to be cached", key)
+                return open(source_path, 'rb')
+
+            time.sleep(self.poll_interval)
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted meanwhile, the open file is still readable
+            pass
+
+    def _fill(self, key, source_path):
+        """Copy the source in the cache unless another process is already doing it
+
+        :returns: True if the file was copied, False if it is locked by another process.
+
+        """
+        path = self.path(key)
+        lock_path = path + LOCK_SUFFIX
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        except FileExistsError:
+            self._break_stale_lock(lock_path)
+            return False
+
+        tmp_path = "{}.{}{}".format(path, uuid.uuid4().hex, TMP_SUFFIX)
+        try:
+            with open(source_path, 'rb') as source, open(tmp_path, 'wb') as destination:
+                shutil.copyfileobj(source, destination)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            os.remove(lock_path)
+
+        self.evict()
+
+        return True
+
+    def _break_stale_lock(self, lock_path):
+        try:
+            if time.time() - os.path.getmtime(lock_path) > LOCK_TIMEOUT:
+                log.warning("Removing lock %s abandoned by another process", lock_path)
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        """Return tuples (last_use, size, path) of the cached files"""
+        entries = []
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(LOCK_SUFFIX) or filename.endswith(TMP_SUFFIX):
+                    continue
+
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        return entries
+
+    def size(self):
+        """Return the total size of the cached files in bytes"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove the least recently used files until the cache fits in `max_size` bytes"""
+        entries = sorted(self._entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`kleio.core.io.artifact_store` -- Content-addressed storage of artifacts
+=============================================================================
+
+.. module:: artifact_store
+   :platform: Unix
+   :synopsis: Store files once per content, with reference counts in the database.
+
+Blobs are saved under `<root>/<digest[:2]>/<digest[2:4]>/<digest>` where digest is the sha256
+of their content. Identical files logged by many trials are only written once. Each blob has a
+document in the collection `artifacts.blobs` counting the number of artifacts referring to it.
+
+Files are uploaded by chunks written in parallel, with the checksum of each chunk recorded in
+a manifest so that interrupted uploads can be resumed.
+
+"""
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+import datetime
+import hashlib
+import os
+import uuid
+
+
+CHUNK_SIZE = 2 ** 20
+UPLOAD_CHUNK_SIZE = 8 * 2 ** 20
+UPLOAD_WORKERS = 4
+
+
+def _hash(file_like_object):
+    """Return the sha256 of the content of a file and its size in bytes"""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: file_like_object.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+
+    return digest.hexdigest(), size
+
+
+def _pwrite(file_descriptor, data, offset):
+    """Write all data at the given offset of the file"""
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(file_descriptor, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _is_seekable(file_like_object):
+    try:
+        return file_like_object.seekable()
+    except AttributeError:
+        return False
+
+
+class ArtifactStore(object):
+    """Blobs stored by the sha256 of their content, with reference counts
+
+    Attributes
+    ----------
+    database: `kleio.core.io.database.AbstractDB`
+        Database holding the reference counts.
+    root: str
+        Directory of the blobs.
+
+    """
+
+    blob_collection = 'artifacts.blobs'
+    upload_collection = 'artifacts.uploads'
+
+    def __init__(self, database, root):
+        self.database = database
+        self.root = root
+
+    def path(self, digest):
+        """Return the path of the blob with the given digest"""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, file_like_object, upload_id=None, chunk_size=UPLOAD_CHUNK_SIZE,
+            workers=UPLOAD_WORKERS):
+        """Store the content of a file unless a blob with the same content exists
+
+        If the file is seekable, it is hashed first and not uploaded at all when the blob
+        already exists. Otherwise it is uploaded by chunks, see :meth:`upload`, and only
+        committed as a blob if none exists. The reference count of the blob is incremented in
+        both cases, before checking whether the blob exists, so that a concurrent
+        :meth:`release` cannot delete it in between.
+
+        :returns: A tuple (digest, size) of the blob.
+
+        """
+        seekable = _is_seekable(file_like_object)
+        if seekable:
+            start = file_like_object.tell()
+            digest, size = _hash(file_like_object)
+            file_like_object.seek(start)
+        else:
+            # The digest is only known once the file is read
+            if upload_id is None:
+                upload_id = uuid.uuid4().hex
+            digest, size = self._write_part(file_like_object, upload_id, chunk_size, workers)
+
+        self.database.write(
+            self.blob_collection,
+            {'$inc': {'refcount': 1},
+             '$setOnInsert': {'size': size, 'creation_timestamp': datetime.datetime.utcnow()}},
+            query={'_id': digest})
+
+        try:
+            if not seekable:
+                self._commit(upload_id, digest)
+            elif not self.exists(digest):
+                self.upload(file_like_object, upload_id, chunk_size, workers)
+        except BaseException:
+            self.release(digest)
+            raise
+
+        return digest, size
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.root, '.uploads', '{}.part'.format(upload_id))
+
+    def upload(self, file_like_object, upload_id=None, chunk_size=UPLOAD_CHUNK_SIZE,
+               workers=UPLOAD_WORKERS):
+        """Upload a file by chunks written in parallel, and commit it as a blob
+
+        The file is read sequentially by chunks of `chunk_size` bytes which are written at
+        their offset in a partial file by a pool of `workers` threads. The sha256 of each
+        written chunk is recorded in a manifest in the collection `artifacts.uploads`. If an
+        upload with the same `upload_id` was interrupted, chunks whose checksum matches the
+        manifest are not written again. Once all chunks are written, the partial file is moved
+        atomically to the path of the blob.
+
+        :returns: A tuple (digest, size) of the blob.
+
+        """
+        if upload_id is None:
+            upload_id = uuid.uuid4().hex
+
+        digest, size = self._write_part(file_like_object, upload_id, chunk_size, workers)
+        self._commit(upload_id, digest)
+
+        return digest, size
+
+    def _write_part(self, file_like_object, upload_id, chunk_size, workers):
+        """Write the chunks of a file in the partial file of the upload
+
+        :returns: A tuple (digest, size) of the file.
+
+        """
+        manifest = self._read_manifest(upload_id, chunk_size)
+        part_path = self._part_path(upload_id)
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        file_descriptor = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        part_size = os.fstat(file_descriptor).st_size
+
+        hasher = hashlib.sha256()
+        size = 0
+        pending = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                try:
+                    for index, chunk in enumerate(
+                            iter(lambda: file_like_object.read(chunk_size), b'')):
+                        offset = index * chunk_size
+                        checksum = hashlib.sha256(chunk).hexdigest()
+                        hasher.update(chunk)
+                        size += len(chunk)
+
+                        written = manifest.get(str(index))
+                        if written == checksum and part_size >= offset + len(chunk):
+                            continue
+
+                        pending[executor.submit(_pwrite, file_descriptor, chunk, offset)] = (
+                            index, checksum)
+
+                        # Bound the number of chunks held in memory
+                        if len(pending) >= 2 * workers:
+                            self._wait(upload_id, pending, FIRST_COMPLETED)
+
+                    self._wait(upload_id, pending, ALL_COMPLETED)
+                except BaseException:
+                    # Record chunks written before the failure so they are not written again
+                    self._wait(upload_id, pending, ALL_COMPLETED, raise_errors=False)
+                    raise
+
+            os.ftruncate(file_descriptor, size)
+            os.fsync(file_descriptor)
+        finally:
+            os.close(file_descriptor)
+
+        return hasher.hexdigest(), size
+
+    def _commit(self, upload_id, digest):
+        """Move the partial file of the upload to the path of the blob unless it exists"""
+        part_path = self._part_path(upload_id)
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.remove(part_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(part_path, path)
+
+        self.database.remove(self.upload_collection, {'_id': upload_id})
+
+    def _read_manifest(self, upload_id, chunk_size):
+        """Return the checksums of the chunks already written for an upload"""
+        manifests = self.database.read(self.upload_collection, {'_id': upload_id})
+        if manifests and manifests[0]['chunk_size'] == chunk_size:
+            return manifests[0].get('chunks', {})
+
+        # Chunks of a different size cannot be reused
+        if os.path.exists(self._part_path(upload_id)):
+            os.remove(self._part_path(upload_id))
+
+        self.database.write(
+            self.upload_collection,
+            {'chunk_size': chunk_size, 'chunks': {},
+             'creation_timestamp': datetime.datetime.utcnow()},
+            query={'_id': upload_id})
+
+        return {}
+
+    def _wait(self, upload_id, pending, return_when, raise_errors=True):
+        """Wait for chunks to be written and record their checksums in the manifest
+
+        Chunks written successfully are recorded even if another one failed. The first error
+        is then raised, unless `raise_errors` is False.
+        """
+        done, _ = wait(list(pending.keys()), return_when=return_when)
+        error = None
+        for future in done:
+            index, checksum = pending.pop(future)
+            if future.exception() is not None:
+                error = error if error else future.exception()
+                continue
+
+            self.database.write(self.upload_collection,
+                                {'$set': {'chunks.{}'.format(index): checksum}},
+                                query={'_id': upload_id})
+
+        if error is not None and raise_errors:
+            raise error
+
+    def open(self, digest):
+        """Open the blob with the given digest in binary mode"""
+        return open(self.path(digest), 'rb')
+
+    def refcount(self, digest):
+        """Return the number of artifacts referring to the blob"""
+        documents = self.database.read(self.blob_collection, {'_id': digest})
+        return documents[0]['refcount'] if documents else 0
+
+    def release(self, digest):
+        """Decrement the reference count of the blob, deleting it when not referred anymore
+
+        The record of the blob is deleted only if its count is still 0, and the file is only
+        removed by the process whose delete succeeded. A concurrent `put` incrementing the count
+        in between keeps the blob.
+        """
+        self.database.write(self.blob_collection, {'$inc': {'refcount': -1}},
+                            query={'_id': digest})
+        if self.database.remove(self.blob_collection, {'_id': digest, 'refcount': {'$lte': 0}}):
+            if os.path.exists(self.path(digest)):
+                os.remove(self.path(digest))
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`kleio.core.io.codec` -- Compression of large items saved in the database
+==============================================================================
+
+.. module:: codec
+   :platform: Unix
+   :synopsis: Registry of codecs used to compress event items and snapshots.
+
+Items are serialized with BSON, so that they keep the same types as when stored directly in
+the database, and then compressed with one of the registered codecs. Documents only record the
+name of the codec, so new codecs can be added with :func:`register_codec` without breaking
+existing documents.
+
+The default codec can be set with the environment variable `KLEIO_CODEC`. Use `none` to
+disable compression.
+
+"""
+import lzma
+import os
+import zlib
+
+import bson
+from bson.errors import InvalidDocument
+
+
+CODECS = {}
+
+# Items smaller than this number of bytes are saved as is
+DEFAULT_THRESHOLD = 2 ** 10
+
+
+def register_codec(name, compress, decompress):
+    """Register functions to compress and decompress bytes under the given name"""
+    CODECS[name] = (compress, decompress)
+
+
+register_codec('zlib', zlib.compress, zlib.decompress)
+register_codec('lzma', lzma.compress, lzma.decompress)
+
+
+DEFAULT_CODEC = os.getenv('KLEIO_CODEC', 'zlib')
+if DEFAULT_CODEC.lower() == 'none':
+    DEFAULT_CODEC = None
+
+
+def _get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError("Invalid codec '{}', must be one of {}".format(
+            name, sorted(CODECS.keys())))
+
+
+def encode(value, codec=DEFAULT_CODEC, threshold=DEFAULT_THRESHOLD):
+    """Compress a value if its serialization is larger than `threshold` bytes
+
+    :returns: A tuple (codec, value) where codec is None if the value was not compressed,
+        otherwise the name of the codec and value the compressed bytes.
+
+    """
+    if codec is None:
+        return None, value
+
+    compress, _ = _get_codec(codec)
+    try:
+        data = bson.BSON.encode({'value': value})
+    except InvalidDocument:
+        # Only the database in memory accepts types unknown to BSON
+        return None, value
+
+    if len(data) < threshold:
+        return None, value
+
+    return codec, compress(data)
+
+
+def decode(codec, value):
+    """Decompress a value encoded by :func:`encode`"""
+    if codec is None:
+        return value
+
+    _, decompress = _get_codec(codec)
+    return bson.BSON(decompress(value)).decode()['value']
@@ -100,6 +100,22 @@ class AbstractDB(object, metaclass=AbstractSingletonType):
         """
         pass
 
+    @abstractmethod
+    def index_information(self, collection_name):
+        """Return the indexes of a collection.
+
+        Parameters
+        ----------
+        collection_name : str
+           A collection inside database, a table.
+
+        :return: A dictionary of the form `{index_name: {'key': [(key_name, sort_order)],
+           'unique': bool}}` where `sort_order` is either `AbstractDB.ASCENDING` or
+           `AbstractDB.DESCENDING`.
+
+        """
+        pass
+
     @abstractmethod
     def write(self, collection_name, data, query=None):
         """Write new information to a collection. Perform insert or update.
@@ -132,7 +148,7 @@ class AbstractDB(object, metaclass=AbstractSingletonType):
         pass
 
     @abstractmethod
-    def read(self, collection_name, query=None, selection=None):
+    def read(self, collection_name, query=None, selection=None, sort=None, limit=None):
         """Read a collection and return a value according to the query.
 
         Parameters
@@ -143,12 +159,53 @@ class AbstractDB(object, metaclass=AbstractSingletonType):
            Filter entries in collection.
         selection : dict, optional
            Elements of matched entries to return, the projection.
+        sort : list of tuples, optional
+           Order of the matched entries, with the structure `[(key_name, sort_order)]`.
+           `sort_order` can be either `AbstractDB.ASCENDING` or `AbstractDB.DESCENDING`.
+        limit : int, optional
+           Maximum number of matched entries to return.
 
         :return: list of matched document[s]
 
         """
         pass
 
+    @abstractmethod
+    def aggregate(self, collection_name, pipeline):
+        """Run an aggregation pipeline on a collection and return the resulting documents.
+
+        Parameters
+        ----------
+        collection_name : str
+           A collection inside database, a table.
+        pipeline : list of dict
+           Stages of the pipeline, using MongoDB's syntax. Backends other than MongoDB
+           may only support a subset of the stages and expressions.
+
+        :return: list of documents
+
+        """
+        pass
+
+    @abstractmethod
+    def watch(self, collection_names, query):
+        """Open a stream of the documents inserted in collections and matching a query.
+
+        Parameters
+        ----------
+        collection_names : list of str
+           Collections to watch.
+        query : dict
+           Fields and values that the inserted documents must match.
+
+        :return: An object with a method `wait(timeout)` which blocks until documents are
+           inserted or `timeout` seconds passed, returning whether documents were inserted,
+           and a method `close()`.
+        :raises :exc:`NotImplementedError`: if the database does not support change streams.
+
+        """
+        pass
+
     @abstractmethod
     def read_and_write(self, collection_name, query, data, selection=None):
         """Read a collection's document and update the found document.
@@ -203,7 +260,7 @@ class AbstractDB(object, metaclass=AbstractSingletonType):
         query : dict
            Filter entries in collection.
 
-        :return: operation success.
+        :return: Number of documents deleted.
 
         """
         pass
@@ -213,7 +270,13 @@ class AbstractDB(object, metaclass=AbstractSingletonType):
         pass
 
     @abstractmethod
-    def read_file(self, collection_name, query):
+    def read_file(self, collection_name, query, selection=None, sort=None, limit=None):
+        """Return an iterator of tuples (file, metadata) of files matching the query.
+
+        Queries, sorts and limits apply on the metadata of the files, see
+        :meth:`AbstractDB.read`.
+
+        """
         pass
 
 
@@ -233,7 +296,8 @@ class ReadOnlyDB(object):
                         # Properties
                         ["is_connected"] +
                         # Methods
-                        ["initiate_connection", "close_connection", "read", "count", "read_file"])
+                        ["initiate_connection", "close_connection", "read", "count", "read_file",
+                         "index_information", "aggregate", "watch"])
 
     def __init__(self, database):
         """Init method, see attributes of :class:`AbstractDB`."""
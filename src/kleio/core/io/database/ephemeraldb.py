@@ -10,6 +10,8 @@
 """
 from collections import defaultdict
 import copy
+import datetime
+import io
 
 from kleio.core.io.database import AbstractDB, DuplicateKeyError
 from kleio.core.utils import flatten, unflatten
@@ -45,6 +47,14 @@ class EphemeralDB(AbstractDB):
         """
         self._db[collection_name].create_index(keys, unique=unique)
 
+    def index_information(self, collection_name):
+        """Return the indexes of a collection.
+
+        .. seealso:: :meth:`AbstractDB.index_information` for argument documentation.
+
+        """
+        return self._db[collection_name].index_information()
+
     def write(self, collection_name, data, query=None):
         """Write new information to a collection. Perform insert or update.
 
@@ -60,12 +70,13 @@ class EphemeralDB(AbstractDB):
                 data = [data]
             return dbcollection.insert_many(documents=data)
 
-        update_data = {'$set': data}
+        if not any(key.startswith('$') for key in data.keys()):
+            data = {'$set': data}
 
         return dbcollection.update_many(query=query,
-                                        update=update_data)
+                                        update=data)
 
-    def read(self, collection_name, query=None, selection=None):
+    def read(self, collection_name, query=None, selection=None, sort=None, limit=None):
         """Read a collection and return a value according to the query.
 
         .. seealso:: :meth:`AbstractDB.read` for argument documentation.
@@ -73,10 +84,31 @@ class EphemeralDB(AbstractDB):
         """
         dbcollection = self._db[collection_name]
 
-        dbdocs = dbcollection.find(query, selection)
+        dbdocs = dbcollection.find(query, selection, sort=sort, limit=limit)
 
         return dbdocs
 
+    def aggregate(self, collection_name, pipeline):
+        """Run an aggregation pipeline on a collection and return the resulting documents.
+
+        Only stages `$match`, `$sort`, `$group`, `$project`, `$skip` and `$limit` are
+        supported, with a subset of MongoDB's expressions and accumulators.
+
+        .. seealso:: :meth:`AbstractDB.aggregate` for argument documentation.
+
+        """
+        dbcollection = self._db[collection_name]
+
+        return dbcollection.aggregate(pipeline)
+
+    def watch(self, collection_names, query):
+        """Change streams are not supported, documents can only be inserted by this process.
+
+        .. seealso:: :meth:`AbstractDB.watch` for argument documentation.
+
+        """
+        raise NotImplementedError("EphemeralDB does not support change streams")
+
     def read_and_write(self, collection_name, query, data, selection=None):
         """Read a collection's document and update the found document.
 
@@ -113,11 +145,30 @@ class EphemeralDB(AbstractDB):
 
         return dbcollection.delete_many(query=query)
 
-    def write_file(self, collection_name, data, **kwargs):
-        return {}
+    def write_file(self, collection_name, file_like_object, metadata):
+        """Keep the content of the file in memory and save its metadata.
 
-    def read_file(self, collection_name, query):
-        return []
+        :returns: The id of the file.
+
+        """
+        self.write(collection_name + ".files",
+                   {'_id': metadata['_id'], 'data': file_like_object.read()})
+        self.write(collection_name + ".metadata", metadata)
+
+        return metadata['_id']
+
+    def read_file(self, collection_name, query, selection=None, sort=None, limit=None):
+        """Return files in memory with their metadata.
+
+        .. seealso:: :meth:`AbstractDB.read_file` for argument documentation.
+
+        """
+        if selection and any(selection.values()):
+            selection = dict(selection, _id=1)
+        for metadata in self.read(collection_name + ".metadata", query, selection, sort=sort,
+                                  limit=limit):
+            files = self.read(collection_name + ".files", {'_id': metadata['_id']})
+            yield (io.BytesIO(files[0]['data']), metadata)
 
 
 class EphemeralCollection(object):
@@ -133,33 +184,72 @@ class EphemeralCollection(object):
         """Initialise the collection, with no documents and only _id unique index."""
         self._documents = []
         self._indexes = dict()
+        self._index_information = dict()
         self.create_index('_id', unique=True)
 
     def create_index(self, keys, unique=False):
         """Create given indexes if they do not already exist for this collection.
 
-        Indexes are only created if `unique` is True.
+        Indexes are only enforced if `unique` is True, others are only recorded.
         """
         # turn single key into list for coherence
         if not isinstance(keys, (list, tuple)):
-            keys = [(keys, None)]
+            keys = [(keys, AbstractDB.ASCENDING)]
+
+        name = "_".join("{}_{}".format(key, -1 if order == AbstractDB.DESCENDING else 1)
+                        for key, order in keys)
+        if name not in self._index_information:
+            self._index_information[name] = {'key': list(keys), 'unique': unique}
 
         keys = tuple(key for (key, order) in keys)
         if unique and keys not in self._indexes:
             self._indexes[keys] = []
 
-    def find(self, query=None, selection=None):
+    def index_information(self):
+        """Return the indexes of the collection.
+
+        .. seealso:: :meth:`AbstractDB.index_information` for the format.
+
+        """
+        return copy.deepcopy(self._index_information)
+
+    def find(self, query=None, selection=None, sort=None, limit=None):
         """Find documents in the collection and return a value according to the query.
 
         .. seealso:: :meth:`AbstractDB.read` for argument documentation.
 
         """
-        found_documents = []
-        for document in self._documents:
-            if document.match(query):
-                found_documents.append(document.select(selection))
+        found_documents = [document for document in self._documents if document.match(query)]
 
-        return found_documents
+        if sort:
+            # Sort successively on each key, from the least to the most significant one.
+            # Missing keys are sorted first, like in MongoDB.
+            for key, sort_order in reversed(sort):
+                found_documents.sort(
+                    key=lambda document: (key in document, document.get(key)),
+                    reverse=sort_order == AbstractDB.DESCENDING)
+
+        if limit:
+            found_documents = found_documents[:limit]
+
+        return [document.select(selection) for document in found_documents]
+
+    def aggregate(self, pipeline):
+        """Run an aggregation pipeline on the collection.
+
+        .. seealso:: :meth:`AbstractDB.aggregate` for argument documentation.
+
+        """
+        documents = [document.to_dict() for document in self._documents]
+
+        for stage in pipeline:
+            (name, argument), = stage.items()
+            if name not in AGGREGATION_STAGES:
+                raise NotImplementedError(
+                    "Aggregation stage '{}' is not supported by EphemeralDB".format(name))
+            documents = AGGREGATION_STAGES[name](documents, argument)
+
+        return documents
 
     def _validate_index(self, document):
         """Validate index values of a document
@@ -227,12 +317,14 @@ class EphemeralCollection(object):
     def _upsert(self, query, update):
         """Insert the document when query was not found.
 
-        If update contains `$set`, then the new document is the combination of query and
-        update['$set'], otherwise the new document is `update`.
+        If update contains operators, then the new document is the combination of query,
+        update['$set'], update['$setOnInsert'] and update['$inc'], otherwise the new document
+        is `update`.
         """
-        if "$set" in update:
+        if any(key.startswith('$') for key in update.keys()):
             new_document = copy.deepcopy(query)
-            new_document.update(update["$set"])
+            for operator in ('$set', '$setOnInsert', '$inc'):
+                new_document.update(update.get(operator, {}))
         else:
             new_document = update
 
@@ -256,14 +348,16 @@ class EphemeralCollection(object):
             if not document.match(query):
                 retained_documents.append(document)
 
+        n_deleted = len(self._documents) - len(retained_documents)
         self._documents = retained_documents
 
-        return True
+        return n_deleted
 
     def drop(self):
         """Drop the collection, removing all documents and indexes."""
         self._documents = []
         self._indexes = dict()
+        self._index_information = dict()
 
 
 class EphemeralDocument(object):
@@ -276,9 +370,13 @@ class EphemeralDocument(object):
     """
 
     operators = {
+        "$exists": None,
+        "$eq": (lambda a, b: a == b),
         "$in": (lambda a, b: a in b),
         "$gte": (lambda a, b: a >= b),
-        "$gt": (lambda a, b: a > b)
+        "$gt": (lambda a, b: a > b),
+        "$lte": (lambda a, b: a <= b),
+        "$lt": (lambda a, b: a < b)
     }
 
     def __init__(self, data):
@@ -290,6 +388,13 @@ class EphemeralDocument(object):
         if query is None or query == {}:
             return True
 
+        query = dict(query)
+        if '$expr' in query and not evaluate(query.pop('$expr'), self.to_dict()):
+            return False
+
+        if '$or' in query and not any(self.match(clause) for clause in query.pop('$or')):
+            return False
+
         query = flatten(query)
         for key, value in query.items():
             if not self.match_key(key, value):
@@ -302,13 +407,16 @@ class EphemeralDocument(object):
         value based on the operator defined within the key.
 
         Default operator is equal when no operator is defined.
-        Other operators could be $in, $gte, $gt. They are defined
+        Other operators could be $exists, $eq, $in, $gte, $gt, $lte, $lt. They are defined
         in the last section of the key. For example: `abc.def.$in` or `abc.def.$gte`.
         """
         if key.split(".")[-1] in self.operators:
             operator = key.split(".")[-1]
             key = ".".join(key.split(".")[:-1])
 
+            if operator == "$exists":
+                return (key in self) == bool(value)
+
             return key in self and self.operators[operator](self[key], value)
 
         return key in self and self[key] == value
@@ -328,7 +436,8 @@ class EphemeralDocument(object):
             raise ValueError(
                 'Cannot mix selection with 1 and 0s except for _id: {}'.format(keys))
 
-        if n_keys == 0:
+        # Selecting only _id, like for the unique index on it, is not an exclusion
+        if n_keys == 0 and (keys_without_id or not keys.get('_id', 1)):
             new_keys = dict((key, 1) for key in self._data.keys() if key not in keys)
             new_keys['_id'] = keys.get('_id', 1)
             keys = new_keys
@@ -384,12 +493,17 @@ class EphemeralDocument(object):
         Parameters
         ----------
         data: dict
-            Dictionary of data to update the document. If `$set` is in
-            the data, the corresponding `data[$set]` will be used instead.
+            Dictionary of data to update the document. If it contains operators, values of
+            `data[$set]` are set and values of `data[$inc]` are added to the existing ones.
+            `data[$setOnInsert]` is ignored since the document exists already.
 
         """
-        data = flatten(data.get("$set", data))
-        self._data.update(data)
+        if not any(key.startswith('$') for key in data.keys()):
+            data = {'$set': data}
+
+        self._data.update(flatten(data.get('$set', {})))
+        for key, increment in flatten(data.get('$inc', {})).items():
+            self._data[key] = self._data.get(key, 0) + increment
 
     def to_dict(self):
         """Convert the ephemeral document to a python dictionary"""
@@ -399,6 +513,196 @@ class EphemeralDocument(object):
         """Get the item corresponding to the given key in the document"""
         return self._data[key]
 
+    def get(self, key, default=None):
+        """Get the item corresponding to the given key in the document, or default if missing"""
+        return self._data.get(key, default)
+
     def __contains__(self, key):
         """Test whether the given key is present in the document"""
         return key in self._data
+
+
+def _get_field(document, path):
+    """Get value of a dotted path in a document, None if missing"""
+    for part in path.split("."):
+        if not isinstance(document, dict) or part not in document:
+            return None
+        document = document[part]
+
+    return document
+
+
+def _truncate_to_milliseconds(value):
+    """Drop the microseconds that MongoDB does not store in dates"""
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def _to_milliseconds(value):
+    if isinstance(value, datetime.datetime):
+        return (value - datetime.datetime(1970, 1, 1)) // datetime.timedelta(milliseconds=1)
+
+    return int(value)
+
+
+def _subtract(a, b):
+    if a is None or b is None:
+        return None
+    if isinstance(a, datetime.datetime) and not isinstance(b, datetime.datetime):
+        return _truncate_to_milliseconds(a) - datetime.timedelta(milliseconds=b)
+    if isinstance(a, datetime.datetime):
+        return _to_milliseconds(a) - _to_milliseconds(b)
+
+    return a - b
+
+
+def _null_safe(function):
+    def wrapper(*arguments):
+        if any(argument is None for argument in arguments):
+            return None
+        return function(*arguments)
+
+    return wrapper
+
+
+EXPRESSION_OPERATORS = {
+    "$eq": (lambda a, b: a == b),
+    "$ne": (lambda a, b: a != b),
+    "$gt": (lambda a, b: a > b),
+    "$gte": (lambda a, b: a >= b),
+    "$lt": (lambda a, b: a < b),
+    "$lte": (lambda a, b: a <= b),
+    "$and": (lambda *arguments: all(arguments)),
+    "$or": (lambda *arguments: any(arguments)),
+    "$add": _null_safe(lambda *arguments: sum(arguments)),
+    "$subtract": _subtract,
+    "$multiply": _null_safe(lambda a, b: a * b),
+    "$divide": _null_safe(lambda a, b: a / b),
+    "$mod": _null_safe(lambda a, b: a % b),
+    "$toLong": _null_safe(_to_milliseconds),
+}
+
+
+def evaluate(expression, document):
+    """Evaluate an aggregation expression on a document
+
+    Strings starting with `$` are field paths, dictionaries with a single key starting with `$`
+    are operators. Everything else is a literal.
+    """
+    if expression == "$$ROOT":
+        return document
+
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get_field(document, expression[1:])
+
+    if isinstance(expression, dict) and len(expression) == 1:
+        (operator, arguments), = expression.items()
+        if operator.startswith("$"):
+            if operator not in EXPRESSION_OPERATORS:
+                raise NotImplementedError(
+                    "Expression '{}' is not supported by EphemeralDB".format(operator))
+
+            if not isinstance(arguments, list):
+                arguments = [arguments]
+            return EXPRESSION_OPERATORS[operator](
+                *[evaluate(argument, document) for argument in arguments])
+
+    if isinstance(expression, dict):
+        return dict((key, evaluate(value, document)) for key, value in expression.items())
+
+    if isinstance(expression, list):
+        return [evaluate(value, document) for value in expression]
+
+    return expression
+
+
+def _numbers(values):
+    return [value for value in values if isinstance(value, (int, float)) and
+            not isinstance(value, bool)]
+
+
+ACCUMULATORS = {
+    "$first": (lambda values: values[0]),
+    "$last": (lambda values: values[-1]),
+    "$min": (lambda values: min([value for value in values if value is not None],
+                                default=None)),
+    "$max": (lambda values: max([value for value in values if value is not None],
+                                default=None)),
+    "$avg": (lambda values: (sum(_numbers(values)) / len(_numbers(values))
+                             if _numbers(values) else None)),
+    "$sum": (lambda values: sum(_numbers(values))),
+    "$push": list,
+}
+
+
+def _match(documents, query):
+    return [document for document in documents if EphemeralDocument(document).match(query)]
+
+
+def _sort(documents, sort):
+    documents = list(documents)
+    # Sort successively on each key, from the least to the most significant one.
+    for key, sort_order in reversed(list(sort.items())):
+        documents.sort(
+            key=lambda document: (_get_field(document, key) is not None,
+                                  _get_field(document, key)),
+            reverse=sort_order < 0)
+
+    return documents
+
+
+def _group(documents, specification):
+    specification = dict(specification)
+    key_expression = specification.pop('_id')
+
+    groups = []
+    members = dict()
+    for document in documents:
+        key = evaluate(key_expression, document)
+        hashable_key = repr(key)
+        if hashable_key not in members:
+            members[hashable_key] = []
+            groups.append((key, members[hashable_key]))
+        members[hashable_key].append(document)
+
+    results = []
+    for key, group in groups:
+        result = {'_id': key}
+        for field, accumulator in specification.items():
+            (operator, expression), = accumulator.items()
+            if operator not in ACCUMULATORS:
+                raise NotImplementedError(
+                    "Accumulator '{}' is not supported by EphemeralDB".format(operator))
+            result[field] = ACCUMULATORS[operator](
+                [evaluate(expression, document) for document in group])
+        results.append(result)
+
+    return results
+
+
+def _project(documents, specification):
+    results = []
+    for document in documents:
+        result = {}
+        if specification.get('_id', 1):
+            result['_id'] = document.get('_id')
+        for field, expression in specification.items():
+            if field == '_id':
+                continue
+            if expression in (0, False):
+                continue
+            if expression in (1, True):
+                expression = "$" + field
+            result[field] = evaluate(expression, document)
+        results.append(result)
+
+    return results
+
+
+AGGREGATION_STAGES = {
+    "$match": _match,
+    "$sort": _sort,
+    "$group": _group,
+    "$project": _project,
+    "$skip": (lambda documents, n: documents[n:]),
+    "$limit": (lambda documents, n: documents[:n]),
+}
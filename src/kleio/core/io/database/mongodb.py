@@ -10,10 +10,13 @@
 """
 import functools
 import os
+import time
 
 import gridfs
 import pymongo
 
+from kleio.core.io.artifact_cache import get_artifact_cache
+from kleio.core.io.artifact_store import ArtifactStore
 from kleio.core.io.database import (
     AbstractDB, DatabaseError, DuplicateKeyError)
 
@@ -146,6 +149,25 @@ class MongoDB(AbstractDB):
 
         dbcollection.create_index(keys, unique=unique, background=True)
 
+    @mongodb_exception_wrapper
+    def index_information(self, collection_name):
+        """Return the indexes of a collection.
+
+        .. seealso:: :meth:`AbstractDB.index_information` for argument documentation.
+
+        """
+        dbcollection = self._db[collection_name]
+
+        indexes = {}
+        for name, index in dbcollection.index_information().items():
+            indexes[name] = {
+                'key': [(key, self.ASCENDING if sort_order == pymongo.ASCENDING
+                         else self.DESCENDING)
+                        for key, sort_order in index['key']],
+                'unique': index.get('unique', False)}
+
+        return indexes
+
     def _convert_index_keys(self, keys):
         """Convert index keys to MongoDB ones."""
         if not isinstance(keys, (list, tuple)):
@@ -192,7 +214,7 @@ class MongoDB(AbstractDB):
                                           upsert=True)
         return result.acknowledged
 
-    def read(self, collection_name, query=None, selection=None):
+    def read(self, collection_name, query=None, selection=None, sort=None, limit=None):
         """Read a collection and return a value according to the query.
 
         .. seealso:: :meth:`AbstractDB.read` for argument documentation.
@@ -201,10 +223,50 @@ class MongoDB(AbstractDB):
         dbcollection = self._db[collection_name]
 
         cursor = dbcollection.find(query, selection)
+        if sort:
+            cursor = cursor.sort(self._convert_index_keys(sort))
+        if limit:
+            cursor = cursor.limit(limit)
         dbdocs = list(cursor)
 
         return dbdocs
 
+    @mongodb_exception_wrapper
+    def aggregate(self, collection_name, pipeline):
+        """Run an aggregation pipeline on a collection and return the resulting documents.
+
+        .. seealso:: :meth:`AbstractDB.aggregate` for argument documentation.
+
+        """
+        dbcollection = self._db[collection_name]
+
+        return list(dbcollection.aggregate(pipeline))
+
+    @mongodb_exception_wrapper
+    def watch(self, collection_names, query):
+        """Open a change stream of the documents inserted in the collections.
+
+        Change streams of a whole database are only available with PyMongo 3.7 or later, on
+        replica sets and sharded clusters of MongoDB 4.0 or later.
+
+        .. seealso:: :meth:`AbstractDB.watch` for argument documentation.
+
+        """
+        if not hasattr(self._db, 'watch'):
+            raise NotImplementedError("Change streams require PyMongo 3.7 or later")
+
+        match = {'operationType': 'insert', 'ns.coll': {'$in': list(collection_names)}}
+        match.update(('fullDocument.' + key, value) for key, value in query.items())
+
+        try:
+            stream = self._db.watch([{'$match': match}], max_await_time_ms=1000)
+        except pymongo.errors.OperationFailure as e:
+            raise NotImplementedError(
+                "MongoDB only supports change streams of a database on replica sets and "
+                "sharded clusters of version 4.0 or later") from e
+
+        return MongoChangeStream(stream)
+
     @mongodb_exception_wrapper
     def read_and_write(self, collection_name, query, data, selection=None):
         """Read a collection's document and update the found document.
@@ -243,30 +305,68 @@ class MongoDB(AbstractDB):
         dbcollection = self._db[collection_name]
 
         result = dbcollection.delete_many(filter=query)
-        return result.acknowledged
+        return result.deleted_count
 
-    def write_file(self, collection_name, file_like_object, metadata):
-        # kwargs.setdefault('chunk_size', 261120 * 2 * 2)
-        # fs = gridfs.GridFS(self._db, collection=collection_name)
-        self.write(collection_name + ".metadata", metadata)
+    def _get_artifact_store(self):
         # TODO: Set inside of kleio.config
-        dir_path = os.environ['KLEIO_DATABASE_FILE_DIR']
-        with open(os.path.join(dir_path, metadata['_id']), 'wb') as f:
-            f.write(file_like_object.read())
+        return ArtifactStore(self, os.environ['KLEIO_DATABASE_FILE_DIR'])
+
+    def write_file(self, collection_name, file_like_object, metadata):
+        """Store the file in the content-addressed artifact store and save its metadata.
+
+        The blob is uploaded by chunks and committed before the metadata is written, so that
+        metadata never points to a missing or partial file. Files identical to an existing blob
+        are not written again. The upload is identified by the id of the event, so that saving
+        the same event again after an interruption resumes it.
+
+        :returns: The digest of the file.
+
+        """
+        store = self._get_artifact_store()
+        digest, size = store.put(file_like_object, upload_id=metadata['_id'])
+        metadata = dict(metadata, digest=digest, size=size)
+        try:
+            self.write(collection_name + ".metadata", metadata)
+        except BaseException:
+            store.release(digest)
+            raise
+
+        return digest
+
+    def read_file(self, collection_name, query, selection=None, sort=None, limit=None,
+                  raise_if_not_found=True):
+        """Open the files matching the query with their metadata.
 
-    def read_file(self, collection_name, query, raise_if_not_found=True):
+        Files are read through the node-local cache if `KLEIO_ARTIFACT_CACHE_DIR` is set, see
+        :mod:`kleio.core.io.artifact_cache`.
+
+        """
         # fs = gridfs.GridFS(self._db, collection=collection_name)
-        dir_path = os.environ['KLEIO_DATABASE_FILE_DIR']
-        for metadata in self.read(collection_name + ".metadata", query):
-            file_path = os.path.join(dir_path, metadata['_id'])
+        store = self._get_artifact_store()
+        cache = get_artifact_cache()
+        if selection and any(selection.values()):
+            selection = dict(selection, digest=1)
+        for metadata in self.read(collection_name + ".metadata", query, selection, sort=sort,
+                                  limit=limit):
+            if 'digest' in metadata:
+                key = metadata['digest']
+                file_path = store.path(key)
+            else:
+                # Files saved before the artifact store are named after their event
+                key = metadata['_id']
+                file_path = os.path.join(store.root, key)
 
             if not os.path.exists(file_path) and raise_if_not_found:
                 raise RuntimeError("File {} cannot be found".format(file_path))
             elif not os.path.exists(file_path):
                 continue
 
-            # with open(file_path, 'rb') as f:
-            yield (open(file_path, 'rb'), metadata)
+            if cache is not None:
+                file_like_object = cache.open(key, file_path)
+            else:
+                file_like_object = open(file_path, 'rb')
+
+            yield (file_like_object, metadata)
 
         # return [(f, f.metadata) for f in fs.find(query)]
 
@@ -294,3 +394,24 @@ class MongoDB(AbstractDB):
 
             # Use new self.name if authSource not specified in URI
             self.options['authSource'] = settings['options'].get('authsource', self.name)
+
+
+class MongoChangeStream(object):
+    """Wait for changes on a MongoDB change stream"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def wait(self, timeout):
+        """Block until a change or `timeout` seconds, return whether there was a change"""
+        deadline = time.time() + timeout
+        while True:
+            # Blocks at most `max_await_time_ms` on the server
+            if self._stream.try_next() is not None:
+                return True
+
+            if time.time() >= deadline:
+                return False
+
+    def close(self):
+        self._stream.close()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`kleio.core.io.schema` -- Declarative schema of the database
+=================================================================
+
+.. module:: schema
+   :platform: Unix
+   :synopsis: Collections and indexes used by kleio, applied once with `kleio db setup`.
+
+Indexes are created by `kleio db setup` and the version of the schema is recorded in a metadata
+document. Runtime processes only check that version instead of creating the indexes themselves.
+
+"""
+import datetime
+import logging
+import os
+
+from kleio.core.io.database import Database
+
+log = logging.getLogger(__name__)
+
+# Increment when indexes are added or modified
+SCHEMA_VERSION = 3
+
+METADATA_COLLECTION = 'kleio.metadata'
+SCHEMA_DOCUMENT_ID = 'schema'
+
+ASCENDING = Database.ASCENDING
+DESCENDING = Database.DESCENDING
+
+# Event-based attributes of the trials
+EVENT_COLLECTIONS = ('tags', 'status', 'stdout', 'stderr', 'statistics')
+FILE_COLLECTIONS = ('artifacts', )
+
+EVENT_INDEXES = (
+    'trial_id',
+    [('trial_id', ASCENDING), ('seq', ASCENDING)],
+    'runtime_timestamp',
+    'creation_timestamp')
+
+SNAPSHOT_INDEXES = (
+    [('trial_id', ASCENDING), ('seq', ASCENDING)], )
+
+FILE_INDEXES = EVENT_INDEXES + ('filename', )
+
+# Attributes of artifacts indexed to fetch the latest artifact of a trial, ex: the checkpoint with
+# the highest epoch. More can be declared with `KLEIO_ARTIFACT_ATTRIBUTES`, separated with `;`.
+ARTIFACT_ATTRIBUTES = ('runtime_timestamp', 'epoch', 'step') + tuple(
+    name for name in os.getenv('KLEIO_ARTIFACT_ATTRIBUTES', '').split(';') if name)
+
+
+def _artifact_indexes():
+    # `seq` breaks ties between artifacts with the same value, so it must be part of the index
+    return tuple(
+        [('trial_id', ASCENDING), ('filename', ASCENDING), (name, DESCENDING),
+         ('seq', DESCENDING)]
+        for name in ARTIFACT_ATTRIBUTES)
+
+
+TRIAL_INDEXES = {
+    'trials.immutables': (
+        'refers.parent_id', ),
+    'trials.reports': (
+        [('tags', ASCENDING), ('registry.status', ASCENDING)],
+        'registry.status',
+        'registry.start_time',
+        'registry.end_time'),
+    'trials.leases': (
+        'expires_at', ),
+    # Columnar statistics
+    'statistics.columns': (
+        [('trial_id', ASCENDING), ('seq', ASCENDING)],
+        [('trial_id', ASCENDING), ('last_row', ASCENDING)],
+        'runtime_timestamp',
+        'first_runtime_timestamp')}
+
+
+def _normalize_keys(keys):
+    """Turn keys of an index into a tuple of (key, order)"""
+    if not isinstance(keys, (list, tuple)):
+        keys = [(keys, ASCENDING)]
+
+    return tuple((key, order) for key, order in keys)
+
+
+def get_indexes():
+    """Return the list of indexes declared by the schema
+
+    :returns: A list of tuples (collection_name, keys, unique)
+
+    """
+    indexes = []
+    for collection_name, keys_list in sorted(TRIAL_INDEXES.items()):
+        for keys in keys_list:
+            indexes.append((collection_name, keys, False))
+
+    for collection_name in EVENT_COLLECTIONS:
+        for keys in EVENT_INDEXES:
+            indexes.append((collection_name, keys, False))
+        for keys in SNAPSHOT_INDEXES:
+            indexes.append(("{}.snapshots".format(collection_name), keys, False))
+
+    for collection_name in FILE_COLLECTIONS:
+        for keys in FILE_INDEXES:
+            indexes.append((collection_name, keys, False))
+            indexes.append((collection_name + ".metadata", keys, False))
+        for keys in _artifact_indexes():
+            indexes.append((collection_name + ".metadata", keys, False))
+
+    return indexes
+
+
+def read_version(database):
+    """Return the version of the schema applied on the database, None if never applied"""
+    documents = database.read(METADATA_COLLECTION, {'_id': SCHEMA_DOCUMENT_ID})
+    if not documents:
+        return None
+
+    return documents[0]['version']
+
+
+def setup(database):
+    """Create all indexes of the schema and record its version in the database"""
+    for collection_name, keys, unique in get_indexes():
+        log.debug("Ensuring index %s on %s", keys, collection_name)
+        database.ensure_index(collection_name, keys, unique=unique)
+
+    database.write(
+        METADATA_COLLECTION,
+        {'version': SCHEMA_VERSION, 'updated_at': datetime.datetime.utcnow()},
+        query={'_id': SCHEMA_DOCUMENT_ID})
+
+
+def verify(database):
+    """Compare the database with the schema
+
+    :returns: A tuple (version, missing_indexes) where version is the version recorded in
+        the database and missing_indexes a list of (collection_name, keys, unique) declared in
+        the schema but absent from the database.
+
+    """
+    index_information = {}
+    missing_indexes = []
+    for collection_name, keys, unique in get_indexes():
+        if collection_name not in index_information:
+            index_information[collection_name] = set(
+                (_normalize_keys(index['key']), index['unique'])
+                for index in database.index_information(collection_name).values())
+
+        if (_normalize_keys(keys), unique) not in index_information[collection_name]:
+            missing_indexes.append((collection_name, keys, unique))
+
+    return read_version(database), missing_indexes
+
+
+_version_checked = False
+
+
+def check_version(database):
+    """Warn once per process if the database schema is missing or outdated"""
+    global _version_checked
+
+    if _version_checked:
+        return
+
+    _version_checked = True
+
+    try:
+        version = read_version(database)
+    except BaseException as e:
+        if "not authorized on" not in str(e):
+            raise
+        return
+
+    if version is None or version < SCHEMA_VERSION:
+        log.warning("Database schema version is %s but kleio expects version %d. "
+                    "Run `kleio db setup` to create missing indexes.", version, SCHEMA_VERSION)
+    elif version > SCHEMA_VERSION:
+        log.warning("Database schema version %d is more recent than the one of kleio (%d). "
+                    "Consider upgrading kleio.", version, SCHEMA_VERSION)
@@ -1,10 +1,19 @@
+import atexit
+from collections import Counter
 import copy
 import datetime
+from itertools import chain
+import time
+import weakref
 
-from kleio.core.io.database import Database
+from kleio.core.io import codec, schema
+from kleio.core.io.database import Database, DuplicateKeyError
 from kleio.core.utils import flatten, unflatten
 
 
+_NO_ITEM = object()
+
+
 class event_based_property(property):
     def __init__(self, fget=None, fset=None, fdel=None, iadd=None, doc=None):
         super(event_based_property, self).__init__(fget, fset, fdel, doc)
@@ -66,9 +75,22 @@ def unfold_event_based_diff(diff):
     return unfolded_diff
 
 
+def _first_runtime_timestamp(event):
+    """Runtime timestamp of the first item of an event, which may hold a block of items"""
+    return event.get('first_runtime_timestamp', event['runtime_timestamp'])
+
+
 class EventBasedAttribute(object):
+    """Attribute defined by a history of events
+
+    The value obtained by replaying the history is materialized and kept up to date
+    incrementally as new events are registered or loaded, so that `get()` does not need to
+    replay the whole history.
+    """
+
     def __init__(self):
-        self.history = []
+        self._history = []
+        self._reset()
 
     def __iter__(self):
         return iter(self.history)
@@ -76,25 +98,73 @@ class EventBasedAttribute(object):
     def __getitem__(self, key):
         return self.history[key]
 
+    @property
+    def history(self):
+        """List of events of the attribute"""
+        self._materialize()
+        return self._history
+
+    def _materialize(self):
+        """Make sure the history and the materialized value are available"""
+        pass
+
+    def _reset(self):
+        """Reset the materialized value to the one of an empty history"""
+        pass
+
+    def _apply(self, event):
+        """Update the materialized value with a new event"""
+        raise NotImplementedError()
+
+    def _append_event(self, event):
+        self._history.append(event)
+        self._apply(event)
+
     def replay(self):
-        raise NotImplemented()
+        """Rebuild the materialized value from scratch based on the history"""
+        self._reset()
+        for event in self.history:
+            self._apply(event)
+
+        return self.get()
 
     def get(self):
-        return self.replay()
+        raise NotImplementedError()
 
-    def register_event(self, event_type, item, timestamp=None, creator=None):
-        event = self.create_event(event_type, item, timestamp=timestamp, creator=creator)
-        self.history.append(event)
+    def _get_state(self):
+        """Return a copy of the materialized value which can be saved in a snapshot"""
+        raise NotImplementedError()
+
+    def _set_state(self, state):
+        """Restore the materialized value from a snapshot"""
+        raise NotImplementedError()
+
+    @property
+    def first_timestamp(self):
+        """Runtime timestamp of the first event"""
+        return _first_runtime_timestamp(self.history[0])
+
+    @property
+    def last_timestamp(self):
+        """Runtime timestamp of the last event"""
+        return self.history[-1]['runtime_timestamp']
+
+    def register_event(self, event_type, item, timestamp=None, creator=None,
+                       first_timestamp=None):
+        event = self.create_event(event_type, item, timestamp=timestamp, creator=creator,
+                                  first_timestamp=first_timestamp)
+        self._append_event(event)
 
     @classmethod
-    def create_event(cls, event_type, item, timestamp=None, creator=None):
+    def create_event(cls, event_type, item, timestamp=None, creator=None, first_timestamp=None):
         creation_timestamp = datetime.datetime.utcnow()
         runtime_timestamp = timestamp if timestamp else creation_timestamp
 
-        if not isinstance(runtime_timestamp, datetime.datetime):
-            raise TypeError(
-                "Timestamp must be of type datetime.datetime, not '{}'".format(
-                    type(runtime_timestamp)))
+        for value in [runtime_timestamp, first_timestamp]:
+            if value is not None and not isinstance(value, datetime.datetime):
+                raise TypeError(
+                    "Timestamp must be of type datetime.datetime, not '{}'".format(
+                        type(value)))
 
         event = {
             'item': item,
@@ -103,13 +173,73 @@ class EventBasedAttribute(object):
             'runtime_timestamp': runtime_timestamp
         }
 
+        # Events grouping many items span a range of runtime timestamps
+        if first_timestamp is not None:
+            event['first_runtime_timestamp'] = first_timestamp
+
         return event
 
 
+class EventBuffer(object):
+    """In-memory queue of events waiting to be written with a single `insert_many`.
+
+    The buffer is considered full when any of the thresholds is reached: number of
+    events, approximate size of the items in bytes or delay since the oldest queued event.
+    """
+
+    def __init__(self, max_events=1000, max_bytes=2 ** 20, max_delay=5.0):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.events = []
+        self.nbytes = 0
+        self.oldest = None
+
+    def __len__(self):
+        return len(self.events)
+
+    def push(self, event):
+        if not self.events:
+            self.oldest = time.time()
+        self.events.append(event)
+        self.nbytes += len(str(event['item']))
+
+    def is_full(self):
+        if not self.events:
+            return False
+
+        return (len(self.events) >= self.max_events or
+                self.nbytes >= self.max_bytes or
+                time.time() - self.oldest >= self.max_delay)
+
+    def pop_all(self):
+        events = self.events
+        self.events = []
+        self.nbytes = 0
+        self.oldest = None
+        return events
+
+
+_buffered_attributes = weakref.WeakSet()
+
+
+def _decode_snapshot(snapshot):
+    snapshot['value'] = codec.decode(snapshot.pop('codec', None), snapshot['value'])
+    return snapshot
+
+
+@atexit.register
+def flush_buffered_attributes():
+    """Write down all events still queued in buffered attributes"""
+    for attribute in list(_buffered_attributes):
+        attribute.flush()
+
+
 class EventBasedAttributeWithDB(EventBasedAttribute):
     """
     {
-        _id:
+        _id: <trial_id>.<seq>
+        seq:
         creation_timestamp:
         runtime_timestamp:
         trial_id:
@@ -118,111 +248,501 @@ class EventBasedAttributeWithDB(EventBasedAttribute):
         }
     }
     """
-    indexes_built = set()
+    page_size = 10000
+    compactable = False
+    required_fields = ('_id', 'seq', 'type', 'runtime_timestamp', 'codec')
 
-    def __init__(self, trial_id, name, interval=(None, None)):
+    def __init__(self, trial_id, name, interval=(None, None), compactable=None):
         # NOTE: If interval is defined, than the attribute cannot write any new event
         # unless the interval covers all the events in the db. Interval is used for viewonly trials
         super(EventBasedAttributeWithDB, self).__init__()
         self._trial_id = trial_id
         self.name = name
         self._interval = interval
+        # Snapshots are only read for compactable attributes
+        if compactable is not None:
+            self.compactable = compactable
+        self._buffer = None
+        self._codec = codec.DEFAULT_CODEC
+        self._compression_threshold = codec.DEFAULT_THRESHOLD
+        self._snapshot = None
+        # Events are only fetched on first access
+        self._loaded = False
         self._db = Database()
         self._setup_db()
 
     def _setup_db(self):
-        if self.collection_name not in EventBasedAttributeWithDB.indexes_built:
-            try:
-                self._db.ensure_index(self.collection_name, 'trial_id')
-                self._db.ensure_index(self.collection_name, 'runtime_timestamp')
-                self._db.ensure_index(self.collection_name, 'creation_timestamp')
-            except BaseException as e:
-                if "not authorized on" not in str(e):
-                    raise
-
-            EventBasedAttributeWithDB.indexes_built.add(self.collection_name)
+        # Indexes are created once with `kleio db setup`
+        schema.check_version(self._db)
 
     @property
     def collection_name(self):
         return "{}".format(self.name)
 
     @property
-    def last_id(self):
-        if not self.history:
-            return 0
+    def snapshot_collection_name(self):
+        return "{}.snapshots".format(self.name)
 
-        return int(self.history[-1]['_id'].split(".")[-1])
+    @property
+    def loaded(self):
+        """Whether the events were fetched from the database at least once"""
+        return self._loaded
 
-    def load(self):
-        query = {"trial_id": self._trial_id}
+    def _materialize(self):
+        if not self._loaded:
+            self.load()
+
+    @property
+    def last_seq(self):
+        """Sequence number of the last event, 0 if there is none"""
+        self._materialize()
+        return self._last_seq
+
+    @property
+    def _last_seq(self):
+        if self._history:
+            return self._history[-1]['seq']
+        elif self._snapshot:
+            return self._snapshot['seq']
+
+        return 0
+
+    @property
+    def first_timestamp(self):
+        """Runtime timestamp of the first event, including those folded in the snapshot"""
+        self._materialize()
+        if self._snapshot:
+            return self._snapshot['first_runtime_timestamp']
+
+        return _first_runtime_timestamp(self._history[0])
+
+    @property
+    def last_timestamp(self):
+        """Runtime timestamp of the last event, including those folded in the snapshot
+
+        :raises: :exc:`IndexError`: if there is no event, like `history[-1]`.
+
+        """
+        self._materialize()
+        if self._history:
+            return self._history[-1]['runtime_timestamp']
+        elif self._snapshot:
+            return self._snapshot['runtime_timestamp']
+
+        raise IndexError("Attribute '{}' has no events".format(self.name))
+
+    def replay(self):
+        """Rebuild the materialized value from the snapshot and the history"""
+        self._materialize()
+        self._reset()
+        if self._snapshot:
+            self._set_state(self._snapshot['value'])
+
+        for event in self._history:
+            self._apply(event)
+
+        return self.get()
+
+    def _read_snapshot(self):
+        """Return the newest snapshot within the interval, None if there is none"""
+        query = {'trial_id': self._trial_id}
+        upper_bound = self._interval[1]
+        if upper_bound:
+            query['runtime_timestamp'] = {'$lte': upper_bound}
+
+        snapshots = self._db.read(self.snapshot_collection_name, query,
+                                  sort=[('seq', Database.DESCENDING)], limit=1)
+        if not snapshots:
+            return None
+
+        return _decode_snapshot(snapshots[0])
+
+    def _load_snapshot(self):
+        """Restore the materialized value from the newest snapshot within the interval"""
+        snapshot = self._read_snapshot()
+        if snapshot:
+            self._restore_snapshot(snapshot)
+
+    def _restore_snapshot(self, snapshot):
+        self._snapshot = snapshot
+        self._set_state(self._snapshot['value'])
+
+    def compact(self, prune=False):
+        """Fold all events into a new snapshot
+
+        Following loads only replay the events saved after the newest snapshot.
+
+        Parameters
+        ----------
+        prune: bool, optional
+            Delete events folded in the snapshot. Views with an interval ending before the snapshot
+            will only be able to replay from an older snapshot. Defaults to False.
+
+        :returns: The new snapshot document, None if there was no new events to fold.
+
+        """
+        if not self.compactable:
+            raise RuntimeError("Attribute '{}' cannot be compacted".format(self.name))
+
+        self._materialize()
+        self.flush()
+
+        if not self._history:
+            return None
+
+        snapshot = {
+            '_id': "{}.{}".format(self._trial_id, self.last_seq),
+            'trial_id': self._trial_id,
+            'seq': self.last_seq,
+            'value': self._get_state(),
+            'first_runtime_timestamp': self.first_timestamp,
+            'runtime_timestamp': self.last_timestamp,
+            'creation_timestamp': datetime.datetime.utcnow()
+        }
+
+        try:
+            self._db.write(self.snapshot_collection_name, self._encode(snapshot, 'value'))
+        except DuplicateKeyError:
+            # Another process already compacted up to the same event
+            pass
+
+        if prune:
+            self._prune(snapshot['seq'])
+
+        self._snapshot = snapshot
+        self._history = []
+
+        return snapshot
+
+    def _prune(self, seq):
+        """Delete events up to `seq` included, legacy events being selected by their _id"""
+        self._db.remove(self.collection_name,
+                        {'trial_id': self._trial_id, 'seq': {'$lte': seq}})
+
+        legacy_events = self._db.read(
+            self.collection_name, {'trial_id': self._trial_id, 'seq': {'$exists': False}},
+            {'_id': 1})
+        legacy_ids = [event['_id'] for event in legacy_events
+                      if int(event['_id'].split(".")[-1]) <= seq]
+        if legacy_ids:
+            self._db.remove(self.collection_name, {'_id': {'$in': legacy_ids}})
+
+    def _interval_query(self):
+        """Query on runtime_timestamp for the interval of the attribute"""
+        lower_bound, upper_bound = self._interval
+        query = {}
+        if lower_bound:
+            query['$gte'] = lower_bound
+        if upper_bound:
+            query['$lte'] = upper_bound
+
+        return {'runtime_timestamp': query} if query else {}
+
+    def aggregate(self, pipeline):
+        """Run an aggregation pipeline on the events of the attribute
+
+        The stages are applied on the events of the trial within the interval of the attribute.
+        Events folded in snapshots and pruned are not available anymore.
+
+        .. seealso:: :meth:`kleio.core.io.database.AbstractDB.aggregate`
+        """
+        self.flush()
+        match = {'trial_id': self._trial_id}
+        match.update(self._interval_query())
+
+        return self._db.aggregate(self.collection_name, [{'$match': match}] + list(pipeline))
+
+    def _selection(self, selection):
+        """Add fields required to replay the events to an inclusive projection"""
+        if selection and any(selection.values()):
+            selection = dict(selection)
+            for field in self.required_fields:
+                selection[field] = 1
+
+        return selection
+
+    def load(self, selection=None):
+        """Fetch events that are not already in the history
+
+        Only events with a sequence number greater than the last one in history and within the
+        interval of the attribute are queried. Events are fetched by pages of `page_size` sorted
+        by sequence number. This is done automatically on first access of the history or the
+        materialized value.
+
+        Parameters
+        ----------
+        selection: dict, optional
+            Projection of the event fields to fetch. Fields required to replay the events are
+            always fetched.
+
+        """
+        self._load_events(selection)
+        self._loaded = True
+
+        return self
+
+    @classmethod
+    def load_many(cls, attributes):
+        """Fetch the events of the attributes of many trials with a single query
+
+        All attributes must have the same name and interval. For compactable attributes, the
+        newest snapshot of each trial is selected with one aggregation, then only the events
+        following the snapshots are read with a single query and partitioned by trial.
+        Attributes already loaded are left untouched.
+
+        """
+        attributes = dict((attribute._trial_id, attribute) for attribute in attributes
+                          if not attribute.loaded)
+        if not attributes:
+            return
+
+        first = next(iter(attributes.values()))
+        trial_ids = sorted(attributes.keys())
+        lower_bound, upper_bound = first._interval
+
+        snapshots = {}
+        if first.compactable and not lower_bound:
+            query = {'trial_id': {'$in': trial_ids}}
+            if upper_bound:
+                query['runtime_timestamp'] = {'$lte': upper_bound}
+            pipeline = [
+                {'$match': query},
+                {'$sort': {'trial_id': 1, 'seq': -1}},
+                {'$group': {'_id': '$trial_id', 'snapshot': {'$first': '$$ROOT'}}}]
+            for group in first._db.aggregate(first.snapshot_collection_name, pipeline):
+                snapshots[group['_id']] = group['snapshot']
+
+        events = {}
+        if not (lower_bound and upper_bound and lower_bound > upper_bound):
+            query = first._interval_query()
+            clauses = [{'trial_id': trial_id, 'seq': {'$gt': snapshots[trial_id]['seq']}}
+                       for trial_id in trial_ids if trial_id in snapshots]
+            trial_ids_without_snapshot = [trial_id for trial_id in trial_ids
+                                          if trial_id not in snapshots]
+            if trial_ids_without_snapshot:
+                clauses.append({'trial_id': {'$in': trial_ids_without_snapshot}})
+            query['$or'] = clauses
+            sort = [('trial_id', Database.ASCENDING), ('seq', Database.ASCENDING)]
+            for event in first._db.read(first.collection_name, query, sort=sort):
+                events.setdefault(event['trial_id'], []).append(event)
+
+        for trial_id, attribute in attributes.items():
+            trial_events = events.get(trial_id, [])
+            if any('seq' not in event for event in trial_events):
+                attribute.load()
+                continue
+
+            snapshot = snapshots.get(trial_id)
+            if snapshot:
+                attribute._restore_snapshot(_decode_snapshot(snapshot))
+
+            last_seq = attribute._last_seq
+            for event in trial_events:
+                if event['seq'] > last_seq:
+                    attribute._append_event(event)
+
+            attribute._loaded = True
+
+    def _load_events(self, selection):
         lower_bound, upper_bound = self._interval
-        if (self.history and
-                (lower_bound is None or lower_bound < self.history[-1]['runtime_timestamp'])):
-            lower_bound = self.history[-1]['runtime_timestamp']
 
         # Can't query anything anymore
         if lower_bound and upper_bound and lower_bound > upper_bound:
-            return {}
+            return
 
-        if lower_bound:
-            query['runtime_timestamp'] = {'$gte': lower_bound}
-        elif upper_bound:
-            query['runtime_timestamp'] = {'$lte': upper_bound}
+        if self.compactable and not self._history and not self._snapshot and not lower_bound:
+            self._load_snapshot()
 
-        new_events = self._db.read(self.collection_name, query)
+        query = {"trial_id": self._trial_id}
+        query.update(self._interval_query())
+        selection = self._selection(selection)
 
-        if self._interval[0] and self._interval[1]:
-            new_events = [event for event
-                          in new_events if event['runtime_timestamp'] <= upper_bound]
+        while True:
+            if self._last_seq:
+                query['seq'] = {'$gt': self._last_seq}
 
-        self.history += self._filter_duplicates(new_events)
+            new_events = self._db.read(self.collection_name, query, selection,
+                                       sort=[('seq', Database.ASCENDING)], limit=self.page_size)
 
-        return self
+            if any('seq' not in event for event in new_events):
+                return self._load_legacy(query, selection)
 
-    def _filter_duplicates(self, new_events):
-        if not self.history:
-            return new_events
+            for event in new_events:
+                self._append_event(event)
 
-        last_id = self.last_id
+            if len(new_events) < self.page_size:
+                return
 
-        return [e for e in new_events if int(e['_id'].split(".")[-1]) > last_id]
+    def _load_legacy(self, query, selection):
+        """Load events saved before sequence numbers were explicit
 
-    def _save(self, event):
-        # Make sure we have full history
-        event['_id'] = "{}.{}".format(self._trial_id, self.last_id + 1)
-        self._db.write(self.collection_name, event)
+        Their sequence number can only be inferred from their _id, so they cannot be filtered
+        or paginated based on it.
+        """
+        query.pop('seq', None)
+        new_events = self._db.read(self.collection_name, query, selection)
+        for event in new_events:
+            if 'seq' not in event:
+                event['seq'] = int(event['_id'].split(".")[-1])
 
-    def register_event(self, event_type, item, timestamp=None, creator=None):
-        event = self.create_event(event_type, item, timestamp=timestamp, creator=creator)
+        last_seq = self._last_seq
+        for event in sorted(new_events, key=lambda event: event['seq']):
+            if event['seq'] > last_seq:
+                self._append_event(event)
+
+    def buffer(self, max_events=1000, max_bytes=2 ** 20, max_delay=5.0):
+        """Queue new events in memory and write them in batches
+
+        Events are written with a single `insert_many` when one of the thresholds is reached,
+        when `flush()` is called or at process exit.
+        """
+        self._buffer = EventBuffer(max_events, max_bytes, max_delay)
+        _buffered_attributes.add(self)
+
+    def flush(self):
+        """Write all events queued in the buffer, if any
+
+        Events are only removed from the buffer once written, so that a failed write can be
+        retried with the next flush.
+        """
+        if not self._buffer:
+            return
+
+        self._db.write(self.collection_name, self._buffer.events)
+        self._buffer.pop_all()
+
+    def compress(self, codec=codec.DEFAULT_CODEC, threshold=codec.DEFAULT_THRESHOLD):
+        """Compress items of new events larger than `threshold` bytes
+
+        Compressed items are decompressed when the events are loaded. Use `codec=None` to
+        save items as is.
+
+        .. seealso:: :mod:`kleio.core.io.codec`
+        """
+        self._codec = codec
+        self._compression_threshold = threshold
+
+    def _encode(self, document, field='item'):
+        """Return a copy of the document with the field compressed, if large enough"""
+        codec_name, value = codec.encode(document[field], self._codec,
+                                         self._compression_threshold)
+        if codec_name is None:
+            return document
+
+        document = dict(document)
+        document[field] = value
+        document['codec'] = codec_name
+        return document
+
+    def _append_event(self, event):
+        if 'codec' in event:
+            event['item'] = codec.decode(event.pop('codec'), event['item'])
+
+        super(EventBasedAttributeWithDB, self)._append_event(event)
+
+    def _save(self, event):
+        # Make sure we have full history. The _id is unique so that concurrent writes of
+        # the same sequence number raise a DuplicateKeyError.
+        event['seq'] = self._last_seq + 1
+        event['_id'] = "{}.{}".format(self._trial_id, event['seq'])
+        document = self._encode(event)
+        if self._buffer is None:
+            self._db.write(self.collection_name, document)
+            return
+
+        self._buffer.push(document)
+        if self._buffer.is_full():
+            self.flush()
+
+    def register_event(self, event_type, item, timestamp=None, creator=None,
+                       first_timestamp=None):
+        self._materialize()
+        event = self.create_event(event_type, item, timestamp=timestamp, creator=creator,
+                                  first_timestamp=first_timestamp)
         event['trial_id'] = self._trial_id
         event['creator_id'] = creator if creator else self._trial_id
         self._save(event)
-        self.history.append(event)
+        self._append_event(event)
 
 
 class EventBasedListAttribute(EventBasedAttribute):
+    """List of items built from add, remove and extend events
+
+    Extend events hold a block of consecutive items, such as lines of logs, so that they are
+    saved in a single document.
+    """
+
     ADD = "add"
     REMOVE = "remove"
+    EXTEND = "extend"
+
+    def _reset(self):
+        self._items = []
+        # Counts of hashable items for constant-time membership tests
+        self._counts = Counter()
+
+    def _apply(self, event):
+        item = event['item']
+        if event['type'] == self.ADD:
+            self._items.append(item)
+            self._count(item, 1)
+        elif event['type'] == self.REMOVE:
+            self._items.remove(item)
+            self._count(item, -1)
+        elif event['type'] == self.EXTEND:
+            self._items.extend(item)
+            for new_item in item:
+                self._count(new_item, 1)
+        else:
+            raise ValueError(
+                "Invalid event type '{}', must be '{}', '{}' or '{}'".format(
+                    event['type'], self.ADD, self.REMOVE, self.EXTEND))
+
+    def _count(self, item, increment):
+        try:
+            self._counts[item] += increment
+        except TypeError:  # Unhashable items are looked up in the list
+            pass
+
+    def __contains__(self, item):
+        self._materialize()
+        try:
+            return self._counts[item] > 0
+        except TypeError:
+            return item in self._items
+
+    def __len__(self):
+        self._materialize()
+        return len(self._items)
 
-    def replay(self):
-        items = []
-        for event in self.history:
-            if event['type'] == self.ADD:
-                items.append(event['item'])
-            elif event['type'] == self.REMOVE:
-                del items[items.index(event['item'])]
-            else:
-                raise ValueError(
-                    "Invalid event type '{}', must be '{}' or '{}'".format(
-                        (event['type'], self.ADD, self.REMOVE)))
+    def get(self):
+        """Return a copy of the materialized list"""
+        self._materialize()
+        return list(self._items)
+
+    def _get_state(self):
+        return list(self._items)
 
-        return items
+    def _set_state(self, state):
+        self._reset()
+        for item in state:
+            self._items.append(item)
+            self._count(item, 1)
 
     def append(self, new_item, timestamp=None, creator=None):
         self.register_event(self.ADD, new_item, timestamp=timestamp, creator=creator)
 
+    def extend(self, new_items, first_timestamp=None, timestamp=None, creator=None):
+        """Add a block of items with a single event
+
+        `first_timestamp` and `timestamp` are the runtime timestamps of the first and the last
+        items of the block.
+        """
+        self.register_event(self.EXTEND, list(new_items), timestamp=timestamp, creator=creator,
+                            first_timestamp=first_timestamp)
+
     def remove(self, item, timestamp=None, creator=None):
-        if item not in self.replay():
+        if item not in self:
             raise RuntimeError(
                 "Cannot remove item that is not in the list:\n{}".format(item))
 
@@ -230,55 +750,145 @@ class EventBasedListAttribute(EventBasedAttribute):
 
 
 class EventBasedListAttributeWithDB(EventBasedListAttribute, EventBasedAttributeWithDB):
-    pass
+    # Lists such as stdout can grow beyond the size of a single snapshot document
+    compactable = False
+
+    def iter_pages(self, since=None, reverse=False, limit=None):
+        """Iterate over the items in the database by pages, without keeping them in memory
+
+        Items are read from the database cursor by pages of at most `page_size` events and
+        are never added to the history of the attribute. Items folded in the newest snapshot
+        are yielded by pages of `page_size` items, unless `since` is given in which case only
+        events are read.
+
+        Parameters
+        ----------
+        since: `datetime.datetime`, optional
+            Only read events whose runtime timestamp is greater or equal. Blocks of items
+            are included whole if their last item is recent enough.
+        reverse: bool, optional
+            Iterate from the newest to the oldest items. Defaults to False.
+        limit: int, optional
+            Maximum number of items to yield.
+
+        :raises: :exc:`ValueError`: if an event removes an item, since the list cannot be
+            streamed.
+
+        """
+        snapshot = None
+        if self.compactable and not since:
+            snapshot = self._read_snapshot()
+
+        remaining = [limit]
+        pages = (items for _, items in self._iter_event_pages(
+            snapshot['seq'] if snapshot else 0, since, reverse, remaining))
+        if snapshot:
+            if reverse:
+                pages = chain(pages, self._iter_snapshot_pages(snapshot['value'], reverse))
+            else:
+                pages = chain(self._iter_snapshot_pages(snapshot['value'], reverse), pages)
+
+        for items in pages:
+            if remaining[0] is not None:
+                items = items[:remaining[0]]
+                remaining[0] -= len(items)
+
+            if items:
+                yield items
+
+            if remaining[0] is not None and remaining[0] <= 0:
+                return
+
+    def newest_seq(self):
+        """Return the sequence number of the newest event in the database, 0 if there is none"""
+        events = self._db.read(self.collection_name, {'trial_id': self._trial_id}, {'seq': 1},
+                               sort=[('seq', Database.DESCENDING)], limit=1)
+        return events[0]['seq'] if events else 0
+
+    def iter_pages_after(self, seq):
+        """Iterate over the items of the events following the event `seq`, by pages
+
+        Pages are pairs of the sequence number of their last event and of their items, so that
+        the next iteration can start after it. Like with `iter_pages`, items are never added
+        to the history of the attribute.
+        """
+        return self._iter_event_pages(seq, None, False, [None])
+
+    def _iter_snapshot_pages(self, items, reverse):
+        """Slice the items of a snapshot in pages, copying only one page at a time"""
+        if reverse:
+            for stop in range(len(items), 0, -self.page_size):
+                yield items[max(stop - self.page_size, 0):stop][::-1]
+        else:
+            for start in range(0, len(items), self.page_size):
+                yield items[start:start + self.page_size]
+
+    def _iter_event_pages(self, after_seq, since, reverse, remaining):
+        query = {'trial_id': self._trial_id}
+        query.update(self._interval_query())
+        if since:
+            timestamp_query = query.setdefault('runtime_timestamp', {})
+            timestamp_query['$gte'] = max(since, timestamp_query.get('$gte', since))
+
+        order = Database.DESCENDING if reverse else Database.ASCENDING
+        query['seq'] = {'$gt': after_seq}
+        while True:
+            # Each event holds at least one item
+            page_size = self.page_size
+            if remaining[0] is not None:
+                page_size = min(page_size, remaining[0])
+
+            events = self._db.read(self.collection_name, query, sort=[('seq', order)],
+                                   limit=page_size)
+            items = []
+            for event in events:
+                item = codec.decode(event.get('codec'), event['item'])
+                if event['type'] == self.ADD:
+                    items.append(item)
+                elif event['type'] == self.EXTEND:
+                    items.extend(item[::-1] if reverse else item)
+                else:
+                    raise ValueError(
+                        "Cannot stream items of '{}', event {} is of type '{}'".format(
+                            self.name, event['_id'], event['type']))
+
+            if events:
+                yield events[-1]['seq'], items
+
+            if len(events) < page_size:
+                return
+
+            if reverse:
+                query['seq'] = {'$gt': after_seq, '$lt': events[-1]['seq']}
+            else:
+                query['seq'] = {'$gt': events[-1]['seq']}
 
 
 class EventBasedFileAttributeWithDB(EventBasedAttributeWithDB):
     ADD = "add"
-    db_is_setup = False
 
-    def _setup_db(self):
-        if self.collection_name not in EventBasedAttributeWithDB.indexes_built:
-            try:
-                self._db.ensure_index(self.collection_name + ".metadata", 'trial_id')
-                self._db.ensure_index(self.collection_name + ".metadata", 'filename')
-                self._db.ensure_index(self.collection_name + ".metadata", 'runtime_timestamp')
-                self._db.ensure_index(self.collection_name + ".metadata", 'creation_timestamp')
-                # Because we are not using gridfs for now...
-                self._db.ensure_index(self.collection_name, 'trial_id')
-                self._db.ensure_index(self.collection_name, 'filename')
-                self._db.ensure_index(self.collection_name, 'runtime_timestamp')
-                self._db.ensure_index(self.collection_name, 'creation_timestamp')
-            except BaseException as e:
-                if "not authorized on" not in str(e):
-                    raise
-
-            EventBasedAttributeWithDB.indexes_built.add(self.collection_name)
+    def _reset(self):
+        self._items = []
 
-    def replay(self):
-        items = []
-        for event in self.history:
-            if event['type'] == self.ADD:
-                items.append(event['item'])
-            elif event['type'] == self.REMOVE:
-                del items[items.find(event['item'])]
-            else:
-                raise ValueError(
-                    "Invalid event type '{}', must be '{}' or '{}'".format(
-                        (event['type'], self.ADD, self.REMOVE)))
+    def _apply(self, event):
+        if event['type'] != self.ADD:
+            raise ValueError(
+                "Invalid event type '{}', must be '{}'".format(event['type'], self.ADD))
 
-        return items
+        self._items.append(event['item'])
 
     def register_event(self, event_type, item, timestamp=None, creator=None):
+        self._materialize()
         file_like_object = item.pop('file_like_object')
         event = self.create_event(event_type, item, timestamp=timestamp, creator=creator)
         event['trial_id'] = self._trial_id
         self._save(event, file_like_object)
-        self.history.append(event)
+        self._append_event(event)
 
     def _save(self, event, file_like_object):
         # Make sure we have full history
-        event['_id'] = "{}.{}".format(self._trial_id, self.last_id + 1)
+        event['seq'] = self._last_seq + 1
+        event['_id'] = "{}.{}".format(self._trial_id, event['seq'])
         metadata = copy.deepcopy(event['item'])
         event.pop('item')
         metadata.update(event)
@@ -292,35 +902,70 @@ class EventBasedFileAttributeWithDB(EventBasedAttributeWithDB):
         attributes['file_like_object'] = file_like_object
         self.register_event(self.ADD, attributes, timestamp=timestamp, creator=creator)
 
-    def get(self, filename, query):
-        query = copy.deepcopy(query)
+    def get(self, filename, query, selection=None, sort=None, limit=None):
+        query = copy.deepcopy(query) if query else {}
         query['trial_id'] = self._trial_id
-        lower_bound, upper_bound = self._interval
+        query.update(self._interval_query())
+        query['filename'] = filename
 
-        if lower_bound:
-            query['runtime_timestamp'] = {'$gte': lower_bound}
-        elif upper_bound:
-            query['runtime_timestamp'] = {'$lte': upper_bound}
+        return self._db.read_file(self.collection_name, query, selection=self._selection(selection),
+                                  sort=sort, limit=limit)
 
-        query['filename'] = filename
+    def latest(self, filename, sort_by='runtime_timestamp', query=None):
+        """Return the artifact with the highest values of `sort_by`, None if there is none
+
+        `sort_by` is either an attribute of the artifacts or a list of tuples (attribute, order)
+        as in :meth:`kleio.core.io.database.AbstractDB.read`. Artifacts are sorted and limited
+        by the database, which can use the indexes of attributes declared in
+        :mod:`kleio.core.io.schema`.
+
+        :returns: A tuple (file, metadata) or None.
+
+        """
+        sort = sort_order(sort_by) + [('seq', Database.DESCENDING)]
+        for artifact in self.get(filename, query, sort=sort, limit=1):
+            return artifact
 
-        files = self._db.read_file(self.collection_name, query)
+        return None
 
-        if lower_bound and upper_bound:
-            files = [f for f, metadata in files if metadata['runtime_timestamp'] <= upper_bound]
 
-        return files
+def sort_order(sort_by):
+    """Return a sort specification, a single key being sorted from highest to lowest"""
+    if isinstance(sort_by, str):
+        return [(sort_by, Database.DESCENDING)]
+
+    return list(sort_by)
 
 
 class EventBasedItemAttribute(EventBasedAttribute):
     SET = "set"
 
-    def replay(self):
-        return self.history[-1]['item']
+    def _reset(self):
+        self._item = _NO_ITEM
+
+    def _apply(self, event):
+        if event['type'] != self.SET:
+            raise ValueError(
+                "Invalid event type '{}', must be '{}'".format(event['type'], self.SET))
+
+        self._item = event['item']
+
+    def get(self):
+        self._materialize()
+        if self._item is _NO_ITEM:
+            raise IndexError("No item was set yet")
+
+        return self._item
+
+    def _get_state(self):
+        return self._item
+
+    def _set_state(self, state):
+        self._item = state
 
     def set(self, new_item, timestamp=None, creator=None):
         self.register_event(self.SET, new_item, timestamp=timestamp, creator=creator)
 
 
 class EventBasedItemAttributeWithDB(EventBasedItemAttribute, EventBasedAttributeWithDB):
-    pass
+    compactable = True
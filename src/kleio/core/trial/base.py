@@ -13,13 +13,17 @@ import copy
 import datetime
 import hashlib
 import logging
+import os
+import socket
 
 from kleio.core.io.database import Database, ReadOnlyDB, DuplicateKeyError
-from kleio.core.utils import sorteddict
+from kleio.core.io import codec, schema
+from kleio.core.utils import canonical_digest, canonical_str, flatten, sorteddict, unflatten
 from .attribute import (
-    event_based_property, EventBasedAttribute,
+    event_based_property, EventBasedAttribute, EventBasedAttributeWithDB,
     EventBasedListAttributeWithDB, EventBasedItemAttributeWithDB, EventBasedFileAttributeWithDB)
-from .statistic import Statistics
+from .columnar import ColumnarStatisticsWithDB
+from .statistic import aggregate_columns, aggregation_pipeline, BulkStatistics, Statistics
 import kleio.core.utils.errors
 
 
@@ -207,7 +211,7 @@ class Trial(object):
         # if trial.id != trial_id:
         #     print("Oups, wrong id")
         trial._saved = True
-        trial.update()  # Update the attributes
+        # Attributes are loaded lazily on first access
 
         return trial
 
@@ -226,6 +230,99 @@ class Trial(object):
 
         return TrialView(trial)
 
+    @classmethod
+    def load_many(cls, trial_ids, interval=(None, None), attributes=('status', 'tags')):
+        """Load many trials with a single query per collection
+
+        Immutables are read with one query on `_id`, and the events of each attribute in
+        `attributes` with one query on `trial_id` for all trials. Other attributes are still
+        loaded lazily on first access.
+
+        :returns: The list of trials found, in the order of `trial_ids`.
+        """
+        db = Database()
+        trial_ids = list(trial_ids)
+        configs = {}
+        for config in db.read(cls.trial_immutable_collection, {'_id': {'$in': trial_ids}}):
+            configs[config.pop('_id')] = config
+
+        trials = []
+        for trial_id in trial_ids:
+            if trial_id not in configs:
+                continue
+
+            trial = cls(interval=interval, **configs[trial_id])
+            trial._saved = True
+            trials.append(trial)
+
+        for name in attributes:
+            attribute_list = [getattr(trial, '_' + name, None) for trial in trials]
+            if not all(isinstance(attribute, EventBasedAttributeWithDB)
+                       for attribute in attribute_list):
+                raise ValueError("Attribute '{}' cannot be loaded in bulk".format(name))
+
+            EventBasedAttributeWithDB.load_many(attribute_list)
+
+        return trials
+
+    @classmethod
+    def view_many(cls, trial_ids, interval=(None, None), attributes=('status', 'tags')):
+        """View many trials, see :meth:`Trial.load_many`"""
+        return [TrialView(trial) for trial in cls.load_many(trial_ids, interval, attributes)]
+
+    @classmethod
+    def fetch_statistics(cls, query, keys):
+        """Fetch statistics of all trials matching a query at once
+
+        Trials are selected in the reports, then the statistics of all of them are read with a
+        single query on the events and a single query on the columnar chunks. Only the
+        statistics of the trials themselves are fetched, not those of their parents.
+
+        Parameters
+        ----------
+        query: dict
+            Query on the reports of the trials, ex: `{'tags': {'$all': ['sweep']},
+            'registry.status': 'completed', 'configuration.lr': 0.1}`.
+        keys: list of str
+            Flattened keys of the statistics to fetch, ex: `['epoch', 'valid.loss']`.
+
+        :returns: A `BulkStatistics` with arrays aligned on the ids of the trials.
+
+        """
+        db = Database()
+        trial_ids = [report['_id'] for report in db.read(
+            cls.trial_report_collection, query, {'_id': 1}, sort=[('_id', Database.ASCENDING)])]
+        if not trial_ids:
+            return BulkStatistics([], {})
+
+        selection = {'_id': 1, 'trial_id': 1, 'seq': 1, 'runtime_timestamp': 1, 'codec': 1}
+        selection.update(('item.' + key, 1) for key in keys)
+        events = db.read(
+            cls.trial_statistics_collection, {'trial_id': {'$in': trial_ids}}, selection,
+            sort=[('trial_id', Database.ASCENDING), ('seq', Database.ASCENDING)])
+
+        # Compressed items cannot be projected, fetch them whole
+        compressed_ids = [event['_id'] for event in events if 'codec' in event]
+        if compressed_ids:
+            compressed = dict(
+                (event['_id'], codec.decode(event['codec'], event['item']))
+                for event in db.read(cls.trial_statistics_collection,
+                                     {'_id': {'$in': compressed_ids}},
+                                     {'_id': 1, 'codec': 1, 'item': 1}))
+            for event in events:
+                if event.pop('codec', None):
+                    item = flatten(compressed[event['_id']])
+                    event['item'] = unflatten(
+                        dict((key, value) for key, value in item.items() if key in keys))
+
+        chunks = db.read(
+            "{}.columns".format(cls.trial_statistics_collection),
+            {'trial_id': {'$in': trial_ids}, 'key': {'$in': list(keys)}},
+            sort=[('trial_id', Database.ASCENDING), ('seq', Database.ASCENDING)])
+
+        return BulkStatistics.from_documents(
+            trial_ids, keys, events, chunks, ColumnarStatisticsWithDB.decode)
+
     class Statistic(object):
         """Container for a value object.
 
@@ -317,7 +414,8 @@ class Trial(object):
 
     __slots__ = ('_db', '_saved', '_status', '_refers',
                  '_tags', '_host', '_version', '_commandline', '_configuration',
-                 '_stdout', '_stderr', '_interval', '_statistics', '_artifacts')
+                 '_stdout', '_stderr', '_interval', '_statistics', '_columns', '_artifacts',
+                 '_statistics_cache', '_id', '_digests', '_report')
     _hashable = ('refers', 'commandline', 'configuration')
     # If defined, those in db should be identical.
     _immutable = ('host', 'version')
@@ -327,9 +425,21 @@ class Trial(object):
     interruptable_stati = ('running', )
     switchover_stati = ('reserved', 'broken', 'branched')
     acknowledgeable_stati = ('broken', )
+    # Statistics and artifacts are accessed through their full history
+    # Snapshots are single documents, large attributes like stdout would exceed the size limit
+    compactable_attributes = ('status', 'tags')
 
     trial_immutable_collection = 'trials.immutables'
     trial_report_collection = 'trials.reports'
+    trial_lease_collection = 'trials.leases'
+    trial_statistics_collection = 'statistics'
+    # Statistics are only compressed when large, so that typical ones can still be
+    # aggregated and projected by the database.
+    statistics_compression_threshold = 2 ** 16
+    # Number of seconds between heartbeats of running trials
+    heartbeat_rate = 10
+    # Number of heartbeats a running trial can miss before its lease expires
+    lease_coefficient = 10
     db_is_setup = False
 
     def __init__(self, commandline, configuration, version, refers, host, interval=(None, None)):
@@ -343,12 +453,24 @@ class Trial(object):
         self._configuration = sorteddict(configuration)
         self._version = sorteddict(version)
         self._host = sorteddict(host)
+        # Hashable and immutable fields are frozen, the id is computed once
+        self._id = hashlib.sha512(self.hash_string).hexdigest()
+        self._digests = {}
+        # Mutable fields of the report as last written by this process
+        self._report = None
         # Tags should be timeless
-        self._tags = EventBasedListAttributeWithDB(self.id, 'tags', (None, None))
+        self._tags = EventBasedListAttributeWithDB(self.id, 'tags', (None, None),
+                                                   compactable=True)
         self._status = EventBasedItemAttributeWithDB(self.id, 'status', interval)
         self._stdout = EventBasedListAttributeWithDB(self.id, 'stdout', interval)
         self._stderr = EventBasedListAttributeWithDB(self.id, 'stderr', interval)
-        self._statistics = EventBasedListAttributeWithDB(self.id, 'statistics', interval)
+        self._statistics = EventBasedListAttributeWithDB(
+            self.id, self.trial_statistics_collection, interval)
+        self._statistics.compress(threshold=self.statistics_compression_threshold)
+        self._columns = ColumnarStatisticsWithDB(
+            self.id, self.trial_statistics_collection, interval)
+        # Statistics indexed for the last event they were built from
+        self._statistics_cache = (None, None)
         self._artifacts = EventBasedFileAttributeWithDB(self.id, 'artifacts', interval)
         self._interval = interval
 
@@ -359,19 +481,9 @@ class Trial(object):
         # saved? We cannot infer? Then what?
 
     def _setup_db(self):
+        # Indexes are created once with `kleio db setup`
         if not Trial.db_is_setup:
-            try:
-                self._db.ensure_index(
-                    self.trial_report_collection,
-                    [('tags', Database.ASCENDING),
-                     ('registry.status', Database.ASCENDING)])
-                self._db.ensure_index(self.trial_report_collection, 'registry.status')
-                self._db.ensure_index(self.trial_report_collection, 'registry.start_time')
-                self._db.ensure_index(self.trial_report_collection, 'registry.end_time')
-            except BaseException as e:
-                if not "not authorized on" in str(e):
-                    raise
-
+            schema.check_version(self._db)
             Trial.db_is_setup = True
 
     # Use immutable collection for race conditions on id registration
@@ -393,6 +505,9 @@ class Trial(object):
         if status not in allowed_stati:
             raise RuntimeError(invalid_status_message.format(status=status, new_status=new_status))
 
+        # Buffered events must be written before the status transition is visible
+        self.flush()
+
         try:
             # If status changed from reserved meanwhile, than the id could be duplicate 
             # and this would raise a duplicate key error
@@ -401,8 +516,12 @@ class Trial(object):
             raise kleio.core.utils.errors.RaceCondition(
                 race_condition_message.format(new_status=new_status)) from e
 
+        if status == 'running' and new_status != 'running':
+            self._release_lease()
+
     def running(self):
         self._set_status('running', ['reserved'])
+        self._renew_lease()
 
     def reserve(self):
         # TODO: If status is broken given commandline to restore
@@ -417,11 +536,46 @@ class Trial(object):
     def failover(self):
         self._set_status('failover', ['running'])
 
-    def heartbeat(self):
-        self._set_status(
-            'running', ['running'],
-            "Trial with status '{status}' cannot have a heartbeat.",
-            "Trial status changed meanwhile. Heartbeat failed.")
+    def heartbeat(self, lease_duration=None):
+        """Renew the lease of a running trial
+
+        Liveness is recorded in a lease document updated in place rather than with new status
+        events. The status is reloaded to detect if it was changed meanwhile by another process.
+
+        Parameters
+        ----------
+        lease_duration: int, optional
+            Number of seconds before the lease expires. Defaults to
+            `Trial.lease_coefficient * Trial.heartbeat_rate`.
+
+        """
+        self._status.load()
+        if self.status != 'running':
+            raise RuntimeError("Trial status changed meanwhile. Heartbeat failed.")
+
+        self.flush()
+        self._renew_lease(lease_duration)
+
+    @property
+    def lease(self):
+        """Lease document of the trial, None if it is not running"""
+        leases = self._db.read(self.trial_lease_collection, {'_id': self.id})
+        return leases[0] if leases else None
+
+    def _renew_lease(self, lease_duration=None):
+        if lease_duration is None:
+            lease_duration = self.lease_coefficient * self.heartbeat_rate
+
+        now = datetime.datetime.utcnow()
+        lease = {
+            'last_seen': now,
+            'worker': "{}:{}".format(socket.gethostname(), os.getpid()),
+            'expires_at': now + datetime.timedelta(seconds=lease_duration)
+        }
+        self._db.write(self.trial_lease_collection, lease, query={'_id': self.id})
+
+    def _release_lease(self):
+        self._db.remove(self.trial_lease_collection, {'_id': self.id})
 
     def interrupt(self):
         self._set_status('interrupted', self.interruptable_stati)
@@ -464,7 +618,7 @@ class Trial(object):
     def tags(self, new_tags):
         for tag in new_tags:
             # if a tag is added meanwhile by another process this while key DuplicateKeyError
-            if tag not in self._tags.get():
+            if tag not in self._tags:
                 self._tags.append(tag)
 
     @property
@@ -484,11 +638,19 @@ class Trial(object):
 
     @property
     def start_time(self):
-        return self._status.history[0]['runtime_timestamp']
+        return self._status.first_timestamp
 
     @property
     def end_time(self):
-        return self._status.history[-1]['runtime_timestamp']
+        """Runtime timestamp of the last status change, or of the last heartbeat if running"""
+        end_time = self._status.last_timestamp
+        # Heartbeats renew the lease instead of adding status events
+        if self.status == 'running' and self._interval[1] is None:
+            lease = self.lease
+            if lease and lease['last_seen'] > end_time:
+                end_time = lease['last_seen']
+
+        return end_time
 
     @property
     def configuration(self):
@@ -556,26 +718,82 @@ class Trial(object):
             # TODO: Statistics and others
 
     def update(self):
-        # Mutable categorization
-        self._tags.load()
+        """Fetch new events of the attributes already loaded
 
-        # Mutable/evolving info
-        self._status.load()
-        self._stdout.load()
-        self._stderr.load()
+        Attributes which were never accessed are left untouched and will be loaded on first
+        access.
+        """
+        for attrname in self.__slots__:
+            attr = getattr(self, attrname, None)
+            if (isinstance(attr, (EventBasedAttributeWithDB, ColumnarStatisticsWithDB)) and
+                    attr.loaded):
+                attr.load()
+
+    def iter_logs(self, name='stdout', since=None, reverse=False, limit=None):
+        """Iterate over pages of lines of stdout or stderr read from the database
+
+        .. seealso:: :meth:`kleio.core.trial.attribute.EventBasedListAttributeWithDB.iter_pages`
+        """
+        return self._get_log(name).iter_pages(since=since, reverse=reverse, limit=limit)
+
+    def last_log_seq(self, name='stdout'):
+        """Return the sequence number of the newest event of stdout or stderr in the database"""
+        return self._get_log(name).newest_seq()
+
+    def iter_logs_after(self, name='stdout', seq=0):
+        """Iterate over pages of lines of stdout or stderr logged after the event `seq`
+
+        .. seealso::
+            :meth:`kleio.core.trial.attribute.EventBasedListAttributeWithDB.iter_pages_after`
+        """
+        return self._get_log(name).iter_pages_after(seq)
 
-        self._statistics.load()
-        self._artifacts.load()
+    def _get_log(self, name):
+        if name not in ('stdout', 'stderr'):
+            raise ValueError("Invalid log '{}', must be 'stdout' or 'stderr'".format(name))
+
+        return getattr(self, '_' + name)
+
+    def watch(self, attributes=('stdout', 'stderr', 'status')):
+        """Open a stream of the new events of the given attributes
+
+        .. seealso:: :meth:`kleio.core.io.database.AbstractDB.watch`
+
+        :raises :exc:`NotImplementedError`: if the database does not support change streams.
+
+        """
+        collection_names = [getattr(self, '_' + name).collection_name for name in attributes]
+        return self._db.watch(collection_names, {'trial_id': self.id})
+
+    def compact(self, attributes=('status', 'tags'), prune=False):
+        """Fold the events of the given attributes into snapshots
+
+        .. seealso:: :meth:`kleio.core.trial.attribute.EventBasedAttributeWithDB.compact`
+        """
+        for name in attributes:
+            if name not in self.compactable_attributes:
+                raise ValueError("Attribute '{}' cannot be compacted. Must be one of {}".format(
+                    name, self.compactable_attributes))
+
+            getattr(self, '_' + name).compact(prune=prune)
+
+    def flush(self):
+        """Write down events queued in buffered attributes"""
+        for attrname in self.__slots__:
+            attr = getattr(self, attrname, None)
+            if isinstance(attr, (EventBasedAttributeWithDB, ColumnarStatisticsWithDB)):
+                attr.flush()
 
     def save(self):
         # TODO: detect if not new, then update.
         # This will raise DuplicateKeyError if a concurrent trial with
         # identical id is written first in the database.
-        if not self._saved:
+        created = not self._saved
+        if created:
             self._save_immutable()
             self._saved = True
 
-        self._save_report()
+        self._save_report(created)
 
         return self
 
@@ -617,34 +835,54 @@ class Trial(object):
 
         # self._save_report()
 
-    def _save_report(self):
+    def _save_report(self, created=False):
+        """Write the fields of the report which changed since the last save
 
+        Immutable fields are only sent by the save which created the trial, with
+        `$setOnInsert`. Mutable fields are compared to the ones written last by this process and
+        only those which changed are set, so that saving a trial whose status did not change
+        writes nothing.
+        """
         query = {
             '_id': self.id
         }
 
-        trial_dict = {
-            # Immutable
-            '_id': self.id,
-            'refers': self.refers,
-            'commandline': self._commandline,
-            'configuration': self._configuration,
-            'version': self.version,
-            'host': self.host,
-
-            # Mutable
+        # Mutable
+        report = {
             'tags': self.tags,
-            'registry': {
-                'status': self.status,
-                'start_time': self.start_time,
-                'end_time': self.end_time
-            }
+            'registry.status': self.status,
+            'registry.start_time': self.start_time,
+            'registry.end_time': self.end_time
             # statisticts?
             # artifacts?
             # ressources?
         }
 
-        self._db.write(self.trial_report_collection, trial_dict, query=query)
+        if self._report is None and not created:
+            update = {'$set': report}
+        elif self._report is None:
+            update = {
+                '$set': report,
+                # Immutable
+                '$setOnInsert': {
+                    'refers': self.refers,
+                    'commandline': self._commandline,
+                    'configuration': self._configuration,
+                    'version': self.version,
+                    'host': self.host
+                }
+            }
+        else:
+            changes = dict((key, value) for key, value in report.items()
+                           if self._report.get(key) != value)
+            if not changes:
+                return
+
+            update = {'$set': changes}
+
+        self._db.write(self.trial_report_collection, update, query=query)
+        # Kept values must not change along with the attributes
+        self._report = copy.deepcopy(report)
 
     # def to_dict(self):
     #     """Needed to be able to convert `Trial` to `dict` form."""
@@ -679,7 +917,7 @@ class Trial(object):
     @property
     def status(self):
         """For meaning of property type, see `Trial.status`."""
-        if not self._status.history:
+        if not self._status.last_seq:
             self._status.set('new')
 
         return self._status.get()
@@ -698,7 +936,7 @@ class Trial(object):
         # if self.name:
         #     return self.name
 
-        return self.__hash__()
+        return self._id
 
     @property
     def short_id(self):
@@ -707,7 +945,13 @@ class Trial(object):
 
     @property
     def hash_string(self):
-        return "".join(str(getattr(self, name)) for name in self._hashable).encode('utf-8')
+        """Canonical encoding of the hashable fields
+
+        Identical to the concatenation of the strings of `refers`, `commandline` and
+        `configuration`, so that ids of existing trials do not change.
+        """
+        return "".join(canonical_str(getattr(self, name))
+                       for name in self._hashable).encode('utf-8')
 
     @property
     def hash_name(self):
@@ -721,7 +965,23 @@ class Trial(object):
 
             If a trial is a branch, his hash_name is computed based on the composed configuration.
         """
-        return hashlib.sha512(self.hash_string).hexdigest()
+        return self._id
+
+    def _digest(self, name):
+        if name not in self._digests:
+            self._digests[name] = canonical_digest(getattr(self, '_' + name))
+
+        return self._digests[name]
+
+    @property
+    def host_digest(self):
+        """Digest of the host, to compare it with :func:`kleio.core.utils.canonical_digest`"""
+        return self._digest('host')
+
+    @property
+    def version_digest(self):
+        """Digest of the version, to compare it with :func:`kleio.core.utils.canonical_digest`"""
+        return self._digest('version')
 
     def __hash__(self):
         """Return the hashname for this trial"""
@@ -744,9 +1004,19 @@ class Trial(object):
         #             statistics[key] = {}
 
         #         statistics[key]
-        return Statistics(self._statistics.history)
+        last_seq, statistics = self._statistics_cache
+        if last_seq != self._statistics.last_seq:
+            statistics = Statistics(self._statistics.history)
+            self._statistics_cache = (self._statistics.last_seq, statistics)
+
+        # Columnar statistics follow the event-based ones
+        columns = self._columns.get()
+        if columns.keys():
+            statistics = Statistics(columns=statistics.columns.merge(columns))
+
+        return statistics
 
-    def get_artifacts(self, filename, query):
+    def get_artifacts(self, filename, query, sort=None, limit=None):
         # statistics = {}
         # for event in self._statistics:
         #     for key in event['item'].keys():
@@ -754,13 +1024,80 @@ class Trial(object):
         #             statistics[key] = {}
 
         #         statistics[key]
-        return self._artifacts.get(filename, query)
+        return self._artifacts.get(filename, query, sort=sort, limit=limit)
+
+    def latest_artifact(self, filename, sort_by='runtime_timestamp', query=None):
+        """Return the artifact with the highest values of `sort_by`, ex: the last checkpoint
+
+        .. seealso:: :meth:`kleio.core.trial.attribute.EventBasedFileAttributeWithDB.latest`
+        """
+        return self._artifacts.latest(filename, sort_by, query)
 
     @property
     def resources(self):
         return []
 
+    def aggregate_statistics(self, keys, by=None, reducer='last', every=None, time_bucket=None):
+        """Aggregate statistics per bucket instead of loading all of them
+
+        Event-based statistics are aggregated by the database. Statistics of trials with
+        columnar statistics, including their event-based ones, are aggregated in process with
+        NumPy. Statistics compressed because they were larger than
+        `statistics_compression_threshold` are not aggregated by the database.
+
+        Parameters
+        ----------
+        keys: list of str
+            Statistics to aggregate. Nested statistics are accessed with dots, ex: `valid.loss`.
+        by: str, optional
+            Statistic whose values define the buckets, ex: `epoch` or `step`.
+        reducer: str, optional
+            One of 'last', 'first', 'min', 'max' or 'mean'. Defaults to 'last'.
+        every: int, optional
+            Only use one call to `add_statistic` every `every`.
+        time_bucket: float, optional
+            Duration of the buckets in seconds, based on the runtime timestamps.
+
+        :returns: A `Statistics` with one row per bucket. The values of the buckets are in the
+            statistic `by`, `runtime_timestamp` if `time_bucket` is given or `row` otherwise.
+
+        """
+        if by is not None:
+            name = by
+        elif time_bucket is not None:
+            name = 'runtime_timestamp'
+        else:
+            name = 'row'
+
+        aggregates = {}
+        if self._columns.exists():
+            columns = self.statistics.columns
+            for key in keys:
+                aggregates[key] = aggregate_columns(columns, key, by, reducer, every,
+                                                    time_bucket)
+        else:
+            for key in keys:
+                aggregates[key] = self._statistics.aggregate(
+                    aggregation_pipeline(key, by, reducer, every, time_bucket))
+
+        return Statistics.from_aggregates(aggregates, name)
+
+    def use_columnar_statistics(self, chunk_size=4096, max_delay=5.0):
+        """Store new statistics as chunks of NumPy arrays instead of one event per call
+
+        Statistics must then be numeric. Their rows follow the ones of the event-based
+        statistics already saved, with which they are merged in `statistics`.
+
+        .. seealso:: :class:`kleio.core.trial.columnar.ColumnarStatisticsWithDB`
+        """
+        self._columns.enable(chunk_size=chunk_size, max_delay=max_delay,
+                             first_row=len(self._statistics.history) + 1)
+
     def add_statistic(self, timestamp=None, creator=None, **statistics):
+        if self._columns.enabled:
+            self._columns.append(statistics, timestamp=timestamp, creator=creator)
+            return
+
         self._statistics.append(statistics, timestamp=timestamp, creator=creator)
 
     def add_artifact(self, filename, artifact, **attributes):
@@ -787,9 +1124,11 @@ class TrialView(object):
                         # Properties
                         ["id", "short_id", "tags", "status", "refers", "host", "version",
                          "commandline", "configuration", "stdout", "stderr", "interval",
-                         "hash_name", "start_time", "end_time", "statistics", "get_artifacts"] +
+                         "hash_name", "host_digest", "version_digest", "start_time", "end_time",
+                         "statistics", "get_artifacts", "latest_artifact",
+                         "lease", "aggregate_statistics"] +
                         # Methods
-                        ["update"])
+                        ["update", "watch", "iter_logs", "last_log_seq", "iter_logs_after"])
 
     def __init__(self, trial):
         trial._db = ReadOnlyDB(trial._db)
@@ -797,7 +1136,7 @@ class TrialView(object):
         # Attributes as well
         for attrname in trial.__slots__:
             attr = getattr(trial, attrname)
-            if isinstance(attr, EventBasedAttribute):
+            if isinstance(attr, (EventBasedAttribute, ColumnarStatisticsWithDB)):
                 attr._db = trial._db
 
         self._trial = trial
@@ -0,0 +1,400 @@
+import datetime
+import time
+
+import numpy
+
+from kleio.core.io import schema
+from kleio.core.io.database import Database, DuplicateKeyError
+from kleio.core.trial.attribute import _buffered_attributes
+from kleio.core.utils import flatten
+
+
+def _to_datetime64(timestamps):
+    return numpy.array(timestamps, dtype='datetime64[us]')
+
+
+def _to_array(values):
+    """Convert values to an array, using an array of objects if they have different shapes"""
+    try:
+        return numpy.array(values)
+    except ValueError:
+        array = numpy.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            array[i] = value
+        return array
+
+
+class Column(object):
+    """Values of a statistic with the rows and runtime timestamps at which they were logged
+
+    Rows are the sequence numbers of the calls to `add_statistic`, so that values of different
+    statistics logged together share the same row.
+    """
+
+    def __init__(self, rows, runtime_timestamps, values):
+        self.rows = rows
+        self.runtime_timestamps = runtime_timestamps
+        self.values = values
+
+    def __len__(self):
+        return len(self.rows)
+
+    def mask(self, mask):
+        return Column(self.rows[mask], self.runtime_timestamps[mask], self.values[mask])
+
+    @classmethod
+    def concatenate(cls, columns):
+        if len(columns) == 1:
+            return columns[0]
+
+        return cls(numpy.concatenate([column.rows for column in columns]),
+                   numpy.concatenate([column.runtime_timestamps for column in columns]),
+                   numpy.concatenate([column.values for column in columns]))
+
+
+class StatisticColumns(object):
+    """Read-only view of statistics as NumPy arrays
+
+    Statistics are flattened, so that `{'valid': {'loss': 0.1}}` is accessible with
+    `columns['valid.loss']`. Keys without dots can also be accessed as attributes.
+    """
+
+    def __init__(self, columns):
+        self._columns = columns
+
+    @classmethod
+    def from_events(cls, history):
+        """Build columns from the events of an event-based statistics attribute"""
+        rows = {}
+        runtime_timestamps = {}
+        values = {}
+        for row, event in enumerate(history, 1):
+            for key, value in flatten(event['item']).items():
+                rows.setdefault(key, []).append(row)
+                runtime_timestamps.setdefault(key, []).append(event['runtime_timestamp'])
+                values.setdefault(key, []).append(value)
+
+        return cls(dict(
+            (key, Column(numpy.array(rows[key], dtype=numpy.int64),
+                         _to_datetime64(runtime_timestamps[key]),
+                         _to_array(values[key])))
+            for key in rows))
+
+    def keys(self):
+        return sorted(self._columns.keys())
+
+    def column(self, key):
+        return self._columns[key]
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    def __getitem__(self, key):
+        return self._columns[key].values
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        try:
+            return self._columns[name].values
+        except KeyError:
+            raise AttributeError(name)
+
+    def merge(self, other):
+        """Append the columns of `other`, whose rows already follow the ones of `self`"""
+        columns = dict(self._columns)
+        for key, column in other._columns.items():
+            if key in columns:
+                column = Column.concatenate([columns[key], column])
+            columns[key] = column
+
+        return StatisticColumns(columns)
+
+    def __add__(self, other):
+        """Append the rows of `other` after the ones of `self`"""
+        offset = max([column.rows[-1] for column in self._columns.values() if len(column)] +
+                     [0])
+        return self.merge(StatisticColumns(dict(
+            (key, Column(column.rows + offset, column.runtime_timestamps, column.values))
+            for key, column in other._columns.items())))
+
+    def to_dict(self):
+        return dict((key, column.values.tolist()) for key, column in self._columns.items())
+
+    def __str__(self):
+        return "StatisticColumns({})".format(", ".join(self.keys()[:10]))
+
+
+class ColumnarStatisticsWithDB(object):
+    """Statistics stored as chunks of per-key arrays
+
+    Rows appended with `append` are queued in memory per key and written as a chunk document
+    when `chunk_size` rows are queued, when the oldest queued row waited more than `max_delay`
+    seconds, when `flush()` is called or at process exit.
+
+    Rows are numbered after the event-based statistics the trial had when columns were enabled,
+    so that both can be merged in a single `StatisticColumns`. Writers only read the sequence
+    number and row of the newest chunks, the chunks themselves are fetched by `get()`.
+
+    {
+        _id: <trial_id>.<seq>
+        seq:
+        trial_id:
+        creator_id:
+        key:
+        dtype:
+        shape: <shape of a single value>
+        length:
+        rows: <bytes of int64 array>
+        runtime_timestamps: <bytes of datetime64[us] array>
+        values: <bytes of the array of values>
+        first_row:
+        last_row:
+        first_runtime_timestamp:
+        runtime_timestamp: <runtime timestamp of the last row>
+        creation_timestamp:
+    }
+    """
+
+    page_size = 100
+
+    def __init__(self, trial_id, name, interval=(None, None)):
+        self._trial_id = trial_id
+        self.name = name
+        self._interval = interval
+        self._db = Database()
+        self.enabled = False
+        self.chunk_size = 4096
+        self.max_delay = 5.0
+        self._chunks = {}
+        self._cache = {}
+        self._pending = {}
+        self._oldest = None
+        self._last_seq = 0
+        self._last_row = 0
+        self._read_seq = 0
+        self._cursor_read = False
+        self._exists = False
+        self._loaded = False
+        schema.check_version(self._db)
+
+    @property
+    def collection_name(self):
+        return "{}.columns".format(self.name)
+
+    @property
+    def loaded(self):
+        """Whether the chunks were fetched from the database at least once"""
+        return self._loaded
+
+    def enable(self, chunk_size=4096, max_delay=5.0, first_row=1):
+        """Store new statistics as columns, numbering rows from `first_row` at least"""
+        self.enabled = True
+        self.chunk_size = chunk_size
+        self.max_delay = max_delay
+        self._last_row = max(self._last_row, first_row - 1)
+        _buffered_attributes.add(self)
+
+    def exists(self):
+        """Whether statistics of the trial are stored as columns"""
+        if not (self.enabled or self._chunks or self._exists):
+            # Columns are never removed, only a positive answer can be kept
+            self._exists = self._db.count(self.collection_name,
+                                          {'trial_id': self._trial_id}) > 0
+
+        return self.enabled or bool(self._chunks) or self._exists
+
+    def _materialize(self):
+        if not self._loaded:
+            self.load()
+
+    def load(self):
+        """Fetch chunks that are not already loaded"""
+        lower_bound, upper_bound = self._interval
+        query = {'trial_id': self._trial_id}
+        if lower_bound:
+            query['runtime_timestamp'] = {'$gte': lower_bound}
+        if upper_bound:
+            query['first_runtime_timestamp'] = {'$lte': upper_bound}
+
+        while True:
+            if self._read_seq:
+                query['seq'] = {'$gt': self._read_seq}
+
+            chunks = self._db.read(self.collection_name, query,
+                                   sort=[('seq', Database.ASCENDING)], limit=self.page_size)
+            for chunk in chunks:
+                self._add_chunk(chunk)
+
+            if len(chunks) < self.page_size:
+                break
+
+        self._loaded = True
+
+        return self
+
+    def _read_cursor(self):
+        """Fetch the highest sequence number and row written, without the arrays of the chunks
+
+        A chunk written early because a key reached `chunk_size` can hold higher rows than
+        chunks flushed later, so rows are sorted on their own.
+        """
+        newest = {}
+        for field in ['seq', 'last_row']:
+            chunks = self._db.read(self.collection_name, {'trial_id': self._trial_id},
+                                   selection={field: 1}, sort=[(field, Database.DESCENDING)],
+                                   limit=1)
+            newest[field] = chunks[0][field] if chunks else 0
+
+        self._last_seq = max(self._last_seq, newest['seq'])
+        self._last_row = max(self._last_row, newest['last_row'])
+        self._cursor_read = True
+
+    def _add_chunk(self, chunk):
+        column = self.decode(chunk)
+
+        lower_bound, upper_bound = self._interval
+        if lower_bound or upper_bound:
+            mask = numpy.ones(len(column), dtype=bool)
+            if lower_bound:
+                mask &= column.runtime_timestamps >= numpy.datetime64(lower_bound, 'us')
+            if upper_bound:
+                mask &= column.runtime_timestamps <= numpy.datetime64(upper_bound, 'us')
+            column = column.mask(mask)
+
+        self._chunks.setdefault(chunk['key'], []).append(column)
+        self._cache.pop(chunk['key'], None)
+        self._read_seq = max(self._read_seq, chunk['seq'])
+        self._last_seq = max(self._last_seq, chunk['seq'])
+        self._last_row = max(self._last_row, chunk['last_row'])
+
+    @staticmethod
+    def decode(chunk):
+        """Turn a chunk document into a `Column`"""
+        shape = (chunk['length'], ) + tuple(chunk['shape'])
+        return Column(
+            numpy.frombuffer(chunk['rows'], dtype=numpy.int64),
+            numpy.frombuffer(chunk['runtime_timestamps'], dtype='datetime64[us]'),
+            numpy.frombuffer(chunk['values'], dtype=numpy.dtype(chunk['dtype'])).reshape(shape))
+
+    def get(self):
+        """Return the statistics as a `StatisticColumns`, including rows not written yet"""
+        self._materialize()
+        columns = {}
+        for key in set(self._chunks) | set(self._pending):
+            parts = []
+            if key in self._chunks:
+                if key not in self._cache:
+                    self._cache[key] = Column.concatenate(self._chunks[key])
+                parts.append(self._cache[key])
+
+            if key in self._pending:
+                pending = self._pending[key]
+                parts.append(Column(numpy.array(pending['rows'], dtype=numpy.int64),
+                                    _to_datetime64(pending['runtime_timestamps']),
+                                    numpy.array(pending['values'])))
+
+            columns[key] = Column.concatenate(parts)
+
+        return StatisticColumns(columns)
+
+    def append(self, statistics, timestamp=None, creator=None):
+        """Queue a row of statistics
+
+        Rows of different creators are written in different chunks.
+
+        :raises: :exc:`TypeError`: if a value is not numeric or an array of numeric values.
+
+        """
+        if not (self._loaded or self._cursor_read):
+            self._read_cursor()
+
+        runtime_timestamp = timestamp if timestamp else datetime.datetime.utcnow()
+        if not isinstance(runtime_timestamp, datetime.datetime):
+            raise TypeError(
+                "Timestamp must be of type datetime.datetime, not '{}'".format(
+                    type(runtime_timestamp)))
+
+        values = {}
+        for key, value in flatten(statistics).items():
+            value = numpy.asarray(value)
+            if value.dtype.kind not in 'biuf':
+                raise TypeError(
+                    "Columnar statistics must be numeric, '{}' is of type '{}'".format(
+                        key, value.dtype))
+            values[key] = value
+
+        creator_id = creator if creator else self._trial_id
+        self._last_row += 1
+        for key, value in values.items():
+            pending = self._pending.get(key)
+            if pending and (pending['values'][0].shape != value.shape or
+                            pending['creator_id'] != creator_id):
+                self._write_chunk(key)
+                pending = None
+
+            if pending is None:
+                pending = self._pending[key] = {'rows': [], 'runtime_timestamps': [],
+                                                'values': [], 'creator_id': creator_id}
+
+            pending['rows'].append(self._last_row)
+            pending['runtime_timestamps'].append(runtime_timestamp)
+            pending['values'].append(value)
+
+            if len(pending['rows']) >= self.chunk_size:
+                self._write_chunk(key)
+
+        if self._oldest is None:
+            self._oldest = time.time()
+
+        if time.time() - self._oldest >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """Write all queued rows"""
+        for key in sorted(self._pending.keys()):
+            self._write_chunk(key)
+
+        self._oldest = None
+
+    def _write_chunk(self, key):
+        pending = self._pending.pop(key)
+        values = numpy.ascontiguousarray(numpy.array(pending['values']))
+        seq = self._last_seq + 1
+        chunk = {
+            '_id': "{}.{}".format(self._trial_id, seq),
+            'seq': seq,
+            'trial_id': self._trial_id,
+            'creator_id': pending['creator_id'],
+            'key': key,
+            'dtype': values.dtype.str,
+            'shape': list(values.shape[1:]),
+            'length': len(pending['rows']),
+            'rows': numpy.array(pending['rows'], dtype=numpy.int64).tobytes(),
+            'runtime_timestamps': _to_datetime64(pending['runtime_timestamps']).tobytes(),
+            'values': values.tobytes(),
+            'first_row': pending['rows'][0],
+            'last_row': pending['rows'][-1],
+            'first_runtime_timestamp': pending['runtime_timestamps'][0],
+            'runtime_timestamp': pending['runtime_timestamps'][-1],
+            'creation_timestamp': datetime.datetime.utcnow()
+        }
+
+        try:
+            self._db.write(self.collection_name, chunk)
+        except DuplicateKeyError:
+            # Put rows back in queue and fetch the chunks another process wrote meanwhile, so
+            # that the next write uses a free sequence number
+            self._pending[key] = pending
+            if self._loaded:
+                self.load()
+            else:
+                self._read_cursor()
+            raise
+
+        if self._loaded:
+            self._add_chunk(chunk)
+        else:
+            # Fetched with the other chunks by the next `get()`
+            self._last_seq = seq
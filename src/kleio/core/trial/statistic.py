@@ -1,97 +1,514 @@
-from collections import defaultdict
-import copy
+import numpy
 
-from .attribute import event_based_diff, unfold_event_based_diff
+from kleio.core.trial.columnar import _to_array, _to_datetime64, Column, StatisticColumns
+from kleio.core.utils import unflatten
+
+
+REDUCERS = {
+    'last': '$last',
+    'first': '$first',
+    'min': '$min',
+    'max': '$max',
+    'mean': '$avg'}
+
+
+def _validate_aggregation(reducer, by, time_bucket):
+    if reducer not in REDUCERS:
+        raise ValueError("Invalid reducer '{}', must be one of {}".format(
+            reducer, sorted(REDUCERS.keys())))
+
+    if by is not None and time_bucket is not None:
+        raise ValueError("Cannot aggregate both by a statistic and by time buckets")
+
+
+def aggregation_pipeline(key, by=None, reducer='last', every=None, time_bucket=None):
+    """Return the aggregation pipeline of one statistic on the events of a trial
+
+    Events are grouped by the values of the statistic `by`, by time buckets of `time_bucket`
+    seconds or, if none of them are given, each event is its own bucket. With `every`, only one
+    event every `every` is used, based on their sequence numbers.
+
+    Each resulting document contains the bucket as `_id`, the reduced `value` and the
+    `runtime_timestamp` of the last event of the bucket.
+    """
+    _validate_aggregation(reducer, by, time_bucket)
+
+    match = {'item.' + key: {'$exists': True}}
+    if by is not None:
+        match['item.' + by] = {'$exists': True}
+
+    pipeline = [{'$match': match}]
+    if every:
+        pipeline.append({'$match': {'$expr': {'$eq': [{'$mod': ['$seq', every]}, 0]}}})
+
+    if by is not None:
+        bucket = '$item.' + by
+    elif time_bucket is not None:
+        bucket = {'$subtract': [
+            '$runtime_timestamp',
+            {'$mod': [{'$toLong': '$runtime_timestamp'}, int(time_bucket * 1000)]}]}
+    else:
+        bucket = '$seq'
+
+    pipeline += [
+        {'$sort': {'seq': 1}},
+        {'$group': {'_id': bucket,
+                    'value': {REDUCERS[reducer]: '$item.' + key},
+                    'runtime_timestamp': {'$last': '$runtime_timestamp'}}},
+        {'$sort': {'_id': 1}}]
+
+    return pipeline
+
+
+def aggregate_columns(columns, key, by=None, reducer='last', every=None, time_bucket=None):
+    """Aggregate one statistic of `StatisticColumns` in process
+
+    .. seealso:: :func:`aggregation_pipeline` for arguments and format of the results.
+    """
+    _validate_aggregation(reducer, by, time_bucket)
+
+    if key not in columns or (by is not None and by not in columns):
+        return []
+
+    column = columns.column(key)
+    mask = numpy.ones(len(column), dtype=bool)
+    if every:
+        mask &= column.rows % every == 0
+
+    if by is not None:
+        by_column = columns.column(by)
+        positions = numpy.searchsorted(by_column.rows, column.rows)
+        clipped = numpy.minimum(positions, len(by_column) - 1)
+        mask &= (positions < len(by_column)) & (by_column.rows[clipped] == column.rows)
+        buckets = by_column.values[clipped[mask]]
+    elif time_bucket is not None:
+        timestamps = column.runtime_timestamps[mask].astype(numpy.int64)
+        buckets = (timestamps - timestamps % int(time_bucket * 1e6)).astype('datetime64[us]')
+    else:
+        buckets = column.rows[mask]
+
+    values = column.values[mask]
+    timestamps = column.runtime_timestamps[mask]
+    if not len(values):
+        return []
+
+    buckets, inverse = numpy.unique(buckets, return_inverse=True)
+    order = numpy.argsort(inverse, kind='stable')
+    starts = numpy.searchsorted(inverse[order], numpy.arange(len(buckets)))
+    ends = numpy.append(starts[1:], len(order))
+    values = values[order]
+
+    if reducer == 'last':
+        reduced = values[ends - 1]
+    elif reducer == 'first':
+        reduced = values[starts]
+    elif reducer == 'min':
+        reduced = numpy.minimum.reduceat(values, starts)
+    elif reducer == 'max':
+        reduced = numpy.maximum.reduceat(values, starts)
+    else:
+        counts = (ends - starts).reshape((-1, ) + (1, ) * (values.ndim - 1))
+        reduced = numpy.add.reduceat(values, starts) / counts
+
+    return [{'_id': bucket, 'value': value, 'runtime_timestamp': timestamp}
+            for bucket, value, timestamp
+            in zip(buckets.tolist(), reduced.tolist(), timestamps[order][ends - 1].tolist())]
+
+
+class Predicate(object):
+    """Selection of rows resulting from a comparison on a statistic, ex: `stats.epoch > 10`
+
+    Predicates can be combined with `&`, `|` and `~` and passed to `Statistics.where`.
+    """
+
+    def __init__(self, rows, universe):
+        self.rows = rows
+        self.universe = universe
+
+    def __and__(self, other):
+        return Predicate(numpy.intersect1d(self.rows, other.rows),
+                         numpy.intersect1d(self.universe, other.universe))
+
+    def __or__(self, other):
+        return Predicate(numpy.union1d(self.rows, other.rows),
+                         numpy.union1d(self.universe, other.universe))
+
+    def __invert__(self):
+        return Predicate(numpy.setdiff1d(self.universe, self.rows), self.universe)
 
 
 class Statistics(object):
-    def __init__(self, history, keys=None, sorted_by=tuple()):
-        if isinstance(history, (list, tuple)):
-            history = dict(zip(range(len(history)), history))
-        self.history = history
-        self._keys = keys
+    """Statistics of a trial indexed as NumPy arrays
+
+    Statistics are stored as one column per flattened key, with the rows (the calls to
+    `add_statistic`) at which each value was logged. A `Statistics` object is a selection of
+    rows over those columns, so that lookups, filters and groups only compute masks and never
+    copy the events.
+
+    Attribute access either groups the rows by the values of a statistic (`stats.epoch`) or
+    selects a nested dictionary of statistics (`stats.valid`). Groups are accessed by value
+    (`stats.epoch[10]`), by position when the value does not exist (`stats.epoch[-1]`) or by
+    slices of positions in the sorted values (`stats.epoch[-5:]`).
+    """
+
+    @classmethod
+    def from_aggregates(cls, aggregates, name):
+        """Build statistics with one row per bucket from results of aggregations
+
+        Parameters
+        ----------
+        aggregates: dict
+            Results of the aggregation of each statistic, as returned by
+            :func:`aggregate_columns` or by running :func:`aggregation_pipeline`.
+        name: str
+            Name of the statistic holding the values of the buckets.
+
+        """
+        buckets = {}
+        for documents in aggregates.values():
+            for document in documents:
+                bucket = buckets.setdefault(repr(document['_id']), document.copy())
+                bucket['runtime_timestamp'] = max(bucket['runtime_timestamp'],
+                                                  document['runtime_timestamp'])
+
+        buckets = sorted(buckets.values(), key=lambda document: document['_id'])
+        positions = dict((repr(document['_id']), row)
+                         for row, document in enumerate(buckets, 1))
+
+        columns = {}
+        columns[name] = Column(
+            numpy.arange(1, len(buckets) + 1, dtype=numpy.int64),
+            _to_datetime64([document['runtime_timestamp'] for document in buckets]),
+            _to_array([document['_id'] for document in buckets]))
+
+        for key, documents in aggregates.items():
+            columns[key] = Column(
+                numpy.array([positions[repr(document['_id'])] for document in documents],
+                            dtype=numpy.int64),
+                _to_datetime64([document['runtime_timestamp'] for document in documents]),
+                _to_array([document['value'] for document in documents]))
+
+        return cls(columns=StatisticColumns(columns))
+
+    def __init__(self, history=None, columns=None, rows=None, group_by=None):
+        if columns is None:
+            if isinstance(history, dict):
+                history = history.values()
+            columns = StatisticColumns.from_events(history or [])
+
+        self._columns = columns
+        if rows is None:
+            rows = numpy.unique(numpy.concatenate(
+                [columns.column(key).rows for key in columns.keys()] +
+                [numpy.array([], dtype=numpy.int64)]))
+        self._rows = rows
+        self._group_by = group_by
+        self._selected = {}
+        self._groups = None
+
+    @property
+    def rows(self):
+        """Sorted array of the rows in the selection"""
+        return self._rows
+
+    @property
+    def columns(self):
+        """`StatisticColumns` of the rows in the selection"""
+        return StatisticColumns(dict((key, self._column(key)) for key in self._keys()))
+
+    def _keys(self):
+        return [key for key in self._columns.keys() if key != self._group_by]
+
+    def _column(self, key):
+        """Return the column of `key` restricted to the selected rows"""
+        if key not in self._selected:
+            column = self._columns.column(key)
+            self._selected[key] = column.mask(numpy.isin(column.rows, self._rows))
+
+        return self._selected[key]
+
+    def _select(self, rows, group_by=None, columns=None):
+        return Statistics(columns=self._columns if columns is None else columns, rows=rows,
+                          group_by=group_by)
 
     def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
 
-        if self.history and isinstance(next(iter(self.history.values())), Statistics):
+        if self._group_by is not None:
             raise RuntimeError("Cannot fetch statistics on statistics...")
 
-        config = defaultdict(list)
-
-        subdict_detected = False
-        for i, event in enumerate(self.history.values()):
-            if name in event or name in event['item']:
-                event = copy.deepcopy(event)
-
-                if name in event:
-                    value = event.pop(name)
-                if name in event['item']:
-                    value = event['item'].pop(name)
-
-                if isinstance(value, dict):
-                    event['item'].update(value)
-                    config[name].append(event)
-                    subdict_detected = True
-                else:
-                    assert not subdict_detected
-                    config[value].append(event)
-
-        if subdict_detected:
-            assert len(config) == 1
-            statistics = Statistics(config[name])
-        else:
-            statistics = Statistics(dict((key, Statistics(history))
-                                    for key, history in config.items()),
-                                    keys=config.keys())
-        return statistics
+        if name in self._columns:
+            column = self._column(name)
+            if column.values.ndim > 1:
+                raise TypeError("Cannot group by non-scalar statistic '{}'".format(name))
+            return self._select(column.rows, group_by=name)
+
+        prefix = name + "."
+        nested = [key for key in self._columns.keys() if key.startswith(prefix)]
+        if not nested:
+            return self._select(numpy.array([], dtype=numpy.int64),
+                                columns=StatisticColumns({}))
+
+        columns = dict((key, self._columns.column(key)) for key in self._columns.keys()
+                       if not key.startswith(prefix))
+        columns.update((key[len(prefix):], self._columns.column(key)) for key in nested)
+        rows = numpy.unique(numpy.concatenate([self._column(key).rows for key in nested]))
+        return self._select(rows, columns=StatisticColumns(columns))
+
+    def _get_groups(self):
+        """Return the sorted distinct values of the group key and the rows of each group"""
+        if self._groups is None:
+            column = self._column(self._group_by)
+            try:
+                values, inverse = numpy.unique(column.values, return_inverse=True)
+            except TypeError:
+                # Values that cannot be sorted are kept in order of first appearance
+                values = []
+                inverse = []
+                for value in column.values.tolist():
+                    if value not in values:
+                        values.append(value)
+                    inverse.append(values.index(value))
+                inverse = numpy.array(inverse, dtype=numpy.int64)
+
+            order = numpy.argsort(inverse, kind='stable')
+            bounds = numpy.searchsorted(inverse[order], numpy.arange(len(values) + 1))
+            rows = [column.rows[order[start:end]] for start, end in zip(bounds[:-1], bounds[1:])]
+            self._groups = (values, rows)
+
+        return self._groups
+
+    def _find(self, value):
+        """Return the position of `value` in the sorted values, None if absent"""
+        values = self._get_groups()[0]
+        if isinstance(values, numpy.ndarray):
+            try:
+                position = numpy.searchsorted(values, value)
+            except TypeError:
+                return None
+            if position < len(values) and values[position] == value:
+                return int(position)
+            return None
+
+        return values.index(value) if value in values else None
 
     def __getitem__(self, index):
-        if self.keys is None:
-            raise RuntimeError("No keys available at this level. "
-                               "Fetch first from %s".format(self.attributes()))
-        # if index not in
-        return self.history[index]
+        if self._group_by is None:
+            if isinstance(index, str):
+                return getattr(self, index)
 
-    def to_dict(self):
-        config = {}
-        for key, event in self.history.items():
-            if isinstance(event, Statistics):
-                runtime_timestamp = min(event['runtime_timestamp']
-                                        for event in event.history.values())
-                event = dict(
-                    runtime_timestamp=runtime_timestamp,
-                    item=event.to_dict())
+            if isinstance(index, slice):
+                return self._select(self._rows[index])
+
+            row = self._rows[index]
+            item = {}
+            for key in self._keys():
+                column = self._column(key)
+                position = numpy.searchsorted(column.rows, row)
+                if position < len(column) and column.rows[position] == row:
+                    item[key] = column.values[position:position + 1].tolist()[0]
+
+            return unflatten(item)
+
+        values, rows = self._get_groups()
+        columns = StatisticColumns(dict(
+            (key, self._columns.column(key)) for key in self._keys()))
+
+        if isinstance(index, slice):
+            return self._select(
+                numpy.sort(numpy.concatenate(rows[index] + [numpy.array([], dtype=numpy.int64)])),
+                group_by=self._group_by)
+
+        position = self._find(index)
+        if position is None and isinstance(index, (int, numpy.integer)) and index < 0:
+            position = len(values) + index if -len(values) <= index else None
+
+        if position is None:
+            raise KeyError(index)
+
+        return self._select(numpy.sort(rows[position]), columns=columns)
+
+    @property
+    def values(self):
+        """Values of the statistic used to group the rows, in row order"""
+        if self._group_by is None:
+            raise RuntimeError("No values at this level. Fetch first from {}".format(
+                sorted(self.attributes())))
+
+        return self._column(self._group_by).values
+
+    def __array__(self, dtype=None):
+        return numpy.asarray(self.values, dtype=dtype)
+
+    def _compare(self, operator, other):
+        if self._group_by is None:
+            raise RuntimeError("Comparisons are only defined on a statistic, "
+                               "ex: stats.epoch > 10")
 
-            if self._keys is None:
-                prior = config
-            else:
-                prior = config.get(key, {})
+        column = self._column(self._group_by)
+        return Predicate(column.rows[operator(column.values, other)], self._rows)
 
-            new_start_time = event['runtime_timestamp']
-            diff = event_based_diff(None, new_start_time, prior, event['item'])
+    def __eq__(self, other):
+        return self._compare(numpy.equal, other)
 
-            if self._keys is None:
-                config = diff
-            else:
-                config[key] = diff
+    def __ne__(self, other):
+        return self._compare(numpy.not_equal, other)
 
-        return unfold_event_based_diff(config)
+    def __lt__(self, other):
+        return self._compare(numpy.less, other)
+
+    def __le__(self, other):
+        return self._compare(numpy.less_equal, other)
+
+    def __gt__(self, other):
+        return self._compare(numpy.greater, other)
+
+    def __ge__(self, other):
+        return self._compare(numpy.greater_equal, other)
+
+    __hash__ = object.__hash__
+
+    def where(self, predicate):
+        """Select the rows satisfying the predicate, ex: `stats.where(stats.epoch > 10)`"""
+        if not isinstance(predicate, Predicate):
+            predicate = numpy.asarray(predicate, dtype=bool)
+            predicate = Predicate(self._rows[predicate], self._rows)
+
+        return self._select(numpy.intersect1d(self._rows, predicate.rows),
+                            group_by=self._group_by)
+
+    @property
+    def history(self):
+        return dict(self.items())
 
     def keys(self):
-        return self._keys  # self.history.keys()
+        if self._group_by is None:
+            return None
+
+        values = self._get_groups()[0]
+        return values.tolist() if isinstance(values, numpy.ndarray) else list(values)
 
     def items(self):
-        return self.history.items()
+        if self._group_by is None:
+            return [(row, self[position]) for position, row in enumerate(self._rows.tolist())]
 
-    def attributes(self):
-        attributes = set()
-        for event in self.history.values():
-            if isinstance(event, Statistics):
-                attributes |= set(event.attributes())
-            else:
-                attributes |= set(event['item'].keys())
+        return [(value, self[value]) for value in self.keys()]
+
+    def __len__(self):
+        if self._group_by is None:
+            return len(self._rows)
+
+        return len(self._get_groups()[0])
+
+    def to_dict(self):
+        if self._group_by is not None:
+            return dict((value, group.to_dict()) for value, group in self.items())
 
-        return attributes
+        config = {}
+        for key in self._keys():
+            column = self._column(key)
+            if len(column):
+                config[key] = column.values.tolist()
+
+        return unflatten(config)
+
+    def attributes(self):
+        return set(key.split(".")[0] for key in self._keys() if len(self._column(key)))
 
     def __str__(self):
         return "Statistics({})".format(", ".join(str(k) for k in sorted(self.attributes())[:10]))
+
+
+class BulkStatistics(object):
+    """Statistics of several trials fetched together
+
+    Arrays are aligned with `trial_ids`, so that `bulk['loss'][i]` holds the values of the
+    statistic `loss` of trial `bulk.trial_ids[i]`. Trials which never logged a statistic have
+    an empty array.
+    """
+
+    def __init__(self, trial_ids, columns):
+        self.trial_ids = list(trial_ids)
+        self._columns = columns
+
+    @classmethod
+    def from_documents(cls, trial_ids, keys, events, chunks, decode):
+        """Build columns of each trial from statistics events and columnar chunks
+
+        Parameters
+        ----------
+        trial_ids: list of str
+            Order of the trials.
+        keys: list of str
+            Flattened keys of the statistics to keep.
+        events: list of dict
+            Statistics events of all trials, sorted by `seq` within each trial.
+        chunks: list of dict
+            Chunks of columnar statistics of all trials, sorted by `seq` within each trial.
+        decode: callable
+            Function turning a chunk into a `Column`.
+
+        """
+        histories = {}
+        for event in events:
+            event.setdefault('item', {})
+            histories.setdefault(event['trial_id'], []).append(event)
+
+        parts = {}
+        for chunk in chunks:
+            parts.setdefault(chunk['trial_id'], {}).setdefault(chunk['key'], []).append(
+                decode(chunk))
+
+        columns = {}
+        for trial_id in trial_ids:
+            trial_columns = StatisticColumns.from_events(histories.get(trial_id, []))
+            trial_columns = StatisticColumns(dict(
+                (key, trial_columns.column(key)) for key in keys if key in trial_columns))
+            if trial_id in parts:
+                # Columnar statistics follow the event-based ones
+                trial_columns = trial_columns.merge(StatisticColumns(dict(
+                    (key, Column.concatenate(key_parts))
+                    for key, key_parts in parts[trial_id].items())))
+            columns[trial_id] = trial_columns
+
+        return cls(trial_ids, columns)
+
+    def __len__(self):
+        return len(self.trial_ids)
+
+    def keys(self):
+        return sorted(set(key for columns in self._columns.values() for key in columns.keys()))
+
+    def _get_columns(self, key):
+        return [self._columns[trial_id].column(key) if key in self._columns[trial_id] else None
+                for trial_id in self.trial_ids]
+
+    def __getitem__(self, key):
+        """Return the list of arrays of values of `key`, one per trial"""
+        return [column.values if column is not None else numpy.array([])
+                for column in self._get_columns(key)]
+
+    def rows(self, key):
+        """Return the list of arrays of rows at which `key` was logged, one per trial"""
+        return [column.rows if column is not None else numpy.array([], dtype=numpy.int64)
+                for column in self._get_columns(key)]
+
+    def stack(self, key, fill=numpy.nan):
+        """Return a 2D array of shape (trials, values) of `key`, padded with `fill`"""
+        arrays = self[key]
+        stacked = numpy.full((len(arrays), max([len(array) for array in arrays] + [0])), fill)
+        for i, array in enumerate(arrays):
+            stacked[i, :len(array)] = array
+
+        return stacked
+
+    def statistics(self, trial_id):
+        """Return the `Statistics` of one trial"""
+        return Statistics(columns=self._columns[trial_id])
+
+    def items(self):
+        return [(trial_id, self.statistics(trial_id)) for trial_id in self.trial_ids]
+
+    def __str__(self):
+        return "BulkStatistics({} trials)".format(len(self))
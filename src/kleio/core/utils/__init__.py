@@ -13,6 +13,7 @@ from collections import defaultdict
 from glob import glob
 from importlib import import_module
 import copy
+import hashlib
 import logging
 import os
 import types
@@ -204,7 +205,37 @@ class SortedDict(dict):
         return str(self)
 
     def __str__(self):
-        return "{{{}}}".format(", ".join("{}: {}".format(k, v) for k, v in self.items()))
+        return canonical_str(self)
+
+
+def canonical_str(value):
+    """Return the string of a value as a `SortedDict` in a single pass
+
+    The result is identical to `str(sorteddict(value))`, on which ids of trials are computed,
+    without building the intermediate sorted dictionaries. Keys of dictionaries are sorted,
+    tuples are formatted as lists and items of lists with their `repr`.
+    """
+    if isinstance(value, dict):
+        return "{{{}}}".format(", ".join(
+            "{}: {}".format(key, canonical_str(item))
+            for key, item in sorted(dict.items(value), key=lambda pair: pair[0])))
+
+    if isinstance(value, (list, tuple)):
+        return "[{}]".format(", ".join(_canonical_repr(item) for item in value))
+
+    return str(value)
+
+
+def _canonical_repr(value):
+    if isinstance(value, (dict, list, tuple)):
+        return canonical_str(value)
+
+    return repr(value)
+
+
+def canonical_digest(value):
+    """Return the sha512 of the canonical string of a value, see :func:`canonical_str`"""
+    return hashlib.sha512(canonical_str(value).encode('utf-8')).hexdigest()
 
 
 def flatten(dictionary, returncopy=True):
@@ -10,6 +10,7 @@
 """
 import asyncio
 import concurrent
+import datetime
 import logging
 import os
 import pprint
@@ -17,6 +18,7 @@ import subprocess
 import tempfile
 import signal
 import sys
+import time
 
 import kleio.core.utils.errors
 from kleio.core.io.database import Database
@@ -97,13 +99,14 @@ class Consumer(object):
 
     """
 
-    def __init__(self, working_dir, capture=False):
+    def __init__(self, working_dir, capture=False, buffer_logs=False):
         """Initialize a consumer.
 
         """
         log.debug("Creating Consumer object.")
         self.root_working_dir = os.path.join(working_dir, 'kleio')
         self.capture = capture
+        self.buffer_logs = buffer_logs
 
     def consume(self, trial):
         """Execute user's script as a block box using the options contained within `trial`.
@@ -189,7 +192,8 @@ class Consumer(object):
 
         try:
             # loop.add_signal_handler(signal.SIGTERM, sigterm_handler)
-            returncode = execute(trial, capture=self.capture, cwd=working_dir, env=env)
+            returncode = execute(trial, capture=self.capture, cwd=working_dir, env=env,
+                                 buffer_logs=self.buffer_logs)
             # returncode = loop.run_until_complete(task)
         except kleio.core.utils.errors.SignalInterrupt as e:
             print(SIGNAL.format(trial=trial))
@@ -221,12 +225,13 @@ class Consumer(object):
 
  
 @asyncio.coroutine
-def update(trial, sleep_time=10):
+def update(trial, sleep_time=Trial.heartbeat_rate):
     while True:
         try:
             yield from asyncio.sleep(sleep_time)
-            trial.heartbeat()
-            # trial.save()
+            # The lease lasts many heartbeats so that a late heartbeat does not make the trial
+            # look dead.
+            trial.heartbeat(lease_duration=Trial.lease_coefficient * sleep_time)
         except RuntimeError as e:
             if "Trial status changed meanwhile. Heartbeat failed." in str(e):
                 trial.update()
@@ -243,11 +248,73 @@ def update(trial, sleep_time=10):
             print("update cancelled")
             break
         finally:
+            # Only the end time of the report changes, set to the last heartbeat
             trial.save()
 
     print("Exiting update")
 
 
+class LogChunker(object):
+    """Group consecutive lines of a stream into blocks saved as single events
+
+    A block is written when it reaches `max_bytes`, when its first line waited more than
+    `max_delay` seconds or when `flush()` is called. Each block records the runtime
+    timestamps of its first and last lines.
+    """
+
+    def __init__(self, attribute, max_bytes=2 ** 16, max_delay=1.0):
+        self.attribute = attribute
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.lines = []
+        self.nbytes = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.oldest = None
+
+    def append(self, line):
+        self.last_timestamp = datetime.datetime.utcnow()
+        if not self.lines:
+            self.first_timestamp = self.last_timestamp
+            self.oldest = time.time()
+
+        self.lines.append(line)
+        self.nbytes += len(line) + 1
+
+        if self.nbytes >= self.max_bytes or self.is_due():
+            self.flush()
+
+    def is_due(self):
+        return bool(self.lines) and time.time() - self.oldest >= self.max_delay
+
+    def flush(self):
+        if not self.lines:
+            return
+
+        lines, first_timestamp, last_timestamp = (
+            self.lines, self.first_timestamp, self.last_timestamp)
+        self.lines = []
+        self.nbytes = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.oldest = None
+        self.attribute.extend(lines, first_timestamp=first_timestamp, timestamp=last_timestamp)
+
+
+@asyncio.coroutine
+def flush_logs(chunkers, max_delay):
+    """Write blocks of quiet streams which waited more than `max_delay` seconds"""
+    while True:
+        try:
+            yield from asyncio.sleep(max_delay)
+        except concurrent.futures.CancelledError:
+            break
+
+        for chunker in chunkers:
+            if chunker.is_due():
+                chunker.flush()
+
+
 @asyncio.coroutine
 def log_stream(stdlist, stream, capture):
     while not stream.at_eof():
@@ -262,7 +329,18 @@ def log_stream(stdlist, stream, capture):
                 print(line)
 
 
-def execute(trial, cwd, env, capture=False, sleep_time=10):
+def execute(trial, cwd, env, capture=False, sleep_time=Trial.heartbeat_rate, buffer_logs=False,
+            chunk_bytes=2 ** 16, chunk_delay=1.0):
+
+    # Lines are saved in blocks of up to `chunk_bytes` or `chunk_delay` seconds of output
+    stdout = LogChunker(trial._stdout, max_bytes=chunk_bytes, max_delay=chunk_delay)
+    stderr = LogChunker(trial._stderr, max_bytes=chunk_bytes, max_delay=chunk_delay)
+
+    if buffer_logs:
+        # Write lines in batches rather than one document per line. Buffers are flushed
+        # at each heartbeat.
+        trial._stdout.buffer(max_delay=sleep_time)
+        trial._stderr.buffer(max_delay=sleep_time)
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -273,14 +351,20 @@ def execute(trial, cwd, env, capture=False, sleep_time=10):
     env['PYTHONUNBUFFERED'] = '1'
 
     update_task = asyncio.ensure_future(update(trial, sleep_time=sleep_time), loop=loop)
+    flush_task = asyncio.ensure_future(flush_logs([stdout, stderr], chunk_delay), loop=loop)
 
     try:
         returncode = loop.run_until_complete(
-            subprocess(trial.commandline.split(" "), stdout=trial._stdout, stderr=trial._stderr, env=env, cwd=cwd, capture=capture))
+            subprocess(trial.commandline.split(" "), stdout=stdout, stderr=stderr, env=env, cwd=cwd, capture=capture))
     finally:
         update_task.cancel()
+        flush_task.cancel()
         loop.run_until_complete(update_task)
+        loop.run_until_complete(flush_task)
         loop.close()
+        stdout.flush()
+        stderr.flush()
+        trial.flush()
 
     return returncode
 
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.client.logger`."""
+
+import io
+import threading
+
+import numpy
+import pytest
+
+from kleio.client.logger import AsyncWriter, Logger, RemoteFileWrapper, _copy_artifact
+
+
+@pytest.fixture()
+def artifact(tmpdir):
+    """Return a wrapper over a local artifact of 1000 bytes"""
+    path = tmpdir.join('artifact')
+    path.write_binary(bytes(range(250)) * 4)
+    with RemoteFileWrapper(open(str(path), 'rb')) as wrapper:
+        yield wrapper
+
+
+def test_mmap(artifact):
+    """Artifacts are memory-mapped read-only."""
+    view = artifact.mmap()
+    assert len(view) == 1000
+    assert view[250:253] == bytes([0, 1, 2])
+    with pytest.raises(TypeError):
+        view[0] = 1
+
+
+def test_read_range(artifact):
+    """Ranges are read without moving the position of the file."""
+    assert artifact.read_range(10, 3) == bytes([10, 11, 12])
+    assert artifact.remote_file.tell() == 0
+
+
+def test_readinto(artifact):
+    """Bytes are streamed into the buffer of the caller."""
+    buffer = bytearray(600)
+    assert artifact.readinto(buffer) == 600
+    assert artifact.readinto(buffer) == 400
+    assert buffer[:3] == bytes([100, 101, 102])
+
+
+def test_load_numpy(tmpdir):
+    """NumPy artifacts are memory-mapped from the artifact directory."""
+    path = str(tmpdir.join('weights.npy'))
+    numpy.save(path, numpy.arange(10))
+    with RemoteFileWrapper(open(path, 'rb')) as wrapper:
+        array = wrapper.load_numpy()
+        assert isinstance(array, numpy.memmap)
+        assert array.tolist() == list(range(10))
+
+    buffer = io.BytesIO()
+    numpy.save(buffer, numpy.arange(3))
+    buffer.seek(0)
+    assert RemoteFileWrapper(buffer).load_numpy().tolist() == [0, 1, 2]
+
+
+class TestAsyncWriter(object):
+    """Test writes in background threads"""
+
+    def test_order(self):
+        """Writes of the same kind are done in order, even with many threads."""
+        writer = AsyncWriter(queue_size=2, workers=3)
+        statistics = []
+        artifacts = []
+        for i in range(50):
+            writer.submit('statistics', statistics.append, i)
+            writer.submit('artifacts', artifacts.append, i)
+        writer.flush()
+
+        assert statistics == list(range(50))
+        assert artifacts == list(range(50))
+        writer.close()
+
+    def test_backpressure(self):
+        """Submitting blocks while the queue is full."""
+        writer = AsyncWriter(queue_size=1, workers=1)
+        release = threading.Event()
+        writer.submit('statistics', release.wait)
+        writer.submit('statistics', lambda: None)
+
+        submitter = threading.Thread(target=writer.submit, args=('statistics', lambda: None))
+        submitter.start()
+        submitter.join(0.1)
+        assert submitter.is_alive()
+
+        release.set()
+        submitter.join()
+        writer.close()
+
+    def test_error(self):
+        """Errors of writes are raised by the next call to flush."""
+        writer = AsyncWriter()
+        writer.submit('statistics', int, 'not a number')
+        with pytest.raises(RuntimeError) as exc:
+            writer.flush()
+        assert isinstance(exc.value.__cause__, ValueError)
+
+        writer.flush()
+        writer.close()
+        with pytest.raises(RuntimeError):
+            writer.submit('statistics', int, '1')
+
+
+class TestAsyncArtifacts(object):
+    """Test artifacts logged in background threads"""
+
+    class RecordingTrial(object):
+        """Record the statistics and the content of the artifacts added"""
+
+        def __init__(self):
+            self.statistics = []
+            self.artifacts = []
+
+        def add_statistic(self, **statistics):
+            self.statistics.append(statistics)
+
+        def add_artifact(self, filename, artifact, **attributes):
+            self.artifacts.append((filename, artifact.read(), attributes))
+
+        def flush(self):
+            pass
+
+    @pytest.fixture()
+    def logger(self):
+        """Return a logger writing asynchronously to a recording trial"""
+        logger = Logger.__new__(Logger)
+        logger.trial = self.RecordingTrial()
+        logger._writer = AsyncWriter()
+        yield logger
+        logger.close()
+
+    def test_copy(self, tmpdir):
+        """The rest of the file is copied, on disk above `max_size`."""
+        artifact = io.BytesIO(b'header data')
+        artifact.seek(7)
+        artifact_copy = _copy_artifact(artifact, max_size=2)
+        assert artifact_copy.read() == b'data'
+        assert artifact_copy._rolled
+
+    def test_closed(self, logger):
+        """Closed files are rejected right away."""
+        artifact = io.BytesIO(b'data')
+        artifact.close()
+        with pytest.raises(ValueError) as exc:
+            logger.log_artifact('model', artifact)
+        assert "closed file" in str(exc.value)
+
+    def test_reuse_file(self, logger):
+        """The file can be modified and closed once logged."""
+        release = threading.Event()
+        logger._writer.submit('artifacts', release.wait)
+
+        artifact = io.BytesIO(b'first')
+        logger.log_artifact('model', artifact, epoch=1)
+        artifact.seek(0)
+        artifact.write(b'other')
+        artifact.close()
+
+        release.set()
+        logger.flush()
+        assert logger.trial.artifacts == [('model', b'first', {'epoch': 1})]
+
+
+class TestAnalyzeLogger(object):
+    """Test the logger of analysis scripts"""
+
+    # AnalyzeLogger is replaced by BackupLogger when the tests are not executed by kleio
+    AnalyzeLogger = next(cls for cls in Logger.__subclasses__() if cls.__name__ == 'AnalyzeLogger')
+
+    @pytest.fixture()
+    def logger(self, monkeypatch):
+        """Return an analysis logger of a recording trial"""
+        class TrialNode(object):
+            @staticmethod
+            def load(trial_id):
+                return TestAsyncArtifacts.RecordingTrial()
+
+        monkeypatch.setattr('kleio.client.logger.TrialNode', TrialNode, raising=False)
+        return self.AnalyzeLogger('abc')
+
+    def test_inherited_logging(self, logger):
+        """Statistics and artifacts are logged with the methods of Logger."""
+        logger.log_statistic(epoch=1, loss=0.5)
+        logger.log_artifact('model', io.BytesIO(b'data'), epoch=1)
+        logger.flush()
+
+        assert logger.trial.statistics == [{'epoch': 1, 'loss': 0.5}]
+        assert logger.trial.artifacts == [('model', b'data', {'epoch': 1})]
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.cli.cat`."""
+import argparse
+import datetime
+import io
+
+import pytest
+
+from kleio.core.cli.cat import timestamp, write
+from kleio.core.evc.trial_node import TrialNode
+from kleio.core.trial.attribute import EventBasedListAttributeWithDB
+
+
+@pytest.fixture()
+def node(make_trial, monkeypatch):
+    """Return a node whose trial logged 10 lines, read by pages of 3 events"""
+    monkeypatch.setattr(EventBasedListAttributeWithDB, 'page_size', 3)
+    trial = make_trial()
+    start = datetime.datetime(2000, 1, 1)
+    for i in range(10):
+        trial._stdout.append('line {}'.format(i), timestamp=start + datetime.timedelta(seconds=i))
+    return TrialNode(trial.id, trial)
+
+
+def cat(node, **kwargs):
+    """Return the lines written by the command"""
+    stream = io.StringIO()
+    write(node, 'stdout', stream=stream, **kwargs)
+    return stream.getvalue().splitlines()
+
+
+def test_write_all(node):
+    """All lines are written in order."""
+    assert cat(node) == ['line {}'.format(i) for i in range(10)]
+
+
+def test_write_head(node):
+    """Only the first lines are written."""
+    assert cat(node, head=4) == ['line {}'.format(i) for i in range(4)]
+
+
+def test_write_tail(node):
+    """Only the last lines are written, in order."""
+    assert cat(node, tail=4) == ['line {}'.format(i) for i in range(6, 10)]
+
+
+def test_write_since(node):
+    """Only the lines logged after the timestamp are written."""
+    since = datetime.datetime(2000, 1, 1, 0, 0, 7)
+    assert cat(node, since=since) == ['line 7', 'line 8', 'line 9']
+    assert cat(node, since=since, tail=2) == ['line 8', 'line 9']
+
+
+def test_timestamp():
+    """Timestamps are parsed with or without time."""
+    assert timestamp('2000-01-02') == datetime.datetime(2000, 1, 2)
+    assert timestamp('2000-01-02 03:04:05') == datetime.datetime(2000, 1, 2, 3, 4, 5)
+    with pytest.raises(argparse.ArgumentTypeError):
+        timestamp('yesterday')
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.cli.cure`."""
+import datetime
+
+import pytest
+
+from kleio.core.cli.cure import extensive_cure, is_dead, quick_cure
+from kleio.core.trial.base import Trial
+
+
+def expire_lease(database, trial):
+    """Move the expiration of the lease of the trial in the past"""
+    expires_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    database.write(Trial.trial_lease_collection, {'expires_at': expires_at},
+                   query={'_id': trial.id})
+
+
+def make_legacy(database, trial, seconds_ago):
+    """Remove the lease of the trial as if it was executed before leases existed"""
+    database.remove(Trial.trial_lease_collection, {'_id': trial.id})
+    end_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds_ago)
+    database.write(Trial.trial_report_collection, {'registry.end_time': end_time},
+                   query={'_id': trial.id})
+
+
+def get_args(**kwargs):
+    """Return the arguments of the command line with defaults"""
+    args = {'threshold_coefficient': 10, 'print_only': False}
+    args.update(kwargs)
+    return args
+
+
+def test_is_dead():
+    """Test the lease has priority over the threshold on the last status change"""
+    now = datetime.datetime.utcnow()
+    long_ago = now - datetime.timedelta(days=1)
+    assert is_dead('a', 'running', long_ago, {'a'}, {'a'}, 10, now)
+    assert not is_dead('a', 'running', long_ago, {'a'}, set(), 10, now)
+    assert is_dead('a', 'running', long_ago, set(), set(), 10, now)
+    assert not is_dead('a', 'running', now, set(), set(), 10, now)
+    assert not is_dead('a', 'completed', long_ago, {'a'}, {'a'}, 10, now)
+
+
+@pytest.mark.parametrize('cure', [quick_cure, extensive_cure])
+def test_cure_expired_lease(ephemeral_db, running_trial, cure):
+    """Test trials whose lease expired are turned to failover"""
+    expire_lease(ephemeral_db, running_trial)
+    cure(ephemeral_db, {}, get_args())
+    assert Trial.load(running_trial.id).status == 'failover'
+
+
+@pytest.mark.parametrize('cure', [quick_cure, extensive_cure])
+def test_cure_valid_lease(ephemeral_db, running_trial, cure):
+    """Test trials with a valid lease are left running whatever their last status change"""
+    ephemeral_db.write(Trial.trial_report_collection,
+                       {'registry.end_time': datetime.datetime(2000, 1, 1)},
+                       query={'_id': running_trial.id})
+    cure(ephemeral_db, {}, get_args())
+    assert Trial.load(running_trial.id).status == 'running'
+
+
+def test_quick_cure_legacy(ephemeral_db, running_trial):
+    """Test trials without lease fall back on the threshold"""
+    make_legacy(ephemeral_db, running_trial, seconds_ago=Trial.heartbeat_rate * 5)
+    quick_cure(ephemeral_db, {}, get_args())
+    assert Trial.load(running_trial.id).status == 'running'
+
+    quick_cure(ephemeral_db, {}, get_args(threshold_coefficient=2))
+    assert Trial.load(running_trial.id).status == 'failover'
+
+
+def test_cure_print_only(ephemeral_db, running_trial, capsys):
+    """Test nothing is changed when only printing"""
+    expire_lease(ephemeral_db, running_trial)
+    quick_cure(ephemeral_db, {}, get_args(print_only=True))
+    assert Trial.load(running_trial.id).status == 'running'
+    assert "Turning {} to failover".format(running_trial.id[:7]) in capsys.readouterr().out
+
+
+def test_cure_other_status(ephemeral_db, running_trial):
+    """Test trials which are not running are never turned to failover"""
+    expire_lease(ephemeral_db, running_trial)
+    running_trial.suspend()
+    running_trial.save()
+    extensive_cure(ephemeral_db, {}, get_args())
+    assert Trial.load(running_trial.id).status == 'suspended'
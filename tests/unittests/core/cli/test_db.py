@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.cli.db`."""
+from kleio.core.cli import db
+from kleio.core.cli.base import KleioArgsParser
+
+
+def test_no_subcommand(monkeypatch, capsys):
+    """The help of the sub-commands is printed without one."""
+    # The default sub-command is selected based on sys.argv
+    monkeypatch.setattr('sys.argv', ['kleio', 'db'])
+    parser = KleioArgsParser()
+    db.add_subparser(parser.get_subparsers())
+    parser.execute(['db'])
+    out = capsys.readouterr().out
+    assert 'setup' in out
+    assert 'verify' in out
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.cli.tail`."""
+import pytest
+
+from kleio.core.cli import tail
+from kleio.core.evc.trial_node import TrialNode
+from kleio.core.trial.attribute import EventBasedListAttributeWithDB
+
+
+@pytest.fixture()
+def trial(running_trial, monkeypatch):
+    """Return a running trial which logged 10 lines, read by pages of 3 events"""
+    monkeypatch.setattr(EventBasedListAttributeWithDB, 'page_size', 3)
+    trial = running_trial
+    for i in range(10):
+        trial._stdout.append('line {}'.format(i))
+    return trial
+
+
+def test_last_lines(trial):
+    """Only the last lines are returned, in order."""
+    node = TrialNode.view(trial.id)
+    assert tail.last_lines(node) == ['line {}'.format(i) for i in range(5, 10)]
+    assert tail.last_lines(node, 2) == ['line 8', 'line 9']
+    assert not node.item._trial._stdout.loaded
+
+
+def test_main(trial, monkeypatch, capsys):
+    """The last lines are printed without following."""
+    monkeypatch.setattr(tail.TrialBuilder, 'build_database', lambda self, args: None)
+    monkeypatch.setattr(tail, 'get_trial_from_short_id',
+                        lambda args, trial_id: {'_id': trial.id})
+    tail.main({'id': trial.id[:7], 'follow': False})
+    assert capsys.readouterr().out.splitlines() == ['line {}'.format(i) for i in range(5, 10)]
+
+
+def test_follow(trial, monkeypatch, capsys):
+    """New lines are printed until the trial stops running."""
+    node = TrialNode.view(trial.id)
+    new_lines = [['line 10'], [], ['line 11', 'line 12']]
+    delays = []
+
+    def sleep(delay):
+        delays.append(delay)
+        lines = new_lines.pop(0)
+        for line in lines:
+            trial._stdout.append(line)
+        if not new_lines:
+            trial.complete()
+
+    monkeypatch.setattr(tail.time, 'sleep', sleep)
+    tail.follow(node.item, min_delay=1, max_delay=4)
+    assert capsys.readouterr().out.splitlines() == ['line 10', 'line 11', 'line 12']
+    assert delays == [2, 1, 2]
+    assert not node.item._trial._stdout.loaded
+    assert not node.item._trial._stderr.loaded
@@ -9,6 +9,9 @@ import os
 import pytest
 
 from kleio.core.io.convert import (JSONConverter, YAMLConverter)
+from kleio.core.io.database import Database
+from kleio.core.io.database.ephemeraldb import EphemeralDB
+from kleio.core.trial.base import Trial
 
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -53,6 +56,50 @@ def json_converter():
     return JSONConverter()
 
 
+@pytest.fixture()
+def ephemeral_db(null_db_instances):
+    """Return a fresh EphemeralDB singleton."""
+    EphemeralDB.instance = None
+    Trial.db_is_setup = False
+    return Database(of_type='EphemeralDB')
+
+
+@pytest.fixture(params=[False, True], ids=['events', 'columnar'])
+def columnar(request):
+    """Whether statistics are stored as events or as columns."""
+    return request.param
+
+
+@pytest.fixture()
+def make_trial(ephemeral_db):
+    """Return a function building saved trials, distinguished by their configuration.
+
+    Statistics are stored as columns by chunks of 4 rows if `columnar` is True. Trials branch
+    from `parent` if given.
+    """
+    def make_trial(columnar=False, parent=None, **configuration):
+        refers = {'parent_id': None, 'timestamp': None}
+        if parent is not None:
+            refers = {'parent_id': parent.id, 'timestamp': datetime.datetime.utcnow()}
+        trial = Trial.build(commandline=['python', 'script.py'], configuration=configuration,
+                            version={}, refers=refers, host={})
+        if columnar:
+            trial.use_columnar_statistics(chunk_size=4)
+        return trial
+
+    return make_trial
+
+
+@pytest.fixture()
+def running_trial(make_trial):
+    """Return a trial with status running and a valid lease."""
+    trial = make_trial(a=1)
+    trial.reserve()
+    trial.running()
+    trial.save()
+    return trial
+
+
 @pytest.fixture(scope='module')
 def space():
     """Construct a simple space with every possible kind of Dimension."""
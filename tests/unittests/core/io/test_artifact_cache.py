@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.io.artifact_cache`."""
+
+import os
+import threading
+
+import pytest
+
+from kleio.core.io import artifact_cache
+from kleio.core.io.artifact_cache import ArtifactCache
+
+
+@pytest.fixture()
+def sources(tmpdir):
+    """Return paths of 3 artifacts of 100 bytes"""
+    paths = {}
+    for key in ['aaa', 'bbb', 'ccc']:
+        path = tmpdir.join('store', key)
+        path.write_binary(key.encode() * 100, ensure=True)
+        paths[key] = str(path)
+    return paths
+
+
+@pytest.fixture()
+def cache(tmpdir):
+    """Return a cache of 700 bytes"""
+    return ArtifactCache(str(tmpdir.join('cache')), max_size=700)
+
+
+def test_fill(cache, sources):
+    """Artifacts are copied in the cache on first read."""
+    with cache.open('aaa', sources['aaa']) as f:
+        assert f.read() == b'aaa' * 100
+        assert f.name == cache.path('aaa')
+
+    os.remove(sources['aaa'])
+    with cache.open('aaa', sources['aaa']) as f:
+        assert f.read() == b'aaa' * 100
+
+
+def test_evict_least_recently_used(cache, sources):
+    """Least recently used artifacts are removed when the cache is full."""
+    for key, mtime in [('aaa', 1), ('bbb', 2)]:
+        cache.open(key, sources[key]).close()
+        os.utime(cache.path(key), (mtime, mtime))
+
+    # Using aaa makes bbb the least recently used
+    cache.open('aaa', sources['aaa']).close()
+    cache.open('ccc', sources['ccc']).close()
+
+    assert os.path.exists(cache.path('aaa'))
+    assert not os.path.exists(cache.path('bbb'))
+    assert os.path.exists(cache.path('ccc'))
+    assert cache.size() == 600
+
+
+def test_too_large(tmpdir, sources):
+    """Artifacts larger than the cache are read from the source."""
+    cache = ArtifactCache(str(tmpdir.join('cache')), max_size=100)
+    with cache.open('aaa', sources['aaa']) as f:
+        assert f.name == sources['aaa']
+    assert cache.size() == 0
+
+
+def test_wait_for_other_fill(cache, sources, monkeypatch):
+    """Readers wait for the artifact to be copied by the process holding the lock."""
+    monkeypatch.setattr(ArtifactCache, 'poll_interval', 0.01)
+    lock_path = cache.path('aaa') + artifact_cache.LOCK_SUFFIX
+    os.makedirs(os.path.dirname(lock_path))
+    open(lock_path, 'w').close()
+
+    def fill():
+        with open(cache.path('aaa'), 'wb') as f:
+            f.write(b'copied')
+        os.remove(lock_path)
+
+    timer = threading.Timer(0.05, fill)
+    timer.start()
+    with cache.open('aaa', sources['aaa']) as f:
+        assert f.read() == b'copied'
+    timer.join()
+
+
+def test_stale_lock(cache, sources, monkeypatch):
+    """Locks abandoned by killed processes are removed."""
+    monkeypatch.setattr(ArtifactCache, 'poll_interval', 0.01)
+    lock_path = cache.path('aaa') + artifact_cache.LOCK_SUFFIX
+    os.makedirs(os.path.dirname(lock_path))
+    open(lock_path, 'w').close()
+    os.utime(lock_path, (0, 0))
+
+    with cache.open('aaa', sources['aaa']) as f:
+        assert f.read() == b'aaa' * 100
+    assert not os.path.exists(lock_path)
+
+
+def test_get_artifact_cache(tmpdir, monkeypatch):
+    """The cache is configured by the environment."""
+    monkeypatch.delenv('KLEIO_ARTIFACT_CACHE_DIR', raising=False)
+    assert artifact_cache.get_artifact_cache() is None
+
+    monkeypatch.setenv('KLEIO_ARTIFACT_CACHE_DIR', str(tmpdir))
+    monkeypatch.setenv('KLEIO_ARTIFACT_CACHE_SIZE', '1000')
+    cache = artifact_cache.get_artifact_cache()
+    assert cache.root == str(tmpdir)
+    assert cache.max_size == 1000
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.io.artifact_store`."""
+
+import io
+import os
+
+import pytest
+
+from kleio.core.io.artifact_store import ArtifactStore
+
+
+class NonSeekable(io.RawIOBase):
+    """File-like object which can only be read once, like a socket"""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._data.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+@pytest.fixture()
+def store(ephemeral_db, tmpdir):
+    """Return an artifact store in a temporary directory."""
+    return ArtifactStore(ephemeral_db, str(tmpdir))
+
+
+def _blobs(store):
+    return [name for _, _, names in os.walk(store.root) for name in names]
+
+
+def test_identical_files_stored_once(store):
+    """Identical content is stored once and referenced twice."""
+    digest, size = store.put(io.BytesIO(b'vocabulary'))
+    assert store.put(io.BytesIO(b'vocabulary')) == (digest, size)
+    assert size == len(b'vocabulary')
+    assert _blobs(store) == [digest]
+    assert store.refcount(digest) == 2
+    with store.open(digest) as f:
+        assert f.read() == b'vocabulary'
+
+
+def test_non_seekable(store):
+    """Files which cannot be hashed first are spooled to a temporary file."""
+    digest, _ = store.put(io.BytesIO(b'checkpoint'))
+    assert store.put(NonSeekable(b'checkpoint'))[0] == digest
+    other_digest, _ = store.put(NonSeekable(b'other checkpoint'))
+    assert sorted(_blobs(store)) == sorted([digest, other_digest])
+
+
+def test_release(store):
+    """Blobs are deleted when they are not referenced anymore."""
+    digest, _ = store.put(io.BytesIO(b'checkpoint'))
+    store.put(io.BytesIO(b'checkpoint'))
+    store.release(digest)
+    assert store.exists(digest)
+    store.release(digest)
+    assert not store.exists(digest)
+    assert store.refcount(digest) == 0
+
+
+def test_release_concurrent_put(store, monkeypatch):
+    """Blobs referred again before being deleted are kept."""
+    digest, _ = store.put(io.BytesIO(b'checkpoint'))
+    remove = store.database.remove
+
+    def put_then_remove(collection_name, query):
+        if collection_name == store.blob_collection:
+            store.put(io.BytesIO(b'checkpoint'))
+        return remove(collection_name, query)
+
+    monkeypatch.setattr(store.database, 'remove', put_then_remove)
+    store.release(digest)
+    assert store.exists(digest)
+    assert store.refcount(digest) == 1
+
+
+def test_put_concurrent_release(store, monkeypatch):
+    """Blobs released while being referred again are kept."""
+    digest, _ = store.put(io.BytesIO(b'checkpoint'))
+    exists = store.exists
+
+    def release_then_exists(digest):
+        store.release(digest)
+        return exists(digest)
+
+    monkeypatch.setattr(store, 'exists', release_then_exists)
+    assert store.put(io.BytesIO(b'checkpoint'))[0] == digest
+    assert exists(digest)
+    assert store.refcount(digest) == 1
+
+
+def test_put_failed_upload(store, monkeypatch):
+    """References taken for uploads which failed are released."""
+    import kleio.core.io.artifact_store as artifact_store
+
+    def failing_pwrite(file_descriptor, chunk, offset):
+        raise IOError("Connection lost")
+
+    monkeypatch.setattr(artifact_store, '_pwrite', failing_pwrite)
+    with pytest.raises(IOError):
+        store.put(io.BytesIO(b'checkpoint'))
+    assert store.database.count(store.blob_collection) == 0
+
+
+def test_chunked_upload(store):
+    """Files are uploaded by chunks and committed as a single blob."""
+    data = bytes(range(256)) * 40
+    digest, size = store.put(NonSeekable(data), chunk_size=1000, workers=3)
+    assert size == len(data)
+    with store.open(digest) as f:
+        assert f.read() == data
+    assert not os.listdir(os.path.join(store.root, '.uploads'))
+    assert store.database.count(store.upload_collection) == 0
+
+
+def test_resume_upload(store, monkeypatch):
+    """Chunks written before an interruption are not written again."""
+    data = bytes(range(256)) * 40
+    import kleio.core.io.artifact_store as artifact_store
+    pwrite = artifact_store._pwrite
+    offsets = []
+
+    def interrupted_pwrite(file_descriptor, chunk, offset):
+        if offset >= 5000:
+            raise IOError("Connection lost")
+        offsets.append(offset)
+        pwrite(file_descriptor, chunk, offset)
+
+    monkeypatch.setattr(artifact_store, '_pwrite', interrupted_pwrite)
+    with pytest.raises(IOError):
+        store.upload(NonSeekable(data), upload_id='trial.1', chunk_size=1000, workers=1)
+    manifest = store.database.read(store.upload_collection, {'_id': 'trial.1'})[0]
+    assert sorted(manifest['chunks'].keys()) == ['0', '1', '2', '3', '4']
+
+    def resumed_pwrite(file_descriptor, chunk, offset):
+        offsets.append(offset)
+        pwrite(file_descriptor, chunk, offset)
+
+    offsets[:] = []
+    monkeypatch.setattr(artifact_store, '_pwrite', resumed_pwrite)
+    digest, size = store.upload(NonSeekable(data), upload_id='trial.1', chunk_size=1000)
+    assert sorted(offsets) == [5000, 6000, 7000, 8000, 9000, 10000]
+    with store.open(digest) as f:
+        assert f.read() == data
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.io.schema`."""
+
+import logging
+
+from kleio.core.io import schema
+
+
+def test_setup_and_verify(ephemeral_db):
+    """Setup creates all indexes and records the version."""
+    version, missing_indexes = schema.verify(ephemeral_db)
+    assert version is None
+    assert ('trials.immutables', 'refers.parent_id', False) in missing_indexes
+
+    schema.setup(ephemeral_db)
+    assert schema.verify(ephemeral_db) == (schema.SCHEMA_VERSION, [])
+
+    # Setup is idempotent
+    schema.setup(ephemeral_db)
+    assert ephemeral_db.count(schema.METADATA_COLLECTION) == 1
+
+
+def test_check_version_once(ephemeral_db, monkeypatch, caplog):
+    """Runtime check only reads the version once per process and warns if outdated."""
+    monkeypatch.setattr(schema, '_version_checked', False)
+    with caplog.at_level(logging.WARNING):
+        schema.check_version(ephemeral_db)
+        schema.check_version(ephemeral_db)
+
+    assert len([record for record in caplog.records if 'kleio db setup' in record.message]) == 1
+
+
+def test_check_version_up_to_date(ephemeral_db, monkeypatch, caplog):
+    """No warning once the schema was set up."""
+    schema.setup(ephemeral_db)
+    monkeypatch.setattr(schema, '_version_checked', False)
+    with caplog.at_level(logging.WARNING):
+        schema.check_version(ephemeral_db)
+
+    assert not caplog.records
+
+
+def test_artifact_indexes_cover_tiebreaker():
+    """Indexes on artifacts cover the sort of `latest`, including the tiebreaker on seq."""
+    indexes = [keys for collection_name, keys, _ in schema.get_indexes()
+               if collection_name == 'artifacts.metadata']
+    assert [('trial_id', schema.ASCENDING), ('filename', schema.ASCENDING),
+            ('epoch', schema.DESCENDING), ('seq', schema.DESCENDING)] in indexes
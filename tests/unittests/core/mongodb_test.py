@@ -388,7 +388,7 @@ class TestRemove(object):
         count_before = database.experiments.count()
         count_filt = database.experiments.count(filt)
         # call interface
-        assert kleio_db.remove('experiments', filt) is True
+        assert kleio_db.remove('experiments', filt) == count_filt
         assert database.experiments.count() == count_before - count_filt
         assert database.experiments.count() == 1
         assert list(database.experiments.find()) == [exp_config[0][3]]
@@ -398,7 +398,7 @@ class TestRemove(object):
         filt = {'_id': exp_config[0][0]['_id']}
         count_before = database.experiments.count()
         # call interface
-        assert kleio_db.remove('experiments', filt) is True
+        assert kleio_db.remove('experiments', filt) == 1
         assert database.experiments.count() == count_before - 1
         assert list(database.experiments.find()) == exp_config[0][1:]
 
@@ -0,0 +1,690 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.trial.attribute`."""
+
+import datetime
+import io
+
+import pytest
+
+from kleio.core.evc.trial_node import TrialNode
+from kleio.core.io.database import Database
+from kleio.core.trial.attribute import (
+    EventBasedFileAttributeWithDB, EventBasedItemAttributeWithDB, EventBasedListAttributeWithDB)
+from kleio.core.trial.base import Trial
+
+
+@pytest.fixture()
+def stdout(ephemeral_db):
+    """Return an empty compactable list attribute for trial 'abc'"""
+    return EventBasedListAttributeWithDB('abc', 'stdout', compactable=True)
+
+
+class TestBuffer(object):
+    """Test buffered writes of events"""
+
+    def test_no_buffer(self, ephemeral_db, stdout):
+        """Without a buffer, each event is written immediately."""
+        stdout.append('line 1')
+        assert ephemeral_db.count('stdout') == 1
+
+    def test_buffer_max_events(self, ephemeral_db, stdout):
+        """Events are written in a single batch when max_events is reached."""
+        stdout.buffer(max_events=3, max_delay=60)
+        stdout.append('line 1')
+        stdout.append('line 2')
+        assert ephemeral_db.count('stdout') == 0
+        assert stdout.get() == ['line 1', 'line 2']
+        stdout.append('line 3')
+        assert ephemeral_db.count('stdout') == 3
+
+    def test_buffer_max_bytes(self, ephemeral_db, stdout):
+        """Events are written when the items reach max_bytes."""
+        stdout.buffer(max_events=100, max_bytes=10, max_delay=60)
+        stdout.append('12345')
+        assert ephemeral_db.count('stdout') == 0
+        stdout.append('67890')
+        assert ephemeral_db.count('stdout') == 2
+
+    def test_buffer_max_delay(self, ephemeral_db, stdout, monkeypatch):
+        """Events are written when the oldest one waited more than max_delay."""
+        import kleio.core.trial.attribute
+        now = [0]
+        monkeypatch.setattr(kleio.core.trial.attribute.time, 'time', lambda: now[0])
+        stdout.buffer(max_events=100, max_delay=5)
+        stdout.append('line 1')
+        now[0] = 6
+        stdout.append('line 2')
+        assert ephemeral_db.count('stdout') == 2
+
+    def test_flush(self, ephemeral_db, stdout):
+        """Flush writes pending events and ids stay contiguous."""
+        stdout.buffer(max_events=100, max_delay=60)
+        stdout.append('line 1')
+        stdout.append('line 2')
+        stdout.flush()
+        stdout.append('line 3')
+        stdout.flush()
+        ids = [event['_id'] for event in ephemeral_db.read('stdout')]
+        assert ids == ['abc.1', 'abc.2', 'abc.3']
+
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout').load()
+        assert reloaded.get() == ['line 1', 'line 2', 'line 3']
+
+    def test_failed_flush(self, ephemeral_db, stdout, monkeypatch):
+        """Events stay in the buffer when they cannot be written."""
+        stdout.buffer(max_events=100, max_delay=60)
+        stdout.append('line 1')
+        stdout.append('line 2')
+
+        write = ephemeral_db.write
+
+        def failing_write(*args, **kwargs):
+            raise IOError("Connection lost")
+
+        monkeypatch.setattr(ephemeral_db, 'write', failing_write)
+        with pytest.raises(IOError):
+            stdout.flush()
+        assert ephemeral_db.count('stdout') == 0
+
+        monkeypatch.setattr(ephemeral_db, 'write', write)
+        stdout.flush()
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout').load()
+        assert reloaded.get() == ['line 1', 'line 2']
+
+
+class TestMaterializedState(object):
+    """Test incremental materialization of list and item attributes"""
+
+    def test_list_append_remove(self, stdout):
+        """Materialized list follows add and remove events."""
+        stdout.append('a')
+        stdout.append('b')
+        stdout.append('a')
+        stdout.remove('a')
+        assert stdout.get() == ['b', 'a']
+        assert 'a' in stdout
+        assert 'c' not in stdout
+        stdout.remove('a')
+        assert 'a' not in stdout
+        assert stdout.replay() == ['b']
+
+    def test_remove_missing(self, stdout):
+        """Cannot remove an item absent from the list."""
+        with pytest.raises(RuntimeError):
+            stdout.remove('a')
+
+    def test_get_copy(self, stdout):
+        """Modifying the returned list does not change the attribute."""
+        stdout.append('a')
+        items = stdout.get()
+        items.append('b')
+        stdout.append('c')
+        assert items == ['a', 'b']
+        assert stdout.get() == ['a', 'c']
+        assert 'b' not in stdout
+
+    def test_unhashable_items(self, stdout):
+        """Membership falls back on the list for unhashable items."""
+        stdout.append({'a': 1})
+        assert {'a': 1} in stdout
+        assert {'a': 2} not in stdout
+
+    def test_load(self, stdout):
+        """Loaded events update the materialized list."""
+        stdout.append('a')
+        stdout.append('b')
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout').load()
+        assert reloaded.get() == ['a', 'b']
+        assert 'b' in reloaded
+        stdout.append('c')
+        assert reloaded.load().get() == ['a', 'b', 'c']
+
+    def test_item(self, ephemeral_db):
+        """Materialized item is the last one set."""
+        status = EventBasedItemAttributeWithDB('abc', 'status')
+        with pytest.raises(IndexError):
+            status.get()
+        status.set('new')
+        status.set('reserved')
+        assert status.get() == 'reserved'
+        assert EventBasedItemAttributeWithDB('abc', 'status').load().get() == 'reserved'
+
+
+class TestSequence(object):
+    """Test sequence numbers of events"""
+
+    def test_seq_saved(self, ephemeral_db, stdout):
+        """Events carry an integer seq matching their _id."""
+        stdout.append('a')
+        stdout.append('b')
+        events = ephemeral_db.read('stdout')
+        assert [event['seq'] for event in events] == [1, 2]
+        assert [event['_id'] for event in events] == ['abc.1', 'abc.2']
+
+    def test_load_only_new(self, ephemeral_db, stdout, monkeypatch):
+        """Reloading only queries events with greater seq."""
+        stdout.append('a')
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout').load()
+        stdout.append('b')
+
+        queries = []
+        read = ephemeral_db.read
+
+        def spy_read(collection_name, query=None, *args, **kwargs):
+            queries.append(query)
+            return read(collection_name, query, *args, **kwargs)
+
+        monkeypatch.setattr(ephemeral_db, 'read', spy_read)
+        assert reloaded.load().get() == ['a', 'b']
+        assert queries[-1]['seq'] == {'$gt': 1}
+
+    def test_load_legacy_events(self, ephemeral_db):
+        """Events without seq get it from their _id."""
+        ephemeral_db.write('stdout', [
+            {'_id': 'abc.1', 'trial_id': 'abc', 'type': 'add', 'item': 'a'},
+            {'_id': 'abc.2', 'trial_id': 'abc', 'type': 'add', 'item': 'b'}])
+        stdout = EventBasedListAttributeWithDB('abc', 'stdout').load()
+        assert stdout.last_seq == 2
+        stdout.append('c')
+        assert ephemeral_db.read('stdout', {'seq': 3})[0]['_id'] == 'abc.3'
+
+
+class TestInterval(object):
+    """Test loading of events within an interval"""
+
+    def test_both_bounds_in_query(self, ephemeral_db, monkeypatch):
+        """Both bounds of the interval are sent to the database."""
+        stdout = EventBasedListAttributeWithDB('abc', 'stdout')
+        for i in range(5):
+            stdout.append(i, timestamp=datetime.datetime(2000, 1, 1 + i))
+
+        queries = []
+        read = ephemeral_db.read
+
+        def spy_read(collection_name, query=None, *args, **kwargs):
+            queries.append(query)
+            return read(collection_name, query, *args, **kwargs)
+
+        monkeypatch.setattr(ephemeral_db, 'read', spy_read)
+        interval = (datetime.datetime(2000, 1, 2), datetime.datetime(2000, 1, 4))
+        view = EventBasedListAttributeWithDB('abc', 'stdout', interval).load()
+        assert view.get() == [1, 2, 3]
+        assert queries[0]['runtime_timestamp'] == {'$gte': interval[0], '$lte': interval[1]}
+
+    def test_pagination(self, ephemeral_db, stdout, monkeypatch):
+        """Events are fetched by pages of page_size."""
+        for i in range(7):
+            stdout.append(i)
+
+        monkeypatch.setattr(EventBasedListAttributeWithDB, 'page_size', 3)
+        assert EventBasedListAttributeWithDB('abc', 'stdout').load().get() == list(range(7))
+
+    def test_selection(self, ephemeral_db, stdout):
+        """Projection keeps the fields required to replay the events."""
+        stdout.append('a')
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout').load(selection={'item': 1})
+        assert reloaded.get() == ['a']
+        assert 'creator_id' not in reloaded.history[0]
+
+
+class TestCompaction(object):
+    """Test snapshots of event-based attributes"""
+
+    def test_compact_and_load(self, ephemeral_db):
+        """Loading replays only the events following the snapshot."""
+        status = EventBasedItemAttributeWithDB('abc', 'status')
+        status.set('new', timestamp=datetime.datetime(2000, 1, 1))
+        status.set('reserved')
+        snapshot = status.compact()
+        assert snapshot['seq'] == 2
+        status.set('running')
+
+        reloaded = EventBasedItemAttributeWithDB('abc', 'status').load()
+        assert reloaded.get() == 'running'
+        assert [event['item'] for event in reloaded.history] == ['running']
+        assert reloaded.last_seq == 3
+        assert reloaded.first_timestamp == datetime.datetime(2000, 1, 1)
+
+        reloaded.set('completed')
+        assert ephemeral_db.read('status', {'seq': 4})[0]['item'] == 'completed'
+
+    def test_compact_list_prune(self, ephemeral_db, stdout):
+        """Pruning deletes the events folded in the snapshot."""
+        stdout.append('a')
+        stdout.append('b')
+        stdout.remove('a')
+        stdout.compact(prune=True)
+        assert ephemeral_db.count('stdout') == 0
+        stdout.append('c')
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout', compactable=True).load()
+        assert reloaded.get() == ['b', 'c']
+        assert 'b' in reloaded
+        assert reloaded.replay() == ['b', 'c']
+
+    def test_compact_prune_legacy(self, ephemeral_db):
+        """Pruning deletes legacy events without seq as well."""
+        timestamp = datetime.datetime(2000, 1, 1)
+        ephemeral_db.write('stdout', [
+            {'_id': 'abc.1', 'trial_id': 'abc', 'type': 'add', 'item': 'a',
+             'runtime_timestamp': timestamp},
+            {'_id': 'abc.2', 'trial_id': 'abc', 'type': 'add', 'item': 'b',
+             'runtime_timestamp': timestamp}])
+        stdout = EventBasedListAttributeWithDB('abc', 'stdout', compactable=True)
+        stdout.append('c')
+        stdout.compact(prune=True)
+        assert ephemeral_db.count('stdout') == 0
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout', compactable=True).load()
+        assert reloaded.get() == ['a', 'b', 'c']
+
+    def test_snapshot_within_interval(self, ephemeral_db, stdout):
+        """Views ending before the snapshot do not use it."""
+        stdout.append('a', timestamp=datetime.datetime(2000, 1, 1))
+        stdout.append('b', timestamp=datetime.datetime(2000, 1, 3))
+        stdout.compact()
+        view = EventBasedListAttributeWithDB(
+            'abc', 'stdout', (None, datetime.datetime(2000, 1, 2)),
+            compactable=True).load()
+        assert view.get() == ['a']
+
+    def test_not_compactable(self, ephemeral_db, monkeypatch):
+        """Snapshots of lists are not read unless they are compactable."""
+        EventBasedListAttributeWithDB('abc', 'stdout').append('a')
+
+        collections = []
+        read = ephemeral_db.read
+
+        def spy_read(collection_name, *args, **kwargs):
+            collections.append(collection_name)
+            return read(collection_name, *args, **kwargs)
+
+        monkeypatch.setattr(ephemeral_db, 'read', spy_read)
+        assert EventBasedListAttributeWithDB('abc', 'stdout').load().get() == ['a']
+        assert sum(EventBasedListAttributeWithDB('abc', 'stdout').iter_pages(), []) == ['a']
+        assert 'stdout.snapshots' not in collections
+
+    def test_last_timestamp_empty(self, ephemeral_db):
+        """Attributes without events nor snapshot have no last timestamp."""
+        status = EventBasedItemAttributeWithDB('abc', 'status')
+        with pytest.raises(IndexError) as exc:
+            status.last_timestamp
+        assert "Attribute 'status' has no events" in str(exc.value)
+
+    def test_compact_nothing(self, stdout):
+        """Nothing to compact without new events."""
+        assert stdout.compact() is None
+
+
+class TestLazyLoading(object):
+    """Test loading of events on first access"""
+
+    def test_load_on_access(self, ephemeral_db, stdout, monkeypatch):
+        """Events are only fetched when the attribute is accessed."""
+        stdout.append('a')
+
+        collections = []
+        read = ephemeral_db.read
+
+        def spy_read(collection_name, *args, **kwargs):
+            collections.append(collection_name)
+            return read(collection_name, *args, **kwargs)
+
+        monkeypatch.setattr(ephemeral_db, 'read', spy_read)
+        lazy = EventBasedListAttributeWithDB('abc', 'stdout')
+        assert not lazy.loaded
+        assert collections == []
+        assert 'a' in lazy
+        assert lazy.loaded
+        assert collections
+        n_reads = len(collections)
+        assert lazy.get() == ['a']
+        assert len(collections) == n_reads
+
+    def test_register_loads_first(self, ephemeral_db, stdout):
+        """New events follow the ones already saved even if never accessed."""
+        stdout.append('a')
+        lazy = EventBasedListAttributeWithDB('abc', 'stdout')
+        lazy.append('b')
+        assert lazy.get() == ['a', 'b']
+        assert ephemeral_db.read('stdout', {'seq': 2})[0]['item'] == 'b'
+
+    def test_trial_load_status_only(self, ephemeral_db, make_trial, monkeypatch):
+        """Loading a trial and reading its status does not fetch its logs."""
+        trial = make_trial()
+        trial._stdout.append('line')
+
+        collections = []
+        read = ephemeral_db.read
+
+        def spy_read(collection_name, *args, **kwargs):
+            collections.append(collection_name)
+            return read(collection_name, *args, **kwargs)
+
+        monkeypatch.setattr(ephemeral_db, 'read', spy_read)
+        loaded = Trial.load(trial.id)
+        assert loaded.status == 'new'
+        loaded.update()
+        assert 'stdout' not in collections
+        assert 'status' in collections
+        assert loaded.stdout == ['line']
+
+
+class TestExtend(object):
+    """Test blocks of items saved as single events"""
+
+    def test_extend_single_document(self, ephemeral_db, stdout):
+        """A block of lines is saved in one document and reassembled."""
+        start = datetime.datetime(2000, 1, 1)
+        end = datetime.datetime(2000, 1, 1, 0, 0, 1)
+        stdout.append('line 1')
+        stdout.extend(['line 2', 'line 3'], first_timestamp=start, timestamp=end)
+        stdout.append('line 4')
+        assert ephemeral_db.count('stdout') == 3
+        assert stdout.get() == ['line 1', 'line 2', 'line 3', 'line 4']
+        assert 'line 3' in stdout
+
+        event = ephemeral_db.read('stdout', {'type': 'extend'})[0]
+        assert event['first_runtime_timestamp'] == start
+        assert event['runtime_timestamp'] == end
+
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout')
+        assert reloaded.get() == ['line 1', 'line 2', 'line 3', 'line 4']
+
+    def test_first_timestamp(self, ephemeral_db, stdout):
+        """The first timestamp of a block is the one of its first line."""
+        start = datetime.datetime(2000, 1, 1)
+        stdout.extend(['line 1', 'line 2'], first_timestamp=start,
+                      timestamp=datetime.datetime(2000, 1, 2))
+        assert stdout.first_timestamp == start
+
+    def test_compact(self, ephemeral_db, stdout):
+        """Blocks are folded in snapshots like other events."""
+        stdout.extend(['line 1', 'line 2'])
+        stdout.remove('line 1')
+        stdout.compact(prune=True)
+        assert EventBasedListAttributeWithDB('abc', 'stdout', compactable=True).get() == ['line 2']
+
+
+class TestCompression(object):
+    """Test compression of large items"""
+
+    def test_small_items_raw(self, ephemeral_db, stdout):
+        """Items below the threshold are saved as is."""
+        stdout.append('line 1')
+        event = ephemeral_db.read('stdout')[0]
+        assert event['item'] == 'line 1'
+        assert 'codec' not in event
+
+    @pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+    def test_large_items_compressed(self, ephemeral_db, stdout, codec):
+        """Items above the threshold are compressed and decompressed on load."""
+        lines = ['epoch {} loss 0.1'.format(i) for i in range(1000)]
+        stdout.compress(codec=codec, threshold=100)
+        stdout.extend(lines)
+        event = ephemeral_db.read('stdout')[0]
+        assert event['codec'] == codec
+        assert isinstance(event['item'], bytes)
+        assert len(event['item']) < len(''.join(lines))
+        assert stdout.get() == lines
+
+        assert EventBasedListAttributeWithDB('abc', 'stdout').get() == lines
+
+    def test_no_codec(self, ephemeral_db, stdout):
+        """Compression can be disabled."""
+        stdout.compress(codec=None)
+        stdout.extend(['line'] * 1000)
+        assert 'codec' not in ephemeral_db.read('stdout')[0]
+
+    def test_invalid_codec(self, stdout):
+        """Unknown codecs are rejected."""
+        stdout.compress(codec='unknown', threshold=0)
+        with pytest.raises(ValueError) as exc:
+            stdout.append('line')
+        assert "Invalid codec 'unknown'" in str(exc.value)
+
+    def test_compressed_snapshot(self, ephemeral_db, stdout):
+        """Large snapshots are compressed as well."""
+        stdout.compress(threshold=100)
+        for i in range(100):
+            stdout.append('line {}'.format(i))
+        stdout.compact(prune=True)
+        assert ephemeral_db.read('stdout.snapshots')[0]['codec'] == 'zlib'
+
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout', compactable=True)
+        assert reloaded.get() == ['line {}'.format(i) for i in range(100)]
+
+
+class TestIterPages(object):
+    """Test streaming of list attributes from the database"""
+
+    @pytest.fixture()
+    def lines(self, stdout):
+        """Save 10 lines, some of them in blocks"""
+        start = datetime.datetime(2000, 1, 1)
+        for i in range(0, 10, 2):
+            stdout.append('line {}'.format(i), timestamp=start + datetime.timedelta(seconds=i))
+            stdout.extend(['line {}'.format(i + 1)],
+                          timestamp=start + datetime.timedelta(seconds=i + 1))
+        return ['line {}'.format(i) for i in range(10)]
+
+    def test_pages(self, stdout, lines, monkeypatch):
+        """Items are read by pages and not kept in the history."""
+        monkeypatch.setattr(EventBasedListAttributeWithDB, 'page_size', 3)
+        reloaded = EventBasedListAttributeWithDB('abc', 'stdout')
+        pages = list(reloaded.iter_pages())
+        assert [len(page) for page in pages] == [3, 3, 3, 1]
+        assert sum(pages, []) == lines
+        assert not reloaded.loaded
+
+    def test_reverse_limit(self, stdout, lines, monkeypatch):
+        """The last items are read first and reading stops at the limit."""
+        monkeypatch.setattr(EventBasedListAttributeWithDB, 'page_size', 3)
+        assert sum(stdout.iter_pages(reverse=True, limit=4), []) == lines[::-1][:4]
+        assert sum(stdout.iter_pages(limit=4), []) == lines[:4]
+
+    def test_since(self, stdout, lines):
+        """Items older than `since` are not read."""
+        since = datetime.datetime(2000, 1, 1, 0, 0, 7)
+        assert sum(stdout.iter_pages(since=since), []) == lines[7:]
+
+    def test_snapshot(self, ephemeral_db, stdout, lines):
+        """Items folded in a snapshot are read from it."""
+        stdout.compact(prune=True)
+        stdout.append('line 10')
+        assert sum(stdout.iter_pages(), []) == lines + ['line 10']
+        assert sum(stdout.iter_pages(reverse=True), []) == (lines + ['line 10'])[::-1]
+
+    def test_snapshot_pages(self, stdout, lines, monkeypatch):
+        """Items folded in a snapshot are yielded by pages as well."""
+        stdout.compact(prune=True)
+        monkeypatch.setattr(EventBasedListAttributeWithDB, 'page_size', 4)
+        pages = list(stdout.iter_pages())
+        assert [len(page) for page in pages] == [4, 4, 2]
+        assert sum(pages, []) == lines
+        pages = list(stdout.iter_pages(reverse=True, limit=6))
+        assert [len(page) for page in pages] == [4, 2]
+        assert sum(pages, []) == lines[::-1][:6]
+
+    def test_remove(self, stdout, lines):
+        """Lists with removed items cannot be streamed."""
+        stdout.remove('line 0')
+        with pytest.raises(ValueError) as exc:
+            list(stdout.iter_pages())
+        assert "Cannot stream items of 'stdout'" in str(exc.value)
+
+    def test_trial_logs(self, make_trial):
+        """Trials stream their stdout and stderr only."""
+        trial = make_trial()
+        trial._stdout.append('out')
+        trial._stderr.append('err')
+        assert list(trial.iter_logs()) == [['out']]
+        assert list(trial.iter_logs('stderr')) == [['err']]
+        with pytest.raises(ValueError) as exc:
+            trial.iter_logs('tags')
+        assert "Invalid log 'tags'" in str(exc.value)
+
+    def test_lineage(self, make_trial):
+        """Lines of the parents come first, and are only read in reverse if needed."""
+        parent = make_trial()
+        parent._stdout.append('parent 0')
+        parent._stdout.append('parent 1')
+        child = make_trial(parent=parent, child=True)
+        child._stdout.append('child 0')
+        parent._stdout.append('parent 2')
+
+        node = TrialNode(child.id, child)
+        assert sum(node.iter_logs(), []) == ['parent 0', 'parent 1', 'child 0']
+        assert sum(node.iter_logs(reverse=True, limit=2), []) == ['child 0', 'parent 1']
+
+        node = TrialNode(child.id, child)
+        assert sum(node.iter_logs(reverse=True, limit=1), []) == ['child 0']
+        assert node._parent is None
+
+
+class TestLatest(object):
+    """Test fetching the latest artifact"""
+
+    @pytest.fixture()
+    def artifacts(self, ephemeral_db):
+        """Save checkpoints of 5 epochs, logged in a shuffled order"""
+        artifacts = EventBasedFileAttributeWithDB('abc', 'artifacts')
+        for epoch in [2, 4, 0, 3, 1]:
+            artifacts.add('checkpoint', io.BytesIO(b'epoch ' + str(epoch).encode()),
+                          {'epoch': epoch, 'loss': 1. / (epoch + 1)})
+        artifacts.add('config', io.BytesIO(b'config'), {})
+        return artifacts
+
+    def test_sort_by(self, artifacts):
+        """The artifact with the highest value is returned."""
+        file_like_object, metadata = artifacts.latest('checkpoint', sort_by='epoch')
+        assert file_like_object.read() == b'epoch 4'
+        assert metadata['epoch'] == 4
+
+    def test_sort_order(self, artifacts):
+        """Sort orders can be given explicitly."""
+        _, metadata = artifacts.latest('checkpoint', sort_by=[('loss', Database.ASCENDING)])
+        assert metadata['epoch'] == 4
+        _, metadata = artifacts.latest('checkpoint', sort_by=[('loss', Database.DESCENDING)])
+        assert metadata['epoch'] == 0
+
+    def test_default(self, artifacts):
+        """The last artifact logged is returned by default."""
+        _, metadata = artifacts.latest('checkpoint')
+        assert metadata['epoch'] == 1
+
+    def test_query(self, artifacts):
+        """Artifacts are filtered before sorting."""
+        _, metadata = artifacts.latest('checkpoint', 'epoch', query={'epoch': {'$lte': 2}})
+        assert metadata['epoch'] == 2
+        assert artifacts.latest('missing', 'epoch') is None
+
+    def test_lineage(self, make_trial):
+        """The latest artifact is searched in parents as well."""
+        parent = make_trial()
+        for epoch in range(3):
+            parent.add_artifact('checkpoint', io.BytesIO(b'parent'), epoch=epoch)
+        child = make_trial(parent=parent, child=True)
+        child.add_artifact('checkpoint', io.BytesIO(b'child'), epoch=1)
+
+        node = TrialNode(child.id, child)
+        file_like_object, metadata = node.latest_artifact('checkpoint', sort_by='epoch')
+        assert file_like_object.read() == b'parent'
+        assert metadata['epoch'] == 2
+
+        child.add_artifact('checkpoint', io.BytesIO(b'child'), epoch=2)
+        file_like_object, metadata = node.latest_artifact('checkpoint', sort_by='epoch')
+        assert file_like_object.read() == b'child'
+
+
+class TestLoadMany(object):
+    """Test loading attributes of many trials at once"""
+
+    @pytest.fixture()
+    def reads(self, ephemeral_db, monkeypatch):
+        """Record the collections read or aggregated"""
+        reads = []
+
+        def record(method):
+            def recording_method(collection_name, *args, **kwargs):
+                reads.append(collection_name)
+                return method(collection_name, *args, **kwargs)
+
+            return recording_method
+
+        monkeypatch.setattr(ephemeral_db, 'read', record(ephemeral_db.read))
+        monkeypatch.setattr(ephemeral_db, 'aggregate', record(ephemeral_db.aggregate))
+        return reads
+
+    @pytest.fixture()
+    def saved(self, ephemeral_db):
+        """Save statuses of 3 trials, the one of 'b' being compacted"""
+        start = datetime.datetime(2000, 1, 1)
+        for i, trial_id in enumerate(['a', 'b', 'c']):
+            status = EventBasedItemAttributeWithDB(trial_id, 'status')
+            for j, value in enumerate(['new', 'reserved', 'running'][:i + 1]):
+                status.set(value, timestamp=start + datetime.timedelta(seconds=j))
+            if trial_id == 'b':
+                status.compact(prune=True)
+
+    def test_load_many(self, saved, reads):
+        """Events of all trials are read with one query, snapshots with another."""
+        statuses = [EventBasedItemAttributeWithDB(trial_id, 'status')
+                    for trial_id in ['a', 'b', 'c', 'd']]
+        EventBasedItemAttributeWithDB.load_many(statuses)
+
+        assert sorted(reads) == ['status', 'status.snapshots']
+        assert all(status.loaded for status in statuses)
+        assert [status.get() for status in statuses[:3]] == ['new', 'reserved', 'running']
+        assert [status.last_seq for status in statuses] == [1, 2, 3, 0]
+        assert len(reads) == 2
+
+        statuses[2].set('completed')
+        assert EventBasedItemAttributeWithDB('c', 'status').get() == 'completed'
+
+    def test_newest_snapshot_only(self, ephemeral_db, saved, monkeypatch):
+        """Only the newest snapshot and the events following it are read."""
+        status = EventBasedItemAttributeWithDB('b', 'status')
+        status.set('running')
+        status.compact()
+        status.set('completed')
+
+        queries = []
+        read = ephemeral_db.read
+
+        def spy_read(collection_name, query, *args, **kwargs):
+            documents = read(collection_name, query, *args, **kwargs)
+            queries.append((query, len(documents)))
+            return documents
+
+        monkeypatch.setattr(ephemeral_db, 'read', spy_read)
+        statuses = [EventBasedItemAttributeWithDB(trial_id, 'status') for trial_id in 'abc']
+        EventBasedItemAttributeWithDB.load_many(statuses)
+        assert [status.get() for status in statuses] == ['new', 'completed', 'running']
+        assert [event['item'] for event in statuses[1].history] == ['completed']
+        (query, n_events), = queries
+        assert {'trial_id': 'b', 'seq': {'$gt': 3}} in query['$or']
+        assert n_events == 1 + 1 + 3
+
+    def test_interval(self, saved):
+        """Events outside of the interval are not loaded."""
+        interval = (None, datetime.datetime(2000, 1, 1, 0, 0, 1))
+        statuses = [EventBasedItemAttributeWithDB(trial_id, 'status', interval)
+                    for trial_id in ['a', 'c']]
+        EventBasedItemAttributeWithDB.load_many(statuses)
+        assert [status.get() for status in statuses] == ['new', 'reserved']
+
+    def test_trials(self, make_trial, reads):
+        """Trials are loaded with one query per collection."""
+        trial_ids = []
+        for i in range(3):
+            trial = make_trial(i=i)
+            trial._tags.append('tag')
+            trial_ids.append(trial.id)
+
+        del reads[:]
+        trials = Trial.load_many(trial_ids[::-1] + ['missing'])
+        assert [trial.id for trial in trials] == trial_ids[::-1]
+        assert [trial.status for trial in trials] == ['new'] * 3
+        assert [trial.tags for trial in trials] == [['tag']] * 3
+        assert sorted(reads) == sorted(['trials.immutables', 'status', 'status.snapshots',
+                                        'tags', 'tags.snapshots'])
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.trial.columnar`."""
+
+import datetime
+
+import numpy
+import pytest
+
+from kleio.core.io.database import DuplicateKeyError
+from kleio.core.trial.base import Trial
+from kleio.core.trial.columnar import ColumnarStatisticsWithDB, StatisticColumns
+
+
+@pytest.fixture()
+def columns(ephemeral_db):
+    """Return enabled columnar statistics for trial 'abc'"""
+    columns = ColumnarStatisticsWithDB('abc', 'statistics')
+    columns.enable(chunk_size=3, max_delay=60)
+    return columns
+
+
+def test_chunks(ephemeral_db, columns):
+    """Rows are written in chunks of chunk_size per key."""
+    for i in range(7):
+        columns.append({'epoch': i, 'loss': 1.0 / (i + 1)})
+
+    assert ephemeral_db.count('statistics.columns') == 4
+    columns.flush()
+    assert ephemeral_db.count('statistics.columns') == 6
+
+    reloaded = ColumnarStatisticsWithDB('abc', 'statistics').get()
+    assert reloaded.keys() == ['epoch', 'loss']
+    assert reloaded.epoch.dtype == numpy.int64
+    numpy.testing.assert_equal(reloaded.epoch, numpy.arange(7))
+    numpy.testing.assert_allclose(reloaded['loss'], 1.0 / numpy.arange(1, 8))
+    numpy.testing.assert_equal(reloaded.column('loss').rows, numpy.arange(1, 8))
+
+
+def test_pending_rows_visible(columns):
+    """Rows not written yet are part of the columns of the writer."""
+    columns.append({'epoch': 1})
+    numpy.testing.assert_equal(columns.get().epoch, [1])
+
+
+def test_arrays_and_nested(columns):
+    """Values can be arrays and nested dictionaries are flattened."""
+    columns.append({'valid': {'confusion': numpy.eye(2)}})
+    columns.append({'valid': {'confusion': numpy.zeros((2, 2))}})
+    columns.flush()
+    confusion = ColumnarStatisticsWithDB('abc', 'statistics').get()['valid.confusion']
+    assert confusion.shape == (2, 2, 2)
+    numpy.testing.assert_equal(confusion[0], numpy.eye(2))
+
+
+def test_concurrent_writer(columns):
+    """Rows are written again once the chunks of another writer are fetched."""
+    columns.append({'epoch': 1})
+    other = ColumnarStatisticsWithDB('abc', 'statistics')
+    other.enable()
+    other.append({'epoch': 2})
+    other.flush()
+
+    with pytest.raises(DuplicateKeyError):
+        columns.flush()
+    columns.flush()
+
+    reloaded = ColumnarStatisticsWithDB('abc', 'statistics').get()
+    assert sorted(reloaded.epoch.tolist()) == [1, 2]
+
+
+def test_non_numeric(columns):
+    """Only numeric values can be stored as columns."""
+    with pytest.raises(TypeError):
+        columns.append({'name': 'abc'})
+
+
+def test_interval(columns):
+    """Rows outside the interval are filtered out."""
+    for i in range(5):
+        columns.append({'epoch': i}, timestamp=datetime.datetime(2000, 1, 1 + i))
+    columns.flush()
+
+    view = ColumnarStatisticsWithDB(
+        'abc', 'statistics', (None, datetime.datetime(2000, 1, 2))).get()
+    numpy.testing.assert_equal(view.epoch, [0, 1])
+
+
+def test_trial_statistics(ephemeral_db, make_trial):
+    """Trials use columns once enabled and events otherwise."""
+    trial = make_trial()
+    trial.add_statistic(epoch=1)
+    assert ephemeral_db.count('statistics') == 1
+    assert not trial._columns.exists()
+
+    other = make_trial(columnar=True, other=True)
+    other.add_statistic(epoch=1, loss=0.5)
+    other.add_statistic(epoch=2, loss=0.25)
+    other.flush()
+
+    assert ephemeral_db.count('statistics') == 1
+    statistics = Trial.load(other.id).statistics
+    assert statistics.to_dict() == {'epoch': [1, 2], 'loss': [0.5, 0.25]}
+
+
+def test_resume_with_events(ephemeral_db, make_trial):
+    """Columns enabled on a trial with event-based statistics follow them."""
+    trial = make_trial()
+    for epoch in range(1, 4):
+        trial.add_statistic(epoch=epoch, loss=float(epoch))
+
+    resumed = make_trial(columnar=True)
+    resumed.add_statistic(epoch=4, loss=4.0, creator='analysis')
+    resumed.flush()
+
+    statistics = trial.statistics
+    assert statistics.to_dict() == {'epoch': [1, 2, 3, 4], 'loss': [1.0, 2.0, 3.0, 4.0]}
+    numpy.testing.assert_equal(statistics.columns.column('epoch').rows, [1, 2, 3, 4])
+    assert trial.aggregate_statistics(['loss'], by='epoch').to_dict()['loss'] == [1, 2, 3, 4]
+    assert set(chunk['creator_id'] for chunk in ephemeral_db.read('statistics.columns')) == {
+        'analysis'}
+
+    bulk = Trial.fetch_statistics({'_id': trial.id}, ['epoch'])
+    numpy.testing.assert_equal(bulk['epoch'][0], [1, 2, 3, 4])
+
+
+def test_resume_without_loading(ephemeral_db, columns, monkeypatch):
+    """Writers only read the newest sequence number and row, not the chunks."""
+    # The chunk of loss is full first, so the newest chunk does not hold the last row
+    columns.chunk_size = 2
+    columns.append({'epoch': 0})
+    columns.append({'loss': 0.5})
+    columns.append({'loss': 0.25})
+    columns.flush()
+
+    reads = []
+    read = ephemeral_db.read
+
+    def spy_read(collection_name, *args, **kwargs):
+        documents = read(collection_name, *args, **kwargs)
+        reads.extend(documents)
+        return documents
+
+    monkeypatch.setattr(ephemeral_db, 'read', spy_read)
+    resumed = ColumnarStatisticsWithDB('abc', 'statistics')
+    resumed.enable(chunk_size=1)
+    resumed.append({'epoch': 1})
+    assert not resumed.loaded
+    assert len(reads) == 2
+    assert all('values' not in chunk for chunk in reads)
+
+    statistics = ColumnarStatisticsWithDB('abc', 'statistics').get()
+    numpy.testing.assert_equal(statistics.epoch, [0, 1])
+    numpy.testing.assert_equal(statistics.column('epoch').rows, [1, 4])
+    numpy.testing.assert_equal(statistics.column('loss').rows, [2, 3])
+    assert ephemeral_db.read('statistics.columns', {'seq': 3})[0]['key'] == 'epoch'
+
+
+def test_exists_cached(ephemeral_db, columns, monkeypatch):
+    """Existence of columns is only counted until they are found."""
+    columns.append({'epoch': 1})
+    columns.flush()
+
+    counts = []
+    count = ephemeral_db.count
+    monkeypatch.setattr(ephemeral_db, 'count', lambda *args: counts.append(args) or count(*args))
+    reader = ColumnarStatisticsWithDB('abc', 'statistics')
+    assert reader.exists()
+    assert reader.exists()
+    assert len(counts) == 1
+
+
+def test_concatenate_with_events():
+    """Columns of a parent built from events are followed by the ones of the child."""
+    events = [{'item': {'epoch': i}, 'runtime_timestamp': datetime.datetime(2000, 1, 1 + i)}
+              for i in range(2)]
+    parent = StatisticColumns.from_events(events)
+    child = StatisticColumns.from_events(events[1:])
+    statistics = parent + child
+    numpy.testing.assert_equal(statistics.epoch, [0, 1, 1])
+    numpy.testing.assert_equal(statistics.column('epoch').rows, [1, 2, 3])
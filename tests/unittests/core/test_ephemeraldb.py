@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 """Collection of tests for :mod:`kleio.core.io.database.ephemeraldb`."""
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pytest
 
@@ -257,7 +257,7 @@ class TestRemove(object):
         count_before = database['experiments'].count()
         count_filt = database['experiments'].count(filt)
         # call interface
-        assert kleio_db.remove('experiments', filt) is True
+        assert kleio_db.remove('experiments', filt) == count_filt
         assert database['experiments'].count() == count_before - count_filt
         assert database['experiments'].count() == 1
         assert list(database['experiments'].find()) == [exp_config[0][3]]
@@ -268,7 +268,7 @@ class TestRemove(object):
 
         count_before = database['experiments'].count()
         # call interface
-        assert kleio_db.remove('experiments', filt) is True
+        assert kleio_db.remove('experiments', filt) == 1
         assert database['experiments'].count() == count_before - 1
         assert database['experiments'].find() == exp_config[0][1:]
 
@@ -296,3 +296,119 @@ class TestCount(object):
         """Call with argument that will not find anything."""
         found = kleio_db.count('experiments', {'name': 'lalalanotfound'})
         assert found == 0
+
+
+class TestReadSortLimit(object):
+    """Calls to :meth:`kleio.core.io.database.ephemeraldb.EphemeralDB.read` with sort or limit."""
+
+    def test_sort(self, kleio_db):
+        """Documents are sorted on successive keys."""
+        kleio_db.write('events', [{'a': 1, 'b': 2}, {'a': 0, 'b': 1}, {'a': 1, 'b': 1}])
+        documents = kleio_db.read('events', selection={'a': 1, 'b': 1, '_id': 0},
+                                  sort=[('a', Database.DESCENDING), ('b', Database.ASCENDING)])
+        assert documents == [{'a': 1, 'b': 1}, {'a': 1, 'b': 2}, {'a': 0, 'b': 1}]
+
+    def test_limit(self, kleio_db):
+        """Only the first documents are returned."""
+        kleio_db.write('events', [{'_id': i, 'a': i} for i in range(5)])
+        documents = kleio_db.read('events', {'a': {'$gt': 0, '$lte': 3}},
+                                  sort=[('a', Database.ASCENDING)], limit=2)
+        assert [document['a'] for document in documents] == [1, 2]
+
+
+class TestAggregate(object):
+    """Calls to :meth:`kleio.core.io.database.ephemeraldb.EphemeralDB.aggregate`."""
+
+    def test_match_group_sort(self, kleio_db):
+        """Documents are filtered, grouped and sorted."""
+        kleio_db.write('events', [{'seq': i, 'item': {'epoch': i // 3, 'loss': float(i)}}
+                                  for i in range(1, 10)])
+        documents = kleio_db.aggregate('events', [
+            {'$match': {'seq': {'$gt': 1}}},
+            {'$group': {'_id': '$item.epoch',
+                        'last': {'$last': '$item.loss'},
+                        'min': {'$min': '$item.loss'},
+                        'mean': {'$avg': '$item.loss'}}},
+            {'$sort': {'_id': -1}}])
+        assert documents == [
+            {'_id': 3, 'last': 9.0, 'min': 9.0, 'mean': 9.0},
+            {'_id': 2, 'last': 8.0, 'min': 6.0, 'mean': 7.0},
+            {'_id': 1, 'last': 5.0, 'min': 3.0, 'mean': 4.0},
+            {'_id': 0, 'last': 2.0, 'min': 2.0, 'mean': 2.0}]
+
+    def test_match_or(self, kleio_db):
+        """Documents can match any of several clauses."""
+        kleio_db.write('events', [{'trial_id': trial_id, 'seq': seq}
+                                  for trial_id in 'abc' for seq in range(3)])
+        documents = kleio_db.aggregate('events', [
+            {'$match': {'seq': {'$gt': 0},
+                        '$or': [{'trial_id': 'a'}, {'trial_id': 'b', 'seq': {'$gt': 1}}]}},
+            {'$project': {'_id': 0, 'trial_id': 1, 'seq': 1}}])
+        assert documents == [{'trial_id': 'a', 'seq': 1}, {'trial_id': 'a', 'seq': 2},
+                             {'trial_id': 'b', 'seq': 2}]
+
+    def test_first_root(self, kleio_db):
+        """Whole documents can be accumulated with $$ROOT."""
+        kleio_db.write('events', [{'trial_id': trial_id, 'seq': seq}
+                                  for trial_id in 'ab' for seq in range(3)])
+        documents = kleio_db.aggregate('events', [
+            {'$sort': {'trial_id': 1, 'seq': -1}},
+            {'$group': {'_id': '$trial_id', 'last': {'$first': '$$ROOT'}}},
+            {'$project': {'_id': 1, 'seq': '$last.seq'}}])
+        assert documents == [{'_id': 'a', 'seq': 2}, {'_id': 'b', 'seq': 2}]
+
+    def test_expr(self, kleio_db):
+        """Expressions can be used in matches."""
+        kleio_db.write('events', [{'seq': i} for i in range(1, 10)])
+        documents = kleio_db.aggregate('events', [
+            {'$match': {'$expr': {'$eq': [{'$mod': ['$seq', 4]}, 0]}}},
+            {'$project': {'_id': 0, 'seq': 1}}])
+        assert documents == [{'seq': 4}, {'seq': 8}]
+
+    def test_time_buckets(self, kleio_db):
+        """Dates can be truncated with $subtract, $mod and $toLong."""
+        start = datetime(2000, 1, 1)
+        kleio_db.write('events', [{'timestamp': start + timedelta(seconds=i)}
+                                  for i in range(5)])
+        documents = kleio_db.aggregate('events', [
+            {'$group': {'_id': {'$subtract': [
+                '$timestamp', {'$mod': [{'$toLong': '$timestamp'}, 2000]}]},
+                        'count': {'$sum': 1}}}])
+        assert documents == [
+            {'_id': start, 'count': 2},
+            {'_id': start + timedelta(seconds=2), 'count': 2},
+            {'_id': start + timedelta(seconds=4), 'count': 1}]
+
+    def test_time_buckets_same_second(self, kleio_db):
+        """Dates within the same bucket are grouped whatever their microseconds."""
+        start = datetime(2000, 1, 1)
+        kleio_db.write('events', [{'timestamp': start + timedelta(microseconds=i * 123457)}
+                                  for i in range(8)])
+        documents = kleio_db.aggregate('events', [
+            {'$group': {'_id': {'$subtract': [
+                '$timestamp', {'$mod': [{'$toLong': '$timestamp'}, 1000]}]},
+                        'count': {'$sum': 1}}}])
+        assert documents == [{'_id': start, 'count': 8}]
+
+
+class TestWatch(object):
+    """Calls to :meth:`kleio.core.io.database.ephemeraldb.EphemeralDB.watch`."""
+
+    def test_not_supported(self, kleio_db):
+        """Change streams are not supported, callers must poll instead."""
+        with pytest.raises(NotImplementedError):
+            kleio_db.watch(['stdout'], {'trial_id': 'abc'})
+
+
+class TestUpdateOperators(object):
+    """Update operators of :meth:`kleio.core.io.database.ephemeraldb.EphemeralDB.write`."""
+
+    def test_inc_and_set_on_insert(self, kleio_db):
+        """$inc adds to existing values and $setOnInsert is only applied on insertion."""
+        update = {'$inc': {'count': 1}, '$setOnInsert': {'first': True}}
+        kleio_db.write('counters', update, query={'_id': 'a'})
+        assert kleio_db.read('counters') == [{'_id': 'a', 'count': 1, 'first': True}]
+
+        update = {'$inc': {'count': 2}, '$setOnInsert': {'first': False}}
+        kleio_db.write('counters', update, query={'_id': 'a'})
+        assert kleio_db.read('counters') == [{'_id': 'a', 'count': 3, 'first': True}]
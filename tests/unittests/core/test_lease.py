@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for leases of :class:`kleio.core.trial.base.Trial`."""
+
+import datetime
+
+import pytest
+
+from kleio.core.trial.base import Trial
+
+
+def test_running_acquires_lease(running_trial):
+    """Switching to running creates the lease."""
+    lease = running_trial.lease
+    assert lease['_id'] == running_trial.id
+    assert lease['expires_at'] - lease['last_seen'] == datetime.timedelta(
+        seconds=Trial.lease_coefficient * Trial.heartbeat_rate)
+
+
+def test_heartbeat_does_not_add_status_events(ephemeral_db, running_trial):
+    """Heartbeats update the lease in place."""
+    n_events = ephemeral_db.count('status')
+    last_seen = running_trial.lease['last_seen']
+    running_trial.heartbeat(lease_duration=30)
+    running_trial.heartbeat(lease_duration=30)
+    assert ephemeral_db.count('status') == n_events
+    assert ephemeral_db.count(Trial.trial_lease_collection) == 1
+    lease = running_trial.lease
+    assert lease['last_seen'] >= last_seen
+    assert lease['expires_at'] - lease['last_seen'] == datetime.timedelta(seconds=30)
+
+
+def test_end_time_last_heartbeat(ephemeral_db, running_trial):
+    """End time of running trials and of their report is the last heartbeat."""
+    running_trial.save()
+    start_time = running_trial.end_time
+    running_trial.heartbeat()
+    last_seen = running_trial.lease['last_seen']
+    assert running_trial.end_time == last_seen >= start_time
+
+    running_trial.save()
+    report = ephemeral_db.read(Trial.trial_report_collection, {'_id': running_trial.id})[0]
+    assert report['registry']['end_time'] == last_seen
+
+    running_trial.complete()
+    assert running_trial.end_time >= last_seen
+
+
+def test_heartbeat_status_changed(running_trial):
+    """Heartbeat fails if the status was changed by another process."""
+    Trial.load(running_trial.id).suspend()
+    with pytest.raises(RuntimeError) as exc:
+        running_trial.heartbeat()
+    assert "Heartbeat failed" in str(exc.value)
+
+
+def test_lease_released(running_trial):
+    """Leaving running status releases the lease."""
+    running_trial.complete()
+    assert running_trial.lease is None
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for reports of :class:`kleio.core.trial.base.Trial`."""
+
+import pytest
+
+from kleio.core.io.database import Database
+from kleio.core.trial.base import Trial
+
+
+@pytest.fixture()
+def report_writes(ephemeral_db, monkeypatch):
+    """Record updates written to the reports"""
+    writes = []
+    write = ephemeral_db.write
+
+    def recording_write(collection_name, data, query=None):
+        if collection_name == Trial.trial_report_collection:
+            writes.append(data)
+        return write(collection_name, data, query=query)
+
+    monkeypatch.setattr(ephemeral_db, 'write', recording_write)
+    return writes
+
+
+@pytest.fixture()
+def trial(ephemeral_db):
+    """Return a new trial"""
+    return Trial(commandline=['python', 'script.py'], configuration={'a': 1},
+                 version={'sha': 'abc'}, refers={}, host={'cpu': 'x' * 1000})
+
+
+def _read_report(trial):
+    return Database().read(Trial.trial_report_collection, {'_id': trial.id})[0]
+
+
+def test_first_save(trial, report_writes):
+    """Immutable fields are written when the report is created."""
+    trial.save()
+    assert len(report_writes) == 1
+    assert set(report_writes[0]['$setOnInsert']) == set(
+        ['refers', 'commandline', 'configuration', 'version', 'host'])
+
+    report = _read_report(trial)
+    assert report['configuration'] == {'a': 1}
+    assert report['host'] == {'cpu': 'x' * 1000}
+    assert report['registry']['status'] == 'new'
+
+
+def test_save_changes_only(trial, report_writes):
+    """Only fields which changed are written, and nothing if none changed."""
+    trial.save()
+    trial.save()
+    assert len(report_writes) == 1
+
+    trial.reserve()
+    trial.save()
+    assert list(report_writes[-1]) == ['$set']
+    assert report_writes[-1]['$set']['registry.status'] == 'reserved'
+    assert 'tags' not in report_writes[-1]['$set']
+
+    report = _read_report(trial)
+    assert report['registry']['status'] == 'reserved'
+    assert report['host'] == {'cpu': 'x' * 1000}
+
+
+def test_save_new_tag(trial, report_writes):
+    """Tags added after the first save are written."""
+    trial.save()
+    trial._tags.append('tag')
+    trial.save()
+    assert report_writes[-1] == {'$set': {'tags': ['tag']}}
+    assert _read_report(trial)['tags'] == ['tag']
+
+
+def test_save_loaded_trial(trial):
+    """Saving a trial loaded from the database does not overwrite immutable fields."""
+    trial.save()
+    loaded = Trial.load(trial.id)
+    loaded.reserve()
+    loaded.save()
+
+    report = _read_report(trial)
+    assert report['registry']['status'] == 'reserved'
+    assert report['commandline'] == ['python', 'script.py']
+
+
+def test_save_loaded_trial_mutable_only(trial, report_writes):
+    """Trials loaded from the database only send mutable fields."""
+    trial.save()
+    loaded = Trial.load(trial.id)
+    loaded.reserve()
+    del report_writes[:]
+    loaded.save()
+    assert len(report_writes) == 1
+    assert list(report_writes[0]) == ['$set']
+    assert report_writes[0]['$set']['registry.status'] == 'reserved'
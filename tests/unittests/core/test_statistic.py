@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.trial.statistic`."""
+
+import datetime
+
+import numpy
+import pytest
+
+from kleio.core.trial.base import Trial
+from kleio.core.trial.statistic import Statistics
+
+
+@pytest.fixture()
+def statistics():
+    """Return statistics of 5 epochs with 2 mini-batches each and a validation per epoch"""
+    history = []
+    timestamp = datetime.datetime(2000, 1, 1)
+    for epoch in range(1, 6):
+        for batch in range(2):
+            history.append({'item': {'epoch': epoch, 'batch': batch, 'loss': epoch + batch / 10.},
+                            'runtime_timestamp': timestamp})
+        history.append({'item': {'epoch': epoch, 'valid': {'loss': float(epoch)}},
+                        'runtime_timestamp': timestamp})
+
+    return Statistics(history)
+
+
+def test_group_by(statistics):
+    """Attribute access groups rows by values."""
+    assert statistics.epoch.keys() == [1, 2, 3, 4, 5]
+    assert statistics.epoch[2].batch[1].to_dict() == {'loss': [2.1]}
+    assert statistics.epoch[2].batch.to_dict() == {0: {'loss': [2.0]}, 1: {'loss': [2.1]}}
+    assert statistics.epoch[2].loss.keys() == [2.0, 2.1]
+
+
+def test_nested(statistics):
+    """Nested dictionaries are selected with attributes."""
+    assert statistics.valid.to_dict() == {'epoch': [1, 2, 3, 4, 5],
+                                          'loss': [1.0, 2.0, 3.0, 4.0, 5.0]}
+    assert statistics.epoch[3].valid.to_dict() == {'loss': [3.0]}
+
+
+def test_negative_index_and_slices(statistics):
+    """Negative indexes and slices are positions in sorted values."""
+    assert statistics.epoch[-1].valid.to_dict() == {'loss': [5.0]}
+    assert statistics.epoch[-2:].keys() == [4, 5]
+    with pytest.raises(KeyError):
+        statistics.epoch[6]
+
+
+def test_where(statistics):
+    """Predicates filter rows."""
+    late = statistics.where(statistics.epoch > 3)
+    assert late.epoch.keys() == [4, 5]
+    numpy.testing.assert_equal(late.valid.epoch.values, [4, 5])
+
+    middle = statistics.where((statistics.epoch >= 2) & ~(statistics.epoch == 3))
+    assert middle.epoch.keys() == [2, 4, 5]
+    assert len(statistics.where(statistics.batch == 1)) == 5
+
+
+def test_values(statistics):
+    """Values of a statistic are NumPy arrays in row order."""
+    numpy.testing.assert_equal(numpy.asarray(statistics.valid.loss), numpy.arange(1, 6))
+
+
+def test_rows(statistics):
+    """Rows can be accessed by position."""
+    assert statistics[0] == {'epoch': 1, 'batch': 0, 'loss': 1.0}
+    assert statistics[-1] == {'epoch': 5, 'valid': {'loss': 5.0}}
+    assert len(statistics[:3]) == 3
+
+
+def test_to_dict(statistics):
+    """Statistics are converted to lists of values per key."""
+    assert statistics.epoch[1].to_dict() == {'batch': [0, 1], 'loss': [1.0, 1.1],
+                                             'valid': {'loss': [1.0]}}
+    assert statistics.attributes() == {'epoch', 'batch', 'loss', 'valid'}
+
+
+def test_getitem_key(statistics):
+    """Statistics can be grouped with item access as well."""
+    assert statistics['epoch'][2].valid.to_dict() == {'loss': [2.0]}
+
+
+def log_steps(trial):
+    """Log 12 steps of 3 epochs, one second apart"""
+    for step in range(1, 13):
+        trial.add_statistic(epoch=(step - 1) // 4, loss=float(step),
+                            timestamp=datetime.datetime(2000, 1, 1, 0, 0, step))
+    trial.flush()
+    return trial
+
+
+@pytest.fixture()
+def trial(make_trial, columnar):
+    """Return a trial which logged 12 steps, as events or as columns"""
+    return log_steps(make_trial(columnar=columnar))
+
+
+@pytest.mark.parametrize('reducer,expected', [
+    ('last', [4.0, 8.0, 12.0]), ('first', [1.0, 5.0, 9.0]), ('min', [1.0, 5.0, 9.0]),
+    ('max', [4.0, 8.0, 12.0]), ('mean', [2.5, 6.5, 10.5])])
+def test_aggregate_by(trial, reducer, expected):
+    """Statistics are reduced per bucket of a statistic."""
+    statistics = trial.aggregate_statistics(['loss'], by='epoch', reducer=reducer)
+    assert statistics.to_dict() == {'epoch': [0, 1, 2], 'loss': expected}
+    assert statistics.epoch[1].to_dict() == {'loss': [expected[1]]}
+
+
+def test_aggregate_every(trial):
+    """Every-Nth downsampling is based on the sequence of calls."""
+    statistics = trial.aggregate_statistics(['loss', 'epoch'], every=5)
+    assert statistics.to_dict() == {'row': [5, 10], 'loss': [5.0, 10.0], 'epoch': [1, 2]}
+
+
+def test_aggregate_time_bucket(trial):
+    """Statistics are reduced per time bucket."""
+    statistics = trial.aggregate_statistics(['loss'], reducer='max', time_bucket=5)
+    assert statistics.to_dict()['loss'] == [4.0, 9.0, 12.0]
+    assert statistics.to_dict()['runtime_timestamp'][1] == datetime.datetime(2000, 1, 1, 0, 0, 5)
+
+
+def test_aggregate_time_bucket_same_second(make_trial, columnar):
+    """Events within the same second fall in a single bucket of one second."""
+    trial = make_trial(columnar=columnar)
+    for step in range(6):
+        trial.add_statistic(loss=float(step), timestamp=datetime.datetime(
+            2000, 1, 1, 0, 0, step // 3, 123457 * (step % 3)))
+    trial.flush()
+
+    statistics = trial.aggregate_statistics(['loss'], reducer='max', time_bucket=1)
+    assert statistics.to_dict()['loss'] == [2.0, 5.0]
+
+
+def test_fetch_statistics(make_trial):
+    """Statistics of many trials are fetched aligned on their ids."""
+    trials = [log_steps(make_trial(columnar=columnar, run=run))
+              for run, columnar in enumerate([False, True])]
+    other = make_trial(other=True)
+
+    statistics = Trial.fetch_statistics({'configuration.run': {'$in': [0, 1]}}, ['loss', 'epoch'])
+    assert statistics.trial_ids == sorted(trial.id for trial in trials)
+    assert [array.tolist() for array in statistics['loss']] == [
+        [float(step) for step in range(1, 13)]] * 2
+    assert statistics.stack('epoch').shape == (2, 12)
+    assert statistics.statistics(trials[1].id).epoch[2].to_dict() == {
+        'loss': [9.0, 10.0, 11.0, 12.0]}
+
+    statistics = Trial.fetch_statistics({'configuration.other': True}, ['loss'])
+    assert statistics.trial_ids == [other.id]
+    assert statistics['loss'][0].tolist() == []
+    assert numpy.isnan(statistics.stack('loss', fill=numpy.nan)).all()
+
+
+def test_fetch_compressed_statistics(make_trial, monkeypatch):
+    """Large statistics are compressed and still fetched."""
+    monkeypatch.setattr(Trial, 'statistics_compression_threshold', 10)
+    trial = make_trial(compressed=True)
+    trial.add_statistic(epoch=1, loss=0.5, weights=list(range(100)))
+
+    statistics = Trial.fetch_statistics({'_id': trial.id}, ['epoch', 'loss'])
+    assert statistics['loss'][0].tolist() == [0.5]
+    assert statistics.keys() == ['epoch', 'loss']
@@ -2,9 +2,11 @@
 # -*- coding: utf-8 -*-
 """Test base functionalities of :mod:`kleio.core.utils`."""
 
+import datetime
+
 import pytest
 
-from kleio.core.utils import Factory
+from kleio.core.utils import canonical_digest, canonical_str, Factory, sorteddict
 
 
 def test_factory_subclasses_detection():
@@ -46,3 +48,23 @@ def test_factory_subclasses_detection():
     with pytest.raises(NotImplementedError) as exc_info:
         MyFactory(of_type="random")
     assert "Could not find implementation of Base, type = 'random'" in str(exc_info.value)
+
+
+@pytest.mark.parametrize('value,expected', [
+    ({}, "{}"),
+    ({'b': 1, 'a': 'x', 'c': None}, "{a: x, b: 1, c: None}"),
+    ({'z': {'y': [1, 'a', (2, 3)], 'x': 0.1}, 'a': [{'d': 'e', 'c': True}, []]},
+     "{a: [{c: True, d: e}, []], z: {x: 0.1, y: [1, 'a', [2, 3]]}}"),
+    (['python', 'script.py', '--lr=0.1'], "['python', 'script.py', '--lr=0.1']"),
+    ({'parent_id': None, 'timestamp': datetime.datetime(2000, 1, 1, 12, 30)},
+     "{parent_id: None, timestamp: 2000-01-01 12:30:00}")])
+def test_canonical_str(value, expected):
+    """Canonical strings are identical to the strings trial ids were computed on."""
+    assert canonical_str(value) == expected
+    assert str(sorteddict(value)) == expected
+
+
+def test_canonical_digest():
+    """Digests do not depend on the order of keys."""
+    assert canonical_digest({'a': 1, 'b': [1, 2]}) == canonical_digest({'b': [1, 2], 'a': 1})
+    assert canonical_digest({'a': 1}) != canonical_digest({'a': 2})
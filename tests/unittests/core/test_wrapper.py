@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Collection of tests for :mod:`kleio.core.wrapper`."""
+import asyncio
+import datetime
+import sys
+import time
+
+import pytest
+
+from kleio.core import wrapper
+from kleio.core.trial.attribute import EventBasedListAttributeWithDB
+from kleio.core.trial.base import Trial
+
+
+@pytest.fixture()
+def stdout(ephemeral_db):
+    """Return an empty stdout attribute"""
+    return EventBasedListAttributeWithDB('abc', 'stdout')
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    """Replace the time of the chunkers by a clock set manually"""
+    clock = [0.]
+    monkeypatch.setattr(wrapper.time, 'time', lambda: clock[0])
+    return clock
+
+
+def saved_blocks(trial_id='abc'):
+    """Return the blocks of lines saved as events"""
+    reloaded = EventBasedListAttributeWithDB(trial_id, 'stdout').load()
+    return [event['item'] for event in reloaded.history]
+
+
+class TestLogChunker(object):
+    """Test grouping of lines in blocks"""
+
+    def test_size_flush(self, stdout, clock):
+        """Blocks are written once they reach `max_bytes`, newlines included."""
+        chunker = wrapper.LogChunker(stdout, max_bytes=8, max_delay=60)
+        for i in range(5):
+            chunker.append('ab{}'.format(i))
+
+        assert saved_blocks() == [['ab0', 'ab1'], ['ab2', 'ab3']]
+        assert chunker.lines == ['ab4']
+        assert chunker.nbytes == 4
+
+    def test_time_flush(self, stdout, clock):
+        """Blocks are written when a line arrives after their first one waited `max_delay`."""
+        chunker = wrapper.LogChunker(stdout, max_bytes=2 ** 16, max_delay=1.0)
+        chunker.append('a')
+        clock[0] = 0.5
+        chunker.append('b')
+        assert not chunker.is_due()
+        assert saved_blocks() == []
+
+        clock[0] = 1.0
+        assert chunker.is_due()
+        chunker.append('c')
+        assert saved_blocks() == [['a', 'b', 'c']]
+        assert not chunker.is_due()
+
+    def test_timestamps(self, stdout, clock):
+        """Blocks record the runtime timestamps of their first and last lines, not of the flush."""
+        chunker = wrapper.LogChunker(stdout)
+        chunker.append('a')
+        chunker.append('b')
+        appended = datetime.datetime.utcnow()
+        time.sleep(0.01)
+        chunker.flush()
+        event, = EventBasedListAttributeWithDB('abc', 'stdout').load().history
+        assert event['first_runtime_timestamp'] <= event['runtime_timestamp'] <= appended
+        assert list(stdout.iter_pages()) == [['a', 'b']]
+
+    def test_flush_empty(self, stdout):
+        """Nothing is written without pending lines."""
+        wrapper.LogChunker(stdout).flush()
+        assert saved_blocks() == []
+
+    def test_flush_logs(self, stdout):
+        """Blocks of quiet streams are written by the flushing task."""
+        chunker = wrapper.LogChunker(stdout, max_delay=0.01)
+        chunker.append('a')
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            task = asyncio.ensure_future(wrapper.flush_logs([chunker], 0.01), loop=loop)
+            loop.run_until_complete(asyncio.sleep(0.1))
+            task.cancel()
+            loop.run_until_complete(task)
+        finally:
+            loop.close()
+
+        assert saved_blocks() == [['a']]
+        assert chunker.lines == []
+
+
+def test_final_flush(ephemeral_db, tmpdir):
+    """Lines still pending in the chunkers are written when the process exits."""
+    script = tmpdir.join('script.py')
+    script.write("print('line 0')\nprint('line 1')\n")
+    trial = Trial.build(commandline=[sys.executable, str(script)], configuration={},
+                        version={}, refers={'parent_id': None, 'timestamp': None}, host={})
+
+    returncode = wrapper.execute(trial, str(tmpdir), {}, capture=True, sleep_time=60,
+                                 chunk_delay=60)
+
+    assert returncode == 0
+    assert saved_blocks(trial.id) == [['line 0', 'line 1']]